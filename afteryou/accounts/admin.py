@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
-from .models import User
+from .models import SweepCheckpoint, SweepPartition, User
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
@@ -20,3 +20,16 @@ class CustomUserAdmin(UserAdmin):
             'fields': ('email', 'role', 'bio', 'profile_image')
         }),
     )
+
+
+@admin.register(SweepCheckpoint)
+class SweepCheckpointAdmin(admin.ModelAdmin):
+    list_display = ('name', 'watermark', 'updated_at')
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(SweepPartition)
+class SweepPartitionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'run_at', 'lower_id', 'upper_id', 'cursor', 'notified', 'triggered', 'completed_at')
+    list_filter = ('name',)
+    readonly_fields = ('updated_at',)
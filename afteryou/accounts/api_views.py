@@ -7,10 +7,11 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.utils.timezone import now
-from datetime import timedelta
 from django.db import connection
 from django.views.decorators.csrf import csrf_exempt
 from .models import User
+from .check_ins import record_check_in
+from .status_snapshot import check_in_state, get_status_snapshot
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
@@ -146,15 +147,7 @@ def logout_api(request):
 def user_profile_api(request):
     try:
         user = request.user
-        current_time = now()
-        months_in_days = 30 * user.check_in_interval_months
-        next_check_in_due = user.last_check_in + timedelta(days=months_in_days)
-        is_overdue = current_time > next_check_in_due
-        in_grace_period = False
-        grace_period_end = None
-        if user.notification_sent_at:
-            grace_period_end = user.notification_sent_at + timedelta(days=user.grace_period_days)
-            in_grace_period = current_time < grace_period_end
+        snapshot = get_status_snapshot(user)
         return Response({
             'user': {
                 'id': user.id,
@@ -164,16 +157,7 @@ def user_profile_api(request):
                 'last_name': user.last_name,
                 'role': 'admin' if user.is_superuser else 'user',
             },
-            'dead_mans_switch': {
-                'last_check_in': user.last_check_in.isoformat() if user.last_check_in else None,
-                'next_check_in_due': next_check_in_due.isoformat(),
-                'check_in_interval_months': user.check_in_interval_months,
-                'grace_period_days': user.grace_period_days,
-                'is_overdue': is_overdue,
-                'notification_sent_at': user.notification_sent_at.isoformat() if user.notification_sent_at else None,
-                'in_grace_period': in_grace_period,
-                'grace_period_end': grace_period_end.isoformat() if grace_period_end else None,
-            }
+            'dead_mans_switch': check_in_state(snapshot)
         }, status=status.HTTP_200_OK)
     except Exception as e:
         return Response(
@@ -186,40 +170,21 @@ def user_profile_api(request):
 def dashboard_stats_api(request):
     try:
         user = request.user
-        current_time = now()
-        months_in_days = 30 * user.check_in_interval_months
-        next_check_in_due = user.last_check_in + timedelta(days=months_in_days)
-        is_overdue = current_time > next_check_in_due
-        in_grace_period = False
-        if user.notification_sent_at:
-            grace_period_end = user.notification_sent_at + timedelta(days=user.grace_period_days)
-            in_grace_period = current_time < grace_period_end
-        try:
-            from legacy.models import LegacyMessage
-            scheduled_messages = LegacyMessage.objects.filter(user=user, status='scheduled').count()
-            total_messages = LegacyMessage.objects.filter(user=user).count()
-        except:
-            scheduled_messages = 0
-            total_messages = 0
-        try:
-            from legacy.digital_locker_models import DigitalLocker
-            digital_lockers = DigitalLocker.objects.filter(user=user).count()
-        except:
-            digital_lockers = 0
+        snapshot = get_status_snapshot(user)
+        state = check_in_state(snapshot)
+        messages = snapshot['messages'] or {}
         return Response({
             'check_in_status': {
-                'last_check_in': user.last_check_in.isoformat() if user.last_check_in else None,
-                'next_check_in_due': next_check_in_due.isoformat(),
-                'is_overdue': is_overdue,
-                'in_grace_period': in_grace_period,
-                'check_in_interval_months': user.check_in_interval_months,
-                'grace_period_days': user.grace_period_days,
+                field: state[field] for field in (
+                    'last_check_in', 'next_check_in_due', 'is_overdue', 'in_grace_period',
+                    'check_in_interval_months', 'grace_period_days',
+                )
             },
             'messages': {
-                'scheduled': scheduled_messages,
-                'total': total_messages,
+                'scheduled': messages.get('scheduled', 0),
+                'total': messages.get('total', 0),
             },
-            'digital_lockers': digital_lockers,
+            'digital_lockers': snapshot['digital_lockers'],
             'user_info': {
                 'username': user.username,
                 'email': user.email,
@@ -373,39 +338,19 @@ def job_status_api(request, job_id):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def api_check_in_status(request):
-    user = request.user
-    current_time = now()
-    months_in_days = 30 * getattr(user, 'check_in_interval_months', 6)
-    next_check_in_due = user.last_check_in + timedelta(days=months_in_days)
-    is_overdue = current_time > next_check_in_due
-    in_grace_period = False
-    grace_period_end = None
-    if user.notification_sent_at:
-        grace_period_end = user.notification_sent_at + timedelta(days=getattr(user, 'grace_period_days', 10))
-        in_grace_period = current_time < grace_period_end
-    return Response({
-        'last_check_in': user.last_check_in.isoformat() if user.last_check_in else None,
-        'next_check_in_due': next_check_in_due.isoformat() if next_check_in_due else None,
-        'check_in_interval_months': getattr(user, 'check_in_interval_months', 6),
-        'grace_period_days': getattr(user, 'grace_period_days', 10),
-        'is_overdue': is_overdue,
-        'notification_sent_at': user.notification_sent_at.isoformat() if user.notification_sent_at else None,
-        'in_grace_period': in_grace_period,
-        'grace_period_end': grace_period_end.isoformat() if grace_period_end else None,
-        'scheduled_messages_count': user.legacymessage_set.filter(status='scheduled').count() if hasattr(user, 'legacymessage_set') else 0
-    })
+    snapshot = get_status_snapshot(request.user)
+    status_data = check_in_state(snapshot)
+    status_data['scheduled_messages_count'] = (snapshot['messages'] or {}).get('scheduled', 0)
+    return Response(status_data)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def api_check_in(request):
     user = request.user
-    user.last_check_in = now()
-    user.notification_sent_at = None
-    user.save()
-    months_in_days = 30 * getattr(user, 'check_in_interval_months', 6)
+    record_check_in(user)
     return Response({
         'success': True,
         'message': 'Check-in successful! Your timer has been reset.',
         'last_check_in': user.last_check_in.isoformat(),
-        'next_check_in_due': (now() + timedelta(days=months_in_days)).isoformat()
+        'next_check_in_due': user.next_check_in_due.isoformat()
     })
@@ -0,0 +1,195 @@
+"""
+Write-behind check-ins
+
+Clients that check in on every app open would otherwise write the user row
+each time. With ``CHECK_INS['WRITE_BEHIND']`` enabled, a check-in from a user
+far from any deadline only records its time in a Redis hash; the
+``flush_pending_check_ins`` task writes the hash to the database every
+``FLUSH_SECONDS`` with one ``bulk_update`` per batch.
+
+A user within ``DEADLINE_MARGIN_HOURS`` of the check-in deadline, or already
+reminded, is written through immediately, and the dead man's switch flushes
+pending check-ins before it evaluates anyone, so it never acts on a stale
+``last_check_in``. If Redis is unavailable check-ins are written through.
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+from django.conf import settings
+from django.utils.timezone import now
+from legacy.task_backends import get_shared_redis_connection
+from .deadline_timers import publish_deadline_change
+from .models import User
+from .status_snapshot import invalidate_status_snapshot
+
+logger = logging.getLogger(__name__)
+
+PENDING_KEY = 'afteryou:check_ins:pending'
+
+DEFAULT_CHECK_IN_SETTINGS = {
+    'WRITE_BEHIND': False,  # Buffer check-ins in Redis instead of writing each one
+    'FLUSH_SECONDS': 60,  # Cadence of the flush task
+    'FLUSH_BATCH_SIZE': 1000,  # Users written per bulk_update
+    'DEADLINE_MARGIN_HOURS': 72,  # Closer than this to the deadline, write through
+}
+
+# Only delete a hash entry if no newer check-in replaced it during the flush
+DELETE_IF_UNCHANGED_SCRIPT = """
+if redis.call('hget', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('hdel', KEYS[1], ARGV[1])
+end
+return 0
+"""
+
+CHECK_IN_FIELDS = ['last_check_in', 'notification_sent_at', 'next_check_in_due', 'grace_expires_at']
+
+
+def get_check_in_settings():
+    """Get check-in settings merged over the defaults"""
+    config = dict(DEFAULT_CHECK_IN_SETTINGS)
+    config.update(getattr(settings, 'CHECK_INS', {}))
+    return config
+
+
+def record_check_in(user, when=None):
+    """
+    Record a check-in, buffering it in Redis when the user is far from a deadline
+
+    The user object is updated in memory either way, so callers can report
+    the new deadline straight away.
+
+    Args:
+        user (User): User checking in
+        when (datetime): Time of the check-in, defaults to now
+
+    Returns:
+        bool: True if the check-in was buffered rather than written
+    """
+    when = when or now()
+    config = get_check_in_settings()
+    margin = timedelta(hours=config['DEADLINE_MARGIN_HOURS'])
+    user.last_check_in = when
+
+    if (config['WRITE_BEHIND'] and user.notification_sent_at is None
+            and user.next_check_in_due and user.next_check_in_due - when > margin):
+        try:
+            get_shared_redis_connection().hset(PENDING_KEY, user.pk, when.timestamp())
+            user.refresh_deadlines()
+            invalidate_status_snapshot(user.pk)
+            return True
+        except Exception as e:
+            logger.warning(f"Could not buffer check-in of user {user.pk}, writing through: {str(e)}")
+
+    user.notification_sent_at = None
+    user.save(update_fields=['last_check_in', 'notification_sent_at'])
+    if config['WRITE_BEHIND']:
+        try:
+            # An older buffered check-in must not be flushed over this one
+            get_shared_redis_connection().hdel(PENDING_KEY, user.pk)
+        except Exception as e:
+            logger.warning(f"Could not clear buffered check-in of user {user.pk}: {str(e)}")
+    invalidate_status_snapshot(user.pk)
+    publish_deadline_change(user)
+    return False
+
+
+def _parse_entries(entries):
+    pending = {}
+    for user_id, raw in entries:
+        if raw is None:
+            continue
+        pending[int(user_id)] = raw
+    return pending
+
+
+def get_pending_check_in(user):
+    """Time of the user's buffered check-in, or None"""
+    if not get_check_in_settings()['WRITE_BEHIND']:
+        return None
+    try:
+        raw = get_shared_redis_connection().hget(PENDING_KEY, user.pk)
+    except Exception as e:
+        logger.warning(f"Could not read buffered check-in of user {user.pk}: {str(e)}")
+        return None
+    if raw is None:
+        return None
+    return datetime.fromtimestamp(float(raw), tz=timezone.utc)
+
+
+def apply_pending_check_in(user):
+    """
+    Overlay a buffered check-in on a user loaded from the database
+
+    Used by the status endpoints so a user sees their latest check-in before
+    it has been flushed.
+    """
+    pending = get_pending_check_in(user)
+    if pending is not None and (user.last_check_in is None or pending > user.last_check_in):
+        user.last_check_in = pending
+        user.notification_sent_at = None
+        user.refresh_deadlines()
+    return user
+
+
+def flush_check_ins(user_ids=None, batch_size=None):
+    """
+    Write buffered check-ins to the database
+
+    Args:
+        user_ids (list): Only flush these users, defaults to every buffered check-in
+        batch_size (int): Users per bulk_update, defaults to FLUSH_BATCH_SIZE
+
+    Returns:
+        dict: Number of check-ins 'flushed' and 'pending' before the flush
+    """
+    config = get_check_in_settings()
+    batch_size = batch_size or config['FLUSH_BATCH_SIZE']
+    connection = get_shared_redis_connection()
+
+    if user_ids is None:
+        pending = _parse_entries(connection.hgetall(PENDING_KEY).items())
+    else:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return {'flushed': 0, 'pending': 0}
+        pending = _parse_entries(zip(user_ids, connection.hmget(PENDING_KEY, user_ids)))
+
+    flushed = 0
+    user_ids = sorted(pending)
+    for start in range(0, len(user_ids), batch_size):
+        chunk = user_ids[start:start + batch_size]
+        changed = []
+        for user in User.objects.filter(pk__in=chunk):
+            checked_in_at = datetime.fromtimestamp(float(pending[user.pk]), tz=timezone.utc)
+            if user.last_check_in is not None and checked_in_at <= user.last_check_in:
+                continue
+            user.last_check_in = checked_in_at
+            user.notification_sent_at = None
+            user.refresh_deadlines()
+            changed.append(user)
+        User.objects.bulk_update(changed, CHECK_IN_FIELDS)
+        flushed += len(changed)
+
+        pipe = connection.pipeline(transaction=False)
+        for user_id in chunk:
+            pipe.eval(DELETE_IF_UNCHANGED_SCRIPT, 1, PENDING_KEY, user_id, pending[user_id])
+        pipe.execute()
+
+    if flushed:
+        logger.info(f"Flushed {flushed} buffered check-ins")
+    return {'flushed': flushed, 'pending': len(pending)}
+
+
+def flush_check_ins_safely(user_ids=None):
+    """
+    Flush buffered check-ins when write-behind is enabled, logging instead of raising
+
+    Returns:
+        dict: The flush result, or a dict with an 'error' key
+    """
+    if not get_check_in_settings()['WRITE_BEHIND']:
+        return {'flushed': 0, 'pending': 0}
+    try:
+        return flush_check_ins(user_ids)
+    except Exception as e:
+        logger.error(f"Error flushing buffered check-ins: {str(e)}")
+        return {'error': str(e)}
@@ -0,0 +1,283 @@
+"""
+Set-based evaluation of the dead man's switch
+
+Instead of loading every user and deciding in Python, each stage is one
+query over the indexed ``next_check_in_due`` and ``grace_expires_at``
+columns: only the users entering a stage are selected, and their rows are
+updated together. Users are streamed in chunks so memory stays flat however
+many there are.
+
+Stages:
+    notify:  past the check-in deadline and not yet notified
+    trigger: notified and the grace period has expired
+
+Runs are incremental: a SweepCheckpoint keeps the time the last run covered,
+and the next run only looks at users whose deadline or grace expiry fell
+between that watermark and now. Re-running a window is harmless because
+each stage changes the state it selects on. A full run ignores the
+watermark and picks up anything an incremental run cannot see, such as a
+deadline moved into the past by a settings change.
+"""
+import logging
+from datetime import timedelta
+from django.db.models import Case, DateTimeField, Value, When
+from django.utils.timezone import now
+from legacy.models import LegacyMessage
+from legacy.task_backends import LANE_BULK, enqueue_immediate_deliveries
+from .models import SweepCheckpoint, User
+from .status_snapshot import invalidate_status_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Users fetched per round trip when streaming a cohort
+DEFAULT_CHUNK_SIZE = 2000
+
+# Reminders sent per Celery task, over one SMTP connection
+REMINDER_BATCH_SIZE = 100
+
+CHECKPOINT_NAME = 'dead_mans_switch'
+
+
+def grace_expiry_expression(notified_at):
+    """
+    SQL expression for ``notified_at`` plus each user's grace period
+
+    Users only pick from a handful of grace periods, so this is a CASE over
+    the distinct values in use; it lets a whole cohort be notified with one
+    UPDATE that also keeps ``grace_expires_at`` in step.
+    """
+    periods = User.objects.order_by().values_list('grace_period_days', flat=True).distinct()
+    return Case(
+        *[
+            When(grace_period_days=days, then=Value(notified_at + timedelta(days=days)))
+            for days in periods
+        ],
+        default=None,
+        output_field=DateTimeField()
+    )
+
+
+def notify_cohort(current_time=None, since=None):
+    """
+    Users past their check-in deadline who have not been notified
+
+    Args:
+        current_time (datetime): Reference time, defaults to now
+        since (datetime): Only users whose deadline passed at or after this time
+    """
+    current_time = current_time or now()
+    users = User.objects.filter(
+        next_check_in_due__lt=current_time,
+        notification_sent_at__isnull=True,
+    )
+    if since is not None:
+        users = users.filter(next_check_in_due__gte=since)
+    return users
+
+
+def trigger_cohort(current_time=None, since=None):
+    """
+    Notified users whose grace period has expired
+
+    Args:
+        current_time (datetime): Reference time, defaults to now
+        since (datetime): Only users whose grace period expired after this time
+    """
+    current_time = current_time or now()
+    users = User.objects.filter(
+        grace_expires_at__lte=current_time,
+        next_check_in_due__lt=current_time,
+    )
+    if since is not None:
+        users = users.filter(grace_expires_at__gt=since)
+    return users
+
+
+def iter_chunks(queryset, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Stream a queryset as lists of up to ``chunk_size`` rows"""
+    chunk = []
+    for row in queryset.iterator(chunk_size=chunk_size):
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def in_id_range(queryset, lower_id, upper_id=None):
+    """Restrict a user queryset to ids in (lower_id, upper_id]; no upper bound if ``upper_id`` is None"""
+    queryset = queryset.filter(pk__gt=lower_id)
+    if upper_id is not None:
+        queryset = queryset.filter(pk__lte=upper_id)
+    return queryset
+
+
+def mark_notified(current_time=None, since=None, user_ids=None, id_range=None):
+    """
+    Mark the whole notify cohort as notified with a single UPDATE
+
+    Every row gets the same ``notification_sent_at``, so the cohort can be
+    streamed afterwards with ``notified_users(current_time)``.
+
+    Args:
+        user_ids (list): Only mark these users, e.g. a chunk picked by the vectorized evaluator
+        id_range (tuple): Only mark users with an id in (lower, upper], e.g. a partition of the sweep
+
+    Returns:
+        int: Number of users marked
+    """
+    current_time = current_time or now()
+    cohort = notify_cohort(current_time, since)
+    if user_ids is not None:
+        cohort = cohort.filter(pk__in=user_ids)
+    if id_range is not None:
+        cohort = in_id_range(cohort, *id_range)
+    return cohort.update(
+        notification_sent_at=current_time,
+        grace_expires_at=grace_expiry_expression(current_time)
+    )
+
+
+def notified_users(current_time):
+    """Users marked by ``mark_notified`` at ``current_time``, with only what the reminder needs"""
+    return User.objects.filter(notification_sent_at=current_time).only(
+        'id', 'username', 'email', 'first_name', 'grace_period_days'
+    ).order_by('pk')
+
+
+def dispatch_reminders(current_time, batch_size=REMINDER_BATCH_SIZE, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Fan the reminders of a notified cohort out to Celery
+
+    Each task of the group sends ``batch_size`` reminders through one SMTP
+    connection. The group result is saved so its progress can be followed
+    with ``get_reminder_progress``.
+
+    Args:
+        current_time (datetime): Time the cohort was marked by ``mark_notified``
+
+    Returns:
+        GroupResult: The dispatched group, or None if the cohort is empty
+    """
+    from celery import group
+    from .tasks import send_check_in_reminders_batch
+
+    user_ids = notified_users(current_time).values_list('pk', flat=True)
+    batches = []
+    for chunk in iter_chunks(user_ids, chunk_size):
+        for start in range(0, len(chunk), batch_size):
+            batches.append(send_check_in_reminders_batch.s(chunk[start:start + batch_size]))
+    if not batches:
+        return None
+
+    result = group(batches).apply_async()
+    try:
+        result.save()
+    except Exception as e:
+        # The reminders are on their way; only progress tracking is lost
+        logger.warning(f"Could not save reminder group {result.id}: {str(e)}")
+    logger.info(f"Dispatched {len(batches)} check-in reminder batches as group {result.id}")
+    return result
+
+
+def get_reminder_progress(group_id):
+    """
+    Progress of a dispatched reminder group
+
+    Returns:
+        dict: batches in total, completed and failed, or None if the group is unknown
+    """
+    from celery.result import GroupResult
+
+    try:
+        result = GroupResult.restore(group_id)
+    except Exception as e:
+        logger.warning(f"Could not load reminder group {group_id}: {str(e)}")
+        return None
+    if result is None:
+        return None
+    return {
+        'group_id': group_id,
+        'batches': len(result.results),
+        'completed': result.completed_count(),
+        'failed': sum(1 for task in result.results if task.failed()),
+    }
+
+
+def trigger_delivery(user_ids):
+    """
+    Release the scheduled messages of a chunk of users whose grace period expired
+
+    The chunk's scheduled messages are set to pending with one update and
+    queued for delivery in one batch, so they go out now rather than at their
+    delivery date. Users whose messages were queued have their notification
+    reset for the next cycle. If the messages cannot be queued they go back
+    to scheduled and the users are left as they are, so the next full run
+    tries again.
+
+    Args:
+        user_ids (list): Primary keys of users in the trigger cohort
+
+    Returns:
+        dict: 'users' reset, 'messages' set to pending and 'queued' for delivery
+    """
+    keys = [str(user_id) for user_id in user_ids]
+    rows = list(LegacyMessage.objects(user_id__in=keys, status='scheduled').scalar('id', 'user_id'))
+    if not rows:
+        return {'users': 0, 'messages': 0, 'queued': 0}
+
+    # Claimed by id so only the messages read above are queued
+    message_ids = [str(message_id) for message_id, _ in rows]
+    messages = LegacyMessage.objects(id__in=message_ids, status='scheduled').update(set__status='pending')
+
+    job_ids = enqueue_immediate_deliveries(message_ids, lane=LANE_BULK)
+    if not job_ids:
+        LegacyMessage.objects(id__in=message_ids, status='pending').update(set__status='scheduled')
+        logger.warning(f"Could not queue {len(message_ids)} released messages, left scheduled for the next full run")
+        return {'users': 0, 'messages': 0, 'queued': 0}
+
+    with_messages = {user_id for _, user_id in rows}
+    users = User.objects.filter(pk__in=with_messages).update(notification_sent_at=None, grace_expires_at=None)
+    invalidate_status_snapshot(*with_messages)
+    return {'users': users, 'messages': messages, 'queued': len(job_ids)}
+
+
+def get_switch_summary(current_time=None, since=None):
+    """
+    Counts of the users in each stage, for dry runs and monitoring
+
+    Returns:
+        dict: total users, overdue users, and the notify and trigger cohorts
+    """
+    current_time = current_time or now()
+    return {
+        'total': User.objects.count(),
+        'overdue': User.objects.filter(next_check_in_due__lt=current_time).count(),
+        'notify': notify_cohort(current_time, since).count(),
+        'trigger': trigger_cohort(current_time, since).count(),
+    }
+
+
+def get_watermark(name=CHECKPOINT_NAME):
+    """Time the last completed run covered, or None before the first run"""
+    checkpoint = SweepCheckpoint.objects.filter(name=name).first()
+    return checkpoint.watermark if checkpoint else None
+
+
+def advance_watermark(current_time, name=CHECKPOINT_NAME):
+    """
+    Record that everything due up to ``current_time`` has been processed
+
+    The watermark only moves forward, so an overlapping slower run cannot
+    move it back.
+    """
+    checkpoint, created = SweepCheckpoint.objects.get_or_create(
+        name=name,
+        defaults={'watermark': current_time}
+    )
+    if not created:
+        SweepCheckpoint.objects.filter(pk=checkpoint.pk, watermark__lt=current_time).update(
+            watermark=current_time,
+            updated_at=now()
+        )
@@ -0,0 +1,226 @@
+"""
+Precise dead man's switch timers
+
+An optional long-running service (``run_deadline_timers``) that fires each
+user's check-in reminder and delivery trigger at the moment the deadline
+passes, instead of waiting for the next sweep. Deadlines due within
+``HORIZON_HOURS`` are loaded from the indexed ``next_check_in_due`` and
+``grace_expires_at`` columns into a hierarchical timing wheel; the service
+reloads the window periodically and on restart, so nothing has to survive
+in memory.
+
+Check-ins and settings changes publish the user's new deadlines on a Redis
+channel and the service reschedules that user's timers in O(1). Events are
+a shortcut, not the source of truth: a timer re-reads the user when it
+fires, and the sweep still runs as a safety net.
+"""
+import json
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils.timezone import now
+from legacy.task_backends import get_shared_redis_connection
+from .dead_mans_switch import grace_expiry_expression
+from .models import User
+from .timing_wheel import TimingWheel
+
+logger = logging.getLogger(__name__)
+
+EVENTS_CHANNEL = 'afteryou:deadline_timers:events'
+
+REMINDER = 'reminder'
+TRIGGER = 'trigger'
+
+DEFAULT_TIMER_SETTINGS = {
+    'ENABLED': False,  # Publish deadline changes for the timer service
+    'HORIZON_HOURS': 48,  # Deadlines loaded into the wheel ahead of time
+    'RELOAD_MINUTES': 60,  # Reload of the horizon from the database
+    'TICK_SECONDS': 1,
+}
+
+
+def get_timer_settings():
+    """Get deadline timer settings merged over the defaults"""
+    config = dict(DEFAULT_TIMER_SETTINGS)
+    config.update(getattr(settings, 'DEADLINE_TIMERS', {}))
+    return config
+
+
+def publish_deadline_change(user):
+    """
+    Tell the timer service that a user's deadlines changed
+
+    Called after check-ins and settings changes; failures are logged and
+    left to the service's next reload.
+    """
+    if not get_timer_settings()['ENABLED']:
+        return
+    try:
+        get_shared_redis_connection().publish(EVENTS_CHANNEL, json.dumps({
+            'user_id': user.pk,
+            'next_check_in_due': user.next_check_in_due.timestamp() if user.next_check_in_due else None,
+            'notified': user.notification_sent_at is not None,
+            'grace_expires_at': user.grace_expires_at.timestamp() if user.grace_expires_at else None,
+        }))
+    except Exception as e:
+        logger.warning(f"Could not publish deadline change for user {user.pk}: {str(e)}")
+
+
+class DeadlineTimerService:
+    """Keeps a timing wheel of upcoming deadlines and fires them on time"""
+
+    def __init__(self, config=None, connection=None):
+        self.config = config or get_timer_settings()
+        self.connection = connection
+        self.horizon = timedelta(hours=self.config['HORIZON_HOURS'])
+        self.wheel = None
+        self.loaded_until = None
+
+    def rehydrate(self):
+        """Rebuild the wheel from the database for the next horizon"""
+        current_time = now()
+        self.loaded_until = current_time + self.horizon
+        self.wheel = TimingWheel(self.config['TICK_SECONDS'], start=current_time.timestamp())
+
+        reminders = User.objects.filter(
+            notification_sent_at__isnull=True,
+            next_check_in_due__gte=current_time,
+            next_check_in_due__lte=self.loaded_until,
+        ).values_list('pk', 'next_check_in_due')
+        for user_id, due in reminders.iterator(chunk_size=2000):
+            self.wheel.schedule((REMINDER, user_id), due.timestamp())
+
+        triggers = User.objects.filter(
+            grace_expires_at__gte=current_time,
+            grace_expires_at__lte=self.loaded_until,
+        ).values_list('pk', 'grace_expires_at')
+        for user_id, expires_at in triggers.iterator(chunk_size=2000):
+            self.wheel.schedule((TRIGGER, user_id), expires_at.timestamp())
+
+        logger.info(f"Loaded {len(self.wheel)} deadline timers up to {self.loaded_until.isoformat()}")
+
+    def reschedule(self, user_id, next_check_in_due=None, notified=False, grace_expires_at=None):
+        """
+        Replace a user's timers with their current deadlines
+
+        Args:
+            user_id (int): Primary key of the user
+            next_check_in_due (float): Unix time of the check-in deadline
+            notified (bool): The user has already been reminded
+            grace_expires_at (float): Unix time the grace period ends
+        """
+        self.wheel.cancel((REMINDER, user_id))
+        self.wheel.cancel((TRIGGER, user_id))
+        horizon_end = self.loaded_until.timestamp()
+        if next_check_in_due is not None and not notified and next_check_in_due <= horizon_end:
+            self.wheel.schedule((REMINDER, user_id), next_check_in_due)
+        if grace_expires_at is not None and grace_expires_at <= horizon_end:
+            self.wheel.schedule((TRIGGER, user_id), grace_expires_at)
+
+    def fire(self, kind, user_id):
+        """
+        Re-check a user whose timer expired and dispatch the matching task
+
+        A buffered check-in of the user is flushed first, and a deadline that
+        moved later without an event reaching the service is rescheduled
+        instead.
+        """
+        from .check_ins import flush_check_ins_safely
+        from .tasks import send_check_in_reminders_batch, trigger_user_message_delivery
+        flush_check_ins_safely([user_id])
+        current_time = now()
+        state = User.objects.filter(pk=user_id).values(
+            'next_check_in_due', 'notification_sent_at', 'grace_expires_at'
+        ).first()
+        if state is None:
+            return
+
+        if kind == REMINDER:
+            if state['notification_sent_at'] is not None or state['next_check_in_due'] is None:
+                return
+            if state['next_check_in_due'] > current_time:
+                self.reschedule(user_id, state['next_check_in_due'].timestamp())
+                return
+            # Claimed with the same conditional UPDATE as the sweep, so only one of them reminds
+            claimed = User.objects.filter(
+                pk=user_id,
+                notification_sent_at__isnull=True,
+                next_check_in_due__lte=current_time,
+            ).update(
+                notification_sent_at=current_time,
+                grace_expires_at=grace_expiry_expression(current_time)
+            )
+            if claimed:
+                # The batch task only sends; the single-user task would re-stamp the claim and move the grace period
+                send_check_in_reminders_batch.delay([user_id])
+                self.reschedule_from_database(user_id)
+                logger.info(f"Check-in deadline passed for user {user_id}, reminder dispatched")
+            return
+
+        expires_at = state['grace_expires_at']
+        if expires_at is None:
+            return
+        if expires_at > current_time:
+            self.wheel.schedule((TRIGGER, user_id), expires_at.timestamp())
+            return
+        trigger_user_message_delivery.delay(user_id)
+        logger.info(f"Grace period expired for user {user_id}, delivery triggered")
+
+    def reschedule_from_database(self, user_id):
+        """Reschedule a user's timers from the deadlines stored on the row"""
+        state = User.objects.filter(pk=user_id).values(
+            'next_check_in_due', 'notification_sent_at', 'grace_expires_at'
+        ).first()
+        if state is None:
+            return
+        self.reschedule(
+            user_id,
+            state['next_check_in_due'].timestamp() if state['next_check_in_due'] else None,
+            state['notification_sent_at'] is not None,
+            state['grace_expires_at'].timestamp() if state['grace_expires_at'] else None,
+        )
+
+    def handle_event(self, raw):
+        try:
+            event = json.loads(raw)
+            self.reschedule(
+                event['user_id'],
+                event.get('next_check_in_due'),
+                event.get('notified', False),
+                event.get('grace_expires_at'),
+            )
+        except Exception as e:
+            logger.error(f"Invalid deadline timer event {raw!r}: {str(e)}")
+
+    def run(self, should_stop=None):
+        """
+        Fire timers until ``should_stop`` returns True
+
+        Subscribes before loading the horizon so no change published during
+        the load is lost.
+        """
+        connection = self.connection or get_shared_redis_connection()
+        pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(EVENTS_CHANNEL)
+        reload_every = self.config['RELOAD_MINUTES'] * 60
+        try:
+            self.rehydrate()
+            reloaded_at = time.monotonic()
+            while not (should_stop and should_stop()):
+                message = pubsub.get_message(timeout=self.config['TICK_SECONDS'])
+                while message:
+                    self.handle_event(message['data'])
+                    message = pubsub.get_message()
+
+                for (kind, user_id), _ in self.wheel.advance(time.time()):
+                    try:
+                        self.fire(kind, user_id)
+                    except Exception as e:
+                        logger.error(f"Error firing {kind} timer for user {user_id}: {str(e)}")
+
+                if time.monotonic() - reloaded_at >= reload_every:
+                    self.rehydrate()
+                    reloaded_at = time.monotonic()
+        finally:
+            pubsub.close()
@@ -1,14 +1,18 @@
-from django.core.mail import send_mail
+import logging
+from django.core.mail import EmailMultiAlternatives, get_connection, send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.utils.html import strip_tags
+from legacy.circuit_breaker import CircuitOpen, allow_request, guarded_send, record_failure, record_success
+
+logger = logging.getLogger(__name__)
 
 class DeadMansSwitchEmailService:
     """Service for sending dead man's switch related emails"""
     
     @staticmethod
-    def send_check_in_reminder(user):
-        """Send reminder email to user to check in"""
+    def _build_check_in_reminder(user):
+        """Compose the check-in reminder for a user without sending it"""
         subject = f"AfterYou - Check-in Reminder for {user.first_name or user.username}"
         
         context = {
@@ -21,20 +25,73 @@ class DeadMansSwitchEmailService:
         html_message = render_to_string('emails/check_in_reminder.html', context)
         plain_message = strip_tags(html_message)
         
+        email = EmailMultiAlternatives(
+            subject=subject,
+            body=plain_message,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[user.email],
+        )
+        email.attach_alternative(html_message, "text/html")
+        return email
+    
+    @staticmethod
+    def send_check_in_reminder(user):
+        """Send reminder email to user to check in"""
         try:
-            send_mail(
-                subject=subject,
-                message=plain_message,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                recipient_list=[user.email],
-                html_message=html_message,
-                fail_silently=False,
-            )
+            email = DeadMansSwitchEmailService._build_check_in_reminder(user)
+            guarded_send(email.send)
             return True
         except Exception as e:
-            print(f"Failed to send check-in reminder to {user.email}: {str(e)}")
+            logger.error(f"Failed to send check-in reminder to {user.email}: {str(e)}")
             return False
     
+    @staticmethod
+    def send_check_in_reminders(users):
+        """
+        Send check-in reminders to several users through one SMTP connection
+        
+        Returns:
+            dict: Maps each user id to True if sent, False if it failed, or None
+                  if it was not attempted because the SMTP circuit breaker is open
+        """
+        results = {user.pk: False for user in users}
+        if not users:
+            return results
+        
+        try:
+            allow_request()
+        except CircuitOpen as e:
+            logger.warning(f"Deferred {len(users)} check-in reminders: {str(e)}")
+            return dict.fromkeys(results, None)
+        
+        connection = get_connection()
+        try:
+            connection.open()
+            for index, user in enumerate(users):
+                try:
+                    email = DeadMansSwitchEmailService._build_check_in_reminder(user)
+                    email.connection = connection
+                    results[user.pk] = bool(email.send())
+                except Exception as e:
+                    logger.error(f"Failed to send check-in reminder to {user.email}: {str(e)}")
+                    if record_failure(e):
+                        # The relay went away; leave the rest for a retry
+                        results.update(dict.fromkeys((pending.pk for pending in users[index:]), None))
+                        break
+            if any(results.values()):
+                record_success()
+        except Exception as e:
+            logger.error(f"Failed to open SMTP connection for check-in reminders: {str(e)}")
+            if record_failure(e):
+                results = dict.fromkeys(results, None)
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        
+        return results
+    
     @staticmethod
     def send_final_warning(user):
         """Send final warning before message delivery begins"""
@@ -51,15 +108,15 @@ class DeadMansSwitchEmailService:
         plain_message = strip_tags(html_message)
         
         try:
-            send_mail(
+            guarded_send(lambda: send_mail(
                 subject=subject,
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[user.email],
                 html_message=html_message,
                 fail_silently=False,
-            )
+            ))
             return True
         except Exception as e:
-            print(f"Failed to send final warning to {user.email}: {str(e)}")
+            logger.error(f"Failed to send final warning to {user.email}: {str(e)}")
             return False
@@ -0,0 +1,167 @@
+"""
+Benchmark of the dead man's switch engines on a seeded database
+
+Creates a synthetic population in a throwaway test database and times, at
+the same reference time, each way of finding the users to notify and to
+trigger:
+
+    loop:       the original per-user loop, one model instance at a time
+    vectorized: ``evaluate_switch``, including loading the columns
+    sql:        the notify and trigger cohort queries of the default engine
+
+Every engine reads the users from the database, so the timings include
+the cost of getting the data out of it, not just the classification.
+"""
+import random
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.test.utils import setup_databases, teardown_databases
+from django.utils.timezone import now
+from accounts.dead_mans_switch import DEFAULT_CHUNK_SIZE, notify_cohort, trigger_cohort
+from accounts.models import CHECK_IN_MONTH_DAYS, User
+from legacy.benchmarking import best_of
+
+
+def classify_user(last_check_in, interval_months, notified_at, grace_days, current_time):
+    """Stage of one user, decided the way the original per-user loop did"""
+    from accounts.switch_evaluator import ACTIVE, DUE, GRACE, TRIGGER
+
+    if last_check_in is None:
+        return ACTIVE
+    if last_check_in + timedelta(days=CHECK_IN_MONTH_DAYS * interval_months) >= current_time:
+        return ACTIVE
+    if notified_at is None:
+        return DUE
+    if current_time >= notified_at + timedelta(days=grace_days):
+        return TRIGGER
+    return GRACE
+
+
+class Command(BaseCommand):
+    help = "Benchmark the vectorized, SQL and per-user dead man's switch engines on a seeded test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            type=int,
+            default=100000,
+            help='Number of synthetic users (default: 100000)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=42,
+            help='Random seed for the synthetic population (default: 42)'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Timed runs of each engine; the best is reported (default: 3)'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Rows fetched per round trip (default: {DEFAULT_CHUNK_SIZE})'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            import numpy as np
+            from accounts.switch_evaluator import STAGES, compute_stages, evaluate_switch, load_columns
+        except ImportError:
+            self.stdout.write(self.style.ERROR("NumPy is required for the vectorized evaluator"))
+            return
+
+        size = options['users']
+        chunk_size = options['chunk_size']
+        repeat = options['repeat']
+        self.stdout.write(f"=== Dead Man's Switch Engine Benchmark ({size} users) ===")
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        try:
+            current_time = now()
+            started = time.perf_counter()
+            self._create_population(size, options['seed'], current_time)
+            self.stdout.write(f"Seeded {size} users in {time.perf_counter() - started:.1f}s")
+
+            def per_user_loop():
+                users = User.objects.only(
+                    'last_check_in', 'check_in_interval_months', 'notification_sent_at', 'grace_period_days'
+                ).order_by('pk')
+                return {
+                    user.pk: classify_user(
+                        user.last_check_in, user.check_in_interval_months,
+                        user.notification_sent_at, user.grace_period_days, current_time
+                    )
+                    for user in users.iterator(chunk_size=chunk_size)
+                }
+
+            def sql_cohorts():
+                return {
+                    'due': set(notify_cohort(current_time).values_list('pk', flat=True)),
+                    'trigger': set(trigger_cohort(current_time).values_list('pk', flat=True)),
+                }
+
+            loop_seconds, loop_stages = best_of(per_user_loop, repeat)
+            vectorized_seconds, evaluation = best_of(
+                lambda: evaluate_switch(current_time, chunk_size=chunk_size), repeat
+            )
+            load_seconds, columns = best_of(lambda: load_columns(chunk_size=chunk_size), repeat)
+            compute_seconds, _ = best_of(lambda: compute_stages(columns, current_time), repeat)
+            sql_seconds, cohorts = best_of(sql_cohorts, repeat)
+
+            counts = np.bincount(compute_stages(columns, current_time), minlength=len(STAGES))
+            self.stdout.write("Stages: " + ', '.join(f"{name} {counts[index]}" for index, name in enumerate(STAGES)))
+            self.stdout.write(f"Per-user loop:  {loop_seconds:.3f}s ({size / loop_seconds:,.0f} users/s)")
+            self.stdout.write(
+                f"Vectorized:     {vectorized_seconds:.3f}s ({size / vectorized_seconds:,.0f} users/s), "
+                f"of which loading {load_seconds:.3f}s and array stages {compute_seconds:.3f}s"
+            )
+            self.stdout.write(f"SQL cohorts:    {sql_seconds:.3f}s ({size / sql_seconds:,.0f} users/s)")
+
+            mismatches = self._mismatches(evaluation, loop_stages, cohorts, STAGES)
+            if mismatches:
+                self.stdout.write(self.style.ERROR(f"❌ {mismatches} users classified differently"))
+            else:
+                self.stdout.write(self.style.SUCCESS("✓ All three engines agree on every user"))
+        finally:
+            teardown_databases(old_config, verbosity=0)
+
+    def _mismatches(self, evaluation, loop_stages, cohorts, stages):
+        """Users the loop or the SQL cohorts place differently from the vectorized evaluator"""
+        mismatches = 0
+        vectorized_stage = {}
+        for stage, name in enumerate(stages):
+            for user_id in evaluation[name].tolist():
+                vectorized_stage[user_id] = stage
+        mismatches += sum(1 for user_id, stage in loop_stages.items() if vectorized_stage.get(user_id) != stage)
+        for name in ('due', 'trigger'):
+            mismatches += len(set(evaluation[name].tolist()) ^ cohorts[name])
+        return mismatches
+
+    def _create_population(self, size, seed, current_time, batch_size=5000):
+        """A population spread over the intervals and stages seen in production"""
+        rng = random.Random(seed)
+        batch = []
+        for index in range(size):
+            user = User(
+                username=f'bench-{index}',
+                email=f'bench-{index}@example.invalid',
+                check_in_interval_months=rng.choice([1, 3, 6, 12, 24]),
+                grace_period_days=rng.randint(1, 30),
+                last_check_in=current_time - timedelta(days=rng.uniform(0, 800)),
+            )
+            # About a third of the users have been notified at some point
+            if rng.random() < 0.34:
+                user.notification_sent_at = current_time - timedelta(days=rng.uniform(0, 40))
+            user.set_unusable_password()
+            user.refresh_deadlines()
+            batch.append(user)
+            if len(batch) >= batch_size:
+                User.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            User.objects.bulk_create(batch)
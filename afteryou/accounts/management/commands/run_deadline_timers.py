@@ -0,0 +1,61 @@
+"""
+Management command to run the precise dead man's switch timer service
+"""
+import signal
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from accounts.deadline_timers import DeadlineTimerService, get_timer_settings
+from legacy.leader import LeaderElection, get_leader_settings
+
+class Command(BaseCommand):
+    help = "Fire dead man's switch reminders and triggers at their exact deadlines"
+
+    def handle(self, *args, **options):
+        # Treat SIGTERM like Ctrl+C so the lease is released on shutdown
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+
+        config = get_timer_settings()
+        if not config['ENABLED']:
+            self.stdout.write(self.style.WARNING(
+                "DEADLINE_TIMERS['ENABLED'] is off: check-ins will not publish "
+                "reschedules, changes are only picked up on reload"
+            ))
+
+        # One active service at a time; standbys take over when the lease lapses
+        election = LeaderElection('deadline_timers')
+        renew_interval = get_leader_settings()['RENEW_INTERVAL']
+        service = DeadlineTimerService(config)
+        last_renewed = time.monotonic()
+
+        def lost_leadership():
+            nonlocal last_renewed
+            if time.monotonic() - last_renewed < renew_interval:
+                return False
+            last_renewed = time.monotonic()
+            return not election.ensure()
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Starting deadline timer service ({config['HORIZON_HOURS']}h horizon)"
+        ))
+        try:
+            while True:
+                if not election.ensure():
+                    time.sleep(renew_interval)
+                    continue
+
+                self.stdout.write(self.style.SUCCESS(
+                    f'[{timezone.now()}] {election.identity} is running the deadline timers'
+                ))
+                last_renewed = time.monotonic()
+                service.run(should_stop=lost_leadership)
+                self.stdout.write(self.style.WARNING(
+                    f'[{timezone.now()}] {election.identity} lost the lease, standing by'
+                ))
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('\nShutting down deadline timer service...'))
+        finally:
+            election.release()
+
+    def handle_sigterm(self, signum, frame):
+        raise KeyboardInterrupt
@@ -0,0 +1,305 @@
+"""
+Simulation harness for the dead man's switch
+
+Builds a synthetic population in a throwaway SQL test database and a
+separate Mongo database, then advances a simulated clock and runs
+``trigger_inactive_users`` at every tick with its clock set to the tick.
+Reminders go to Django's in-memory mail backend and released messages are
+counted instead of being queued, so nothing reaches real users, SMTP or the
+delivery workers. The clock only exists in the throwaway databases, so
+watermarks and notification times it writes never reach production data.
+"""
+import io
+import random
+import time
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.core import mail
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Case, DateTimeField, Value, When
+from django.test.utils import CaptureQueriesContext, override_settings, setup_databases, teardown_databases
+from django.utils.timezone import now
+from mongoengine import register_connection
+from mongoengine.connection import get_db
+from mongoengine.context_managers import switch_db
+from accounts.models import CHECK_IN_MONTH_DAYS, User
+from legacy.models import LegacyMessage
+
+SIMULATION_ALIAS = 'simulation'
+
+# Isolate the sweep from Redis-backed features the simulation does not measure
+SIMULATION_SETTINGS = {
+    'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'CHECK_INS': {'WRITE_BEHIND': False},
+    'SMTP_CIRCUIT_BREAKER': {'ENABLED': False},
+}
+
+
+def parse_distribution(value):
+    """Parse '1:0.2,6:0.5,12:0.3' into ([1, 6, 12], [0.2, 0.5, 0.3])"""
+    values = []
+    weights = []
+    for part in value.split(','):
+        number, _, weight = part.partition(':')
+        values.append(int(number))
+        weights.append(float(weight or 1))
+    return values, weights
+
+
+class Command(BaseCommand):
+    help = "Simulate the dead man's switch on a synthetic population and report per-tick metrics."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10000, help='Synthetic users (default: 10000)')
+        parser.add_argument('--months', type=int, default=12, help='Simulated months (default: 12)')
+        parser.add_argument('--tick-hours', type=int, default=24, help='Hours between sweeps (default: 24)')
+        parser.add_argument(
+            '--intervals',
+            default='1:0.1,3:0.2,6:0.5,12:0.2',
+            help='Check-in interval months and weights (default: 1:0.1,3:0.2,6:0.5,12:0.2)'
+        )
+        parser.add_argument(
+            '--grace-days',
+            default='7:0.3,10:0.5,30:0.2',
+            help='Grace period days and weights (default: 7:0.3,10:0.5,30:0.2)'
+        )
+        parser.add_argument(
+            '--late-rate',
+            type=float,
+            default=0.15,
+            help='Share of users who only check in after a reminder (default: 0.15)'
+        )
+        parser.add_argument(
+            '--lapsed-rate',
+            type=float,
+            default=0.05,
+            help='Share of users who never check in again (default: 0.05)'
+        )
+        parser.add_argument(
+            '--messages-per-user',
+            type=int,
+            default=2,
+            help='Average scheduled messages per user (default: 2)'
+        )
+        parser.add_argument('--engine', choices=['sql', 'vectorized'], default='sql', help='Sweep engine to run')
+        parser.add_argument('--full', action='store_true', help='Run full sweeps instead of incremental ones')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Chunk size passed to the sweep')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+        parser.add_argument(
+            '--mongo-db',
+            default='afteryou_simulation',
+            help='Mongo database for the synthetic messages, dropped afterwards (default: afteryou_simulation)'
+        )
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.stdout.write("=== Dead Man's Switch Simulation ===")
+        if options['mongo_db'] == settings.MONGODB['db']:
+            self.stdout.write(self.style.ERROR(
+                f"--mongo-db must not be the application database '{settings.MONGODB['db']}', it is dropped afterwards"
+            ))
+            return
+
+        old_config = setup_databases(verbosity=0, interactive=False)
+        register_connection(SIMULATION_ALIAS, **dict(settings.MONGODB, db=options['mongo_db']))
+        try:
+            with override_settings(**SIMULATION_SETTINGS), switch_db(LegacyMessage, SIMULATION_ALIAS):
+                self.simulate(options)
+        finally:
+            get_db(SIMULATION_ALIAS).client.drop_database(options['mongo_db'])
+            teardown_databases(old_config, verbosity=0)
+
+    def simulate(self, options):
+        start = now().replace(hour=0, minute=0, second=0, microsecond=0)
+        intervals = parse_distribution(options['intervals'])
+        grace_days = parse_distribution(options['grace_days'])
+
+        started = time.perf_counter()
+        self.create_population(start, options, intervals, grace_days)
+        messages = self.create_messages(options)
+        self.stdout.write(
+            f"Created {options['users']} users and {messages} messages in {time.perf_counter() - started:.1f}s"
+        )
+
+        released = []
+        end = start + timedelta(days=CHECK_IN_MONTH_DAYS * options['months'])
+        tick = timedelta(hours=options['tick_hours'])
+        current_time = start + tick
+        totals = {'check_ins': 0, 'emails': 0, 'released': 0, 'queries': 0, 'seconds': 0.0}
+
+        self.stdout.write(
+            f"\n{'Tick (UTC)':<18}{'Check-ins':>10}{'Emails':>8}{'Released':>10}"
+            f"{'Queries':>9}{'Seconds':>9}{'Users/s':>11}{'Peak MB':>9}"
+        )
+        tracemalloc.start()
+        try:
+            with mock.patch(
+                'accounts.dead_mans_switch.enqueue_immediate_deliveries',
+                side_effect=lambda message_ids, lane=None: released.extend(message_ids) or list(message_ids)
+            ):
+                while current_time <= end:
+                    check_ins = self.simulate_check_ins(current_time)
+                    metrics = self.run_sweep(current_time, options, released)
+                    metrics['check_ins'] = check_ins
+                    for name in totals:
+                        totals[name] += metrics[name]
+                    self.report_tick(current_time, metrics, options['users'])
+                    current_time += tick
+        finally:
+            tracemalloc.stop()
+
+        ticks = max(int((end - start) / tick), 1)
+        self.stdout.write(
+            f"\nTotals over {ticks} ticks: {totals['check_ins']} check-ins, {totals['emails']} reminder emails, "
+            f"{totals['released']} messages released"
+        )
+        self.stdout.write(
+            f"Average sweep: {totals['seconds'] / ticks:.3f}s, {totals['queries'] / ticks:.1f} SQL queries, "
+            f"{options['users'] * ticks / totals['seconds'] if totals['seconds'] else 0:,.0f} users/s"
+        )
+
+    def create_population(self, start, options, intervals, grace_days, batch_size=5000):
+        """Create the synthetic users and decide how each one behaves"""
+        # Per user: 'regular' check in before the deadline, 'late' only after a reminder, 'lapsed' never
+        self.behaviour = {}
+        self.next_check_in = {}
+        self.late_response = {}
+        self.interval_of = {}
+
+        batch = []
+        for index in range(options['users']):
+            interval = self.random.choices(*intervals)[0]
+            user = User(
+                username=f'sim-{index}',
+                email=f'sim-{index}@example.invalid',
+                check_in_interval_months=interval,
+                grace_period_days=self.random.choices(*grace_days)[0],
+                last_check_in=start - timedelta(days=self.random.uniform(0, CHECK_IN_MONTH_DAYS * interval)),
+            )
+            user.set_unusable_password()
+            user.refresh_deadlines()
+            batch.append(user)
+            if len(batch) >= batch_size:
+                self._insert_users(batch, options)
+                batch = []
+        if batch:
+            self._insert_users(batch, options)
+
+    def _insert_users(self, batch, options):
+        for user in User.objects.bulk_create(batch):
+            roll = self.random.random()
+            if roll < options['lapsed_rate']:
+                behaviour = 'lapsed'
+            elif roll < options['lapsed_rate'] + options['late_rate']:
+                behaviour = 'late'
+            else:
+                behaviour = 'regular'
+                self.next_check_in[user.pk] = self._next_regular_check_in(user.last_check_in, user.check_in_interval_months)
+            self.behaviour[user.pk] = behaviour
+            self.interval_of[user.pk] = user.check_in_interval_months
+
+    def _next_regular_check_in(self, last_check_in, interval):
+        return last_check_in + timedelta(days=CHECK_IN_MONTH_DAYS * interval * self.random.uniform(0.3, 0.95))
+
+    def create_messages(self, options, batch_size=5000):
+        """Scheduled messages for every user, far enough out that only the switch releases them"""
+        if not options['messages_per_user']:
+            return 0
+        delivery_date = now() + timedelta(days=3650)
+        created = 0
+        batch = []
+        for user_id in self.behaviour:
+            for number in range(self.random.randint(0, 2 * options['messages_per_user'])):
+                message = LegacyMessage(
+                    user_id=str(user_id),
+                    title=f'Simulated message {number}',
+                    content='Simulated',
+                    recipient_email=f'recipient-{user_id}-{number}@example.invalid',
+                    delivery_date=delivery_date,
+                    status='scheduled',
+                )
+                message.assign_partition_key()
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    LegacyMessage.objects.insert(batch, load_bulk=False)
+                    created += len(batch)
+                    batch = []
+        if batch:
+            LegacyMessage.objects.insert(batch, load_bulk=False)
+            created += len(batch)
+        return created
+
+    def simulate_check_ins(self, current_time, chunk_size=2000):
+        """Apply the check-ins of this tick, one UPDATE per chunk of users"""
+        checking_in = [
+            user_id for user_id, due in self.next_check_in.items() if due <= current_time
+        ]
+
+        # Late users answer their reminder some time into the grace period, or too late
+        notified = User.objects.filter(notification_sent_at__isnull=False).values_list(
+            'pk', 'notification_sent_at', 'grace_period_days'
+        )
+        for user_id, notified_at, grace in notified.iterator(chunk_size=chunk_size):
+            if self.behaviour.get(user_id) != 'late':
+                continue
+            response = self.late_response.setdefault(
+                (user_id, notified_at), notified_at + timedelta(days=self.random.uniform(0, grace * 1.5))
+            )
+            if response <= current_time:
+                checking_in.append(user_id)
+
+        deadline = Case(
+            *[
+                When(check_in_interval_months=months, then=Value(current_time + timedelta(days=CHECK_IN_MONTH_DAYS * months)))
+                for months in set(self.interval_of.values())
+            ],
+            default=None,
+            output_field=DateTimeField()
+        )
+        for start in range(0, len(checking_in), chunk_size):
+            User.objects.filter(pk__in=checking_in[start:start + chunk_size]).update(
+                last_check_in=current_time,
+                notification_sent_at=None,
+                grace_expires_at=None,
+                next_check_in_due=deadline,
+            )
+
+        for user_id in checking_in:
+            if self.behaviour[user_id] == 'regular':
+                self.next_check_in[user_id] = self._next_regular_check_in(current_time, self.interval_of[user_id])
+        return len(checking_in)
+
+    def run_sweep(self, current_time, options, released):
+        """Run one sweep as of ``current_time`` and measure it"""
+        mail.outbox = []
+        released_before = len(released)
+        args = ['--send-emails', '--inline', f'--engine={options["engine"]}', f'--chunk-size={options["chunk_size"]}']
+        if options['full']:
+            args.append('--full')
+
+        tracemalloc.reset_peak()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            with mock.patch('accounts.management.commands.trigger_inactive_users.now', return_value=current_time):
+                call_command('trigger_inactive_users', *args, stdout=io.StringIO())
+            seconds = time.perf_counter() - started
+        return {
+            'emails': len(mail.outbox),
+            'released': len(released) - released_before,
+            'queries': len(queries.captured_queries),
+            'seconds': seconds,
+            'peak_mb': tracemalloc.get_traced_memory()[1] / (1024 * 1024),
+        }
+
+    def report_tick(self, current_time, metrics, users):
+        throughput = users / metrics['seconds'] if metrics['seconds'] else 0
+        self.stdout.write(
+            f"{current_time.strftime('%Y-%m-%d %H:%M'):<18}{metrics['check_ins']:>10}{metrics['emails']:>8}"
+            f"{metrics['released']:>10}{metrics['queries']:>9}{metrics['seconds']:>9.3f}"
+            f"{throughput:>11,.0f}{metrics['peak_mb']:>9.1f}"
+        )
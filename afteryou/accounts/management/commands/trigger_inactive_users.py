@@ -1,9 +1,21 @@
+import time
 from django.core.management.base import BaseCommand
 from django.utils.timezone import now
-from datetime import timedelta
-from accounts.models import User
+from accounts.check_ins import flush_check_ins_safely
 from accounts.email_service import DeadMansSwitchEmailService
-from legacy.models import LegacyMessage
+from accounts.models import User
+from accounts.partitioned_sweep import get_sweep_progress, start_partitioned_sweep
+from accounts.dead_mans_switch import (
+    DEFAULT_CHUNK_SIZE, REMINDER_BATCH_SIZE, advance_watermark, dispatch_reminders,
+    get_reminder_progress, get_switch_summary, get_watermark, iter_chunks, mark_notified,
+    notified_users, notify_cohort, trigger_cohort, trigger_delivery
+)
+
+def id_chunks(ids, chunk_size):
+    """Split an id array from the vectorized evaluator into lists of up to ``chunk_size`` ids"""
+    for start in range(0, len(ids), chunk_size):
+        yield ids[start:start + chunk_size].tolist()
+
 
 class Command(BaseCommand):
     help = 'Dead mans switch: Check for inactive users and trigger notifications or message delivery.'
@@ -19,98 +31,239 @@ class Command(BaseCommand):
             action='store_true',
             help='Actually send notification emails (default: false for safety)'
         )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=DEFAULT_CHUNK_SIZE,
+            help=f'Users fetched per query when streaming a cohort (default: {DEFAULT_CHUNK_SIZE})'
+        )
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Check every user instead of only those whose deadline passed since the last run'
+        )
+        parser.add_argument(
+            '--wait',
+            action='store_true',
+            help='Wait for the dispatched reminder batches to finish and report progress'
+        )
+        parser.add_argument(
+            '--engine',
+            choices=['sql', 'vectorized'],
+            default='sql',
+            help='sql: one query per stage (default); vectorized: load all users into NumPy arrays and pick the cohorts there'
+        )
+        parser.add_argument(
+            '--inline',
+            action='store_true',
+            help='Send reminders from this process instead of dispatching them to Celery'
+        )
+        parser.add_argument(
+            '--partitions',
+            type=int,
+            default=1,
+            help='Split a --full check into this many id ranges swept by parallel Celery workers (default: 1)'
+        )
 
     def handle(self, *args, **options):
         dry_run = options['dry_run']
         send_emails = options['send_emails']
-        
+        chunk_size = options['chunk_size']
+        current_time = now()
+        if options['partitions'] > 1 and options['engine'] == 'vectorized':
+            self.stdout.write(self.style.ERROR("--partitions cannot be combined with --engine=vectorized"))
+            return
+        # Without a previous run there is no watermark and every user is checked
+        since = None if options['full'] else get_watermark()
+        partitions = options['partitions'] if since is None else 1
+        if partitions < options['partitions']:
+            self.stdout.write(self.style.WARNING(
+                "Incremental checks select their cohorts from the deadline indexes; --partitions only applies to full checks"
+            ))
+
         self.stdout.write("=== Dead Man's Switch Check ===")
-        
+
         if dry_run:
             self.stdout.write(self.style.WARNING("DRY RUN MODE - No changes will be made"))
         if not send_emails:
             self.stdout.write(self.style.WARNING("EMAIL SENDING DISABLED - Use --send-emails to enable"))
-        
-        # Get all users
-        all_users = User.objects.all()
-        self.stdout.write(f"Checking {all_users.count()} users...")
-        
-        # Process each user
-        for user in all_users:
-            self._process_user(user, dry_run, send_emails)
-    
-    def _process_user(self, user, dry_run, send_emails):
-        """Process individual user for dead man's switch logic"""
-        current_time = now()
-        
-        # Calculate when user should have checked in (based on their interval)
-        months_ago = 30 * user.check_in_interval_months  # Approximate months to days
-        check_in_deadline = current_time - timedelta(days=months_ago)
-        
-        # Check if user is past their check-in deadline
-        if user.last_check_in >= check_in_deadline:
-            # User is active, no action needed
-            return
-        
-        self.stdout.write(f"\n📋 Processing user: {user.username}")
-        self.stdout.write(f"   Last check-in: {user.last_check_in}")
-        self.stdout.write(f"   Should check in every: {user.check_in_interval_months} months")
-        self.stdout.write(f"   Grace period: {user.grace_period_days} days")
-        
-        # Check if notification has been sent
-        if user.notification_sent_at is None:
-            # First stage: Send notification
-            self._handle_first_notification(user, dry_run, send_emails)
+        if since is None:
+            self.stdout.write("Full check of all users")
         else:
-            # Check if grace period has expired
-            grace_deadline = user.notification_sent_at + timedelta(days=user.grace_period_days)
-            
-            if current_time >= grace_deadline:
-                # Grace period expired: Trigger delivery
-                self._handle_delivery_trigger(user, dry_run)
-            else:
-                # Still in grace period
-                remaining_days = (grace_deadline - current_time).days
-                self.stdout.write(f"   📧 Notification sent, {remaining_days} days remaining in grace period")
-    
-    def _handle_first_notification(self, user, dry_run, send_emails):
-        """Send first inactivity notification"""
-        self.stdout.write(f"   📧 Sending first inactivity notification...")
-        
+            self.stdout.write(f"Incremental check of deadlines since {since.isoformat()}")
+
         if not dry_run:
-            user.notification_sent_at = now()
-            user.save()
-            self.stdout.write(f"   ✓ Marked notification as sent")
-            
-            if send_emails:
-                success = DeadMansSwitchEmailService.send_check_in_reminder(user)
-                if success:
-                    self.stdout.write(f"   ✓ Email sent successfully to {user.email}")
-                else:
-                    self.stdout.write(f"   ❌ Failed to send email to {user.email}")
-            else:
-                self.stdout.write(f"   📧 [EMAIL DISABLED] Would send reminder to {user.email}")
+            # Buffered check-ins must reach the database before anyone is evaluated
+            flushed = flush_check_ins_safely()
+            if 'error' in flushed:
+                self.stdout.write(self.style.WARNING(f"Could not flush buffered check-ins: {flushed['error']}"))
+            elif flushed['flushed']:
+                self.stdout.write(f"Flushed {flushed['flushed']} buffered check-ins")
+
+        evaluation = None
+        if options['engine'] == 'vectorized':
+            try:
+                from accounts.switch_evaluator import evaluate_switch
+            except ImportError:
+                self.stdout.write(self.style.ERROR("NumPy is required for --engine=vectorized"))
+                return
+            evaluation = evaluate_switch(current_time, since, chunk_size)
+            summary = {
+                'total': sum(len(ids) for ids in evaluation.values()),
+                'overdue': len(evaluation['due']) + len(evaluation['grace']) + len(evaluation['trigger']),
+                'notify': len(evaluation['due']),
+                'trigger': len(evaluation['trigger']),
+            }
         else:
-            self.stdout.write(f"   [DRY RUN] Would send notification to {user.email}")
-    
-    def _handle_delivery_trigger(self, user, dry_run):
-        """Trigger message delivery for user"""
-        messages = LegacyMessage.objects.filter(user=user, status='scheduled')
-        message_count = messages.count()
-        
-        self.stdout.write(f"   🚨 Grace period expired! Triggering delivery of {message_count} messages...")
-        
-        if not dry_run and message_count > 0:
-            # Update all scheduled messages to pending
-            updated = messages.update(status='pending')
-            self.stdout.write(f"   ✓ {updated} messages set to pending for delivery")
-            
-            # Reset user's notification status for future cycles
-            user.notification_sent_at = None
-            user.save()
+            summary = get_switch_summary(current_time, since)
+        self.stdout.write(
+            f"Checked {summary['total']} users: {summary['overdue']} overdue, "
+            f"{summary['notify']} to notify, {summary['trigger']} with expired grace period"
+        )
+
+        if dry_run:
+            self._report_dry_run(current_time, since, chunk_size, evaluation)
+            return
+
+        if partitions > 1:
+            self._handle_partitioned(current_time, partitions, send_emails, chunk_size, options)
+            return
+
+        self._handle_notifications(
+            current_time, since, send_emails, chunk_size, options['wait'], evaluation, options['inline']
+        )
+        self._handle_delivery_triggers(current_time, since, chunk_size, evaluation)
+
+        # Only after both stages finished; a failed run is repeated over the same window
+        advance_watermark(current_time)
+
+    def _handle_partitioned(self, current_time, partitions, send_emails, chunk_size, options):
+        """Fan the full sweep out over id ranges; the chord callback advances the watermark"""
+        result = start_partitioned_sweep(
+            current_time, partitions, chunk_size, send_emails, inline=options['inline']
+        )
+        status = result['status']
+        if status == 'running':
+            self.stdout.write(self.style.WARNING(
+                f"\nFull sweep {result['run_at']} still running ({result['completed']}/{result['partitions']} ranges done), "
+                f"nothing new started"
+            ))
+            return
+        if status == 'completed':
+            self.stdout.write(
+                f"\n✓ Swept {result['partitions']} ranges: {result.get('notified', 0)} notified, "
+                f"{result.get('triggered', 0)} triggered, {result.get('released', 0)} messages released"
+            )
+            return
+
+        self.stdout.write(f"\n✓ Dispatched {result['partitions']} sweep ranges of run {result['run_at']} (chord {result['id']})")
+        if options['wait']:
+            self._wait_for_partitions(result['run_at'])
+
+    def _wait_for_partitions(self, run_at, poll_interval=2):
+        while True:
+            progress = get_sweep_progress()
+            if progress is None or progress['run_at'] != run_at:
+                self.stdout.write("   ✓ All ranges done, watermark advanced")
+                return
+            self.stdout.write(
+                f"   {progress['completed']}/{progress['partitions']} ranges done: {progress['notified']} notified, "
+                f"{progress['triggered']} triggered"
+            )
+            time.sleep(poll_interval)
+
+    def _handle_notifications(self, current_time, since, send_emails, chunk_size, wait=False, evaluation=None,
+                              inline=False):
+        """Mark the notify cohort in one UPDATE, then fan its reminders out to Celery"""
+        if evaluation is None:
+            marked = mark_notified(current_time, since)
+        else:
+            marked = sum(
+                mark_notified(current_time, since, user_ids=user_ids)
+                for user_ids in id_chunks(evaluation['due'], chunk_size)
+            )
+        self.stdout.write(f"\n📧 Marked {marked} users as notified")
+        if not marked:
+            return
+
+        if not send_emails:
+            self.stdout.write(f"   📧 [EMAIL DISABLED] Would send {marked} reminders")
+            return
+
+        if inline:
+            self._send_reminders_inline(current_time, chunk_size)
+            return
+
+        try:
+            result = dispatch_reminders(current_time, chunk_size=chunk_size)
+        except Exception as e:
+            # No broker: send from here, still one SMTP connection per batch
+            self.stdout.write(self.style.WARNING(f"   Could not dispatch reminders to Celery ({e}), sending inline"))
+            self._send_reminders_inline(current_time, chunk_size)
+            return
+
+        self.stdout.write(f"   ✓ {len(result.results)} reminder batches dispatched (group {result.id})")
+        if wait:
+            self._wait_for_reminders(result.id)
+
+    def _send_reminders_inline(self, current_time, chunk_size):
+        sent = 0
+        failed = 0
+        for chunk in iter_chunks(notified_users(current_time), chunk_size):
+            for start in range(0, len(chunk), REMINDER_BATCH_SIZE):
+                results = DeadMansSwitchEmailService.send_check_in_reminders(chunk[start:start + REMINDER_BATCH_SIZE])
+                sent += sum(1 for ok in results.values() if ok)
+                failed += sum(1 for ok in results.values() if not ok)
+        self.stdout.write(f"   ✓ {sent} reminders sent, {failed} failed")
+
+    def _wait_for_reminders(self, group_id, poll_interval=2):
+        while True:
+            progress = get_reminder_progress(group_id)
+            if progress is None:
+                return
+            self.stdout.write(
+                f"   {progress['completed']}/{progress['batches']} batches done, {progress['failed']} failed"
+            )
+            if progress['completed'] + progress['failed'] >= progress['batches']:
+                return
+            time.sleep(poll_interval)
+
+    def _handle_delivery_triggers(self, current_time, since, chunk_size, evaluation=None):
+        """Release scheduled messages of users whose grace period expired, a chunk at a time"""
+        users = 0
+        messages = 0
+        queued = 0
+        if evaluation is None:
+            cohort = trigger_cohort(current_time, since).values_list('pk', flat=True).order_by('pk')
+            chunks = iter_chunks(cohort, chunk_size)
+        else:
+            chunks = id_chunks(evaluation['trigger'], chunk_size)
+        for user_ids in chunks:
+            result = trigger_delivery(user_ids)
+            users += result['users']
+            messages += result['messages']
+            queued += result['queued']
+
+        self.stdout.write(f"\n🚨 Grace period expired: {messages} messages set to pending for {users} users")
+        if users:
+            self.stdout.write(f"   ✓ {queued} messages queued for delivery")
             self.stdout.write(f"   ✓ User notification status reset")
+
+    def _report_dry_run(self, current_time, since, chunk_size, evaluation=None):
+        """List the users each stage would act on"""
+        labels = ('Would send notification to', 'Would trigger delivery for')
+        if evaluation is None:
+            stages = [
+                iter_chunks(cohort.only('id', 'username', 'email').order_by('pk'), chunk_size)
+                for cohort in (notify_cohort(current_time, since), trigger_cohort(current_time, since))
+            ]
         else:
-            if message_count > 0:
-                self.stdout.write(f"   [DRY RUN] Would trigger delivery of {message_count} messages")
-            else:
-                self.stdout.write(f"   ℹ️  No scheduled messages to deliver")
+            stages = [
+                (User.objects.filter(pk__in=user_ids).only('id', 'username', 'email').order_by('pk')
+                 for user_ids in id_chunks(evaluation[stage], chunk_size))
+                for stage in ('due', 'trigger')
+            ]
+        for label, chunks in zip(labels, stages):
+            for chunk in chunks:
+                for user in chunk:
+                    self.stdout.write(f"   [DRY RUN] {label} {user.username} ({user.email})")
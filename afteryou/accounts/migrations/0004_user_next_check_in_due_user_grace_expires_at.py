@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_deadlines(apps, schema_editor):
+    """Fill the new columns with one UPDATE per distinct interval and grace period"""
+    User = apps.get_model('accounts', 'User')
+    users = User.objects.order_by()
+
+    for months in users.values_list('check_in_interval_months', flat=True).distinct():
+        users.filter(check_in_interval_months=months, last_check_in__isnull=False).update(
+            next_check_in_due=F('last_check_in') + timedelta(days=30 * months)
+        )
+    for days in users.values_list('grace_period_days', flat=True).distinct():
+        users.filter(grace_period_days=days, notification_sent_at__isnull=False).update(
+            grace_expires_at=F('notification_sent_at') + timedelta(days=days)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_user_check_in_interval_months_user_grace_period_days_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='next_check_in_due',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='last_check_in plus the check-in interval', null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='grace_expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='notification_sent_at plus the grace period, empty until notified', null=True),
+        ),
+        migrations.RunPython(backfill_deadlines, migrations.RunPython.noop),
+    ]
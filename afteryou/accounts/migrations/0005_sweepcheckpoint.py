@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_next_check_in_due_user_grace_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SweepCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('watermark', models.DateTimeField(help_text='Everything due up to this time has been processed')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
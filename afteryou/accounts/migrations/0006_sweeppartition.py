@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 05:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_sweepcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SweepPartition',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('run_at', models.DateTimeField(help_text='Reference time of the run the range belongs to')),
+                ('lower_id', models.BigIntegerField(help_text='Users with an id above this belong to the range')),
+                ('upper_id', models.BigIntegerField(blank=True, help_text='Last id of the range; empty for the open-ended last range', null=True)),
+                ('cursor', models.BigIntegerField(help_text='Last id processed; a resumed range continues after it')),
+                ('notified', models.PositiveIntegerField(default=0)),
+                ('triggered', models.PositiveIntegerField(default=0)),
+                ('released', models.PositiveIntegerField(default=0)),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'unique_together': {('name', 'run_at', 'lower_id')},
+            },
+        ),
+    ]
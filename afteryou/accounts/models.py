@@ -1,6 +1,10 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils.timezone import now
+from datetime import timedelta
+
+# A check-in interval month is counted as 30 days
+CHECK_IN_MONTH_DAYS = 30
 
 class User(AbstractUser):
     email = models.EmailField(unique=True)
@@ -30,6 +34,69 @@ class User(AbstractUser):
         help_text="Days after notification before triggering delivery"
     )
     
+    # Denormalized deadlines so the dead man's switch sweep is an index range scan
+    next_check_in_due = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="last_check_in plus the check-in interval"
+    )
+    grace_expires_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="notification_sent_at plus the grace period, empty until notified"
+    )
+    
+    def refresh_deadlines(self):
+        """Recompute next_check_in_due and grace_expires_at from the fields they derive from"""
+        self.next_check_in_due = (
+            self.last_check_in + timedelta(days=CHECK_IN_MONTH_DAYS * self.check_in_interval_months)
+            if self.last_check_in else None
+        )
+        self.grace_expires_at = (
+            self.notification_sent_at + timedelta(days=self.grace_period_days)
+            if self.notification_sent_at else None
+        )
+    
+    def save(self, *args, **kwargs):
+        self.refresh_deadlines()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {'next_check_in_due', 'grace_expires_at'}
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return self.username
 
+
+
+class SweepCheckpoint(models.Model):
+    """High-water mark of an incremental sweep, such as the dead man's switch check"""
+    name = models.CharField(max_length=100, unique=True)
+    watermark = models.DateTimeField(help_text="Everything due up to this time has been processed")
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.name} @ {self.watermark.isoformat()}"
+
+
+class SweepPartition(models.Model):
+    """Progress of one id range of a partitioned full sweep, so a dead worker's range can be resumed"""
+    name = models.CharField(max_length=100)
+    run_at = models.DateTimeField(help_text="Reference time of the run the range belongs to")
+    lower_id = models.BigIntegerField(help_text="Users with an id above this belong to the range")
+    upper_id = models.BigIntegerField(null=True, blank=True, help_text="Last id of the range; empty for the open-ended last range")
+    cursor = models.BigIntegerField(help_text="Last id processed; a resumed range continues after it")
+    notified = models.PositiveIntegerField(default=0)
+    triggered = models.PositiveIntegerField(default=0)
+    released = models.PositiveIntegerField(default=0)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        unique_together = ('name', 'run_at', 'lower_id')
+    
+    def __str__(self):
+        return f"{self.name} @ {self.run_at.isoformat()} ({self.lower_id}, {self.upper_id}]"
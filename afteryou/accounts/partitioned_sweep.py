@@ -0,0 +1,334 @@
+"""
+Range-partitioned dead man's switch sweep
+
+A full reconciliation of a very large user table is bound to one process.
+A partitioned run splits the table into ``SWEEP_PARTITIONS['PARTITIONS']``
+id ranges holding about the same number of users, and each range is swept
+by its own Celery task, so sweep time shrinks with the number of workers.
+Within a range users are walked in keyset order (``id > cursor AND
+id <= next``), one chunk at a time, and each chunk goes through the same
+set-based stages as the single sweep.
+
+Only full runs are partitioned. An incremental run selects the few users
+whose deadline passed since the watermark straight from the deadline
+indexes, which is cheaper than walking every id.
+
+Every range has a SweepPartition row recording how far it got. A task
+holds a lease on its range while it works and checkpoints the cursor after
+each chunk; if its worker dies the redelivered task waits for the lease to
+expire and continues after the last checkpoint. A chord callback adds up
+the ranges and advances the sweep watermark once all of them completed. A
+run that stalled (no range updated for ``LEASE_SECONDS``) is superseded by
+the next full run, which covers everything it had left.
+
+Reminders of a chunk are sent after its users are marked, so a chunk
+resumed after a crash may send some reminders twice; none are lost.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import Count, F, Q, Sum
+from django.utils.timezone import now
+from .dead_mans_switch import (
+    CHECKPOINT_NAME, DEFAULT_CHUNK_SIZE, REMINDER_BATCH_SIZE, advance_watermark, in_id_range,
+    mark_notified, notified_users, trigger_cohort, trigger_delivery
+)
+from .models import SweepPartition, User
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SWEEP_PARTITION_SETTINGS = {
+    'LEASE_SECONDS': 900,  # Time a range may go without a checkpoint before another worker takes it over
+}
+
+
+class PartitionLeased(Exception):
+    """Another worker holds the lease on the range"""
+
+    def __init__(self, retry_in):
+        self.retry_in = retry_in
+        super().__init__(f"Range leased by another worker for {retry_in}s")
+
+
+def get_sweep_partition_settings():
+    """Get partitioned sweep settings merged over the defaults"""
+    config = dict(DEFAULT_SWEEP_PARTITION_SETTINGS)
+    config.update(getattr(settings, 'SWEEP_PARTITIONS', {}))
+    return config
+
+
+def partition_bounds(partitions):
+    """
+    Split the user table into id ranges with about the same number of users
+
+    One OFFSET lookup on the primary key index per boundary, so gaps in the
+    ids do not unbalance the ranges.
+
+    Returns:
+        list: (lower_id, upper_id) pairs covering (lower_id, upper_id]; the
+              last range has no upper bound so users created during the run
+              are covered too
+    """
+    ids = User.objects.order_by('pk').values_list('pk', flat=True)
+    total = ids.count()
+    if not total:
+        return []
+
+    bounds = []
+    lower = 0
+    for index in range(1, partitions):
+        position = index * total // partitions - 1
+        if position < 0:
+            # More partitions than users
+            continue
+        upper = ids[position]
+        if upper > lower:
+            bounds.append((lower, upper))
+            lower = upper
+    bounds.append((lower, None))
+    return bounds
+
+
+def create_run(current_time, partitions, name=CHECKPOINT_NAME):
+    """
+    Record the ranges of a new partitioned full run
+
+    Returns:
+        list: Primary keys of the SweepPartition rows
+    """
+    rows = SweepPartition.objects.bulk_create([
+        SweepPartition(name=name, run_at=current_time, lower_id=lower, upper_id=upper, cursor=lower)
+        for lower, upper in partition_bounds(partitions)
+    ])
+    return [row.pk for row in rows]
+
+
+def claim_partition(partition_id, lease_seconds=None):
+    """
+    Take the lease on a range
+
+    Returns:
+        SweepPartition: The claimed range, or a completed one as it is
+
+    Raises:
+        PartitionLeased: Another worker holds an unexpired lease
+    """
+    lease_seconds = lease_seconds or get_sweep_partition_settings()['LEASE_SECONDS']
+    current_time = now()
+    claimed = SweepPartition.objects.filter(
+        Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=current_time),
+        pk=partition_id,
+        completed_at__isnull=True,
+    ).update(lease_expires_at=current_time + timedelta(seconds=lease_seconds))
+
+    partition = SweepPartition.objects.get(pk=partition_id)
+    if not claimed and partition.completed_at is None:
+        raise PartitionLeased(max(int((partition.lease_expires_at - current_time).total_seconds()), 1))
+    return partition
+
+
+def partition_result(partition):
+    return {
+        'partition': partition.pk,
+        'notified': partition.notified,
+        'triggered': partition.triggered,
+        'released': partition.released,
+        'completed': partition.completed_at is not None,
+    }
+
+
+def _send_reminders(user_ids, inline):
+    """Send the reminders of a chunk, from this process or as Celery batches"""
+    from .email_service import DeadMansSwitchEmailService
+    from .tasks import send_check_in_reminders_batch
+
+    for start in range(0, len(user_ids), REMINDER_BATCH_SIZE):
+        batch = user_ids[start:start + REMINDER_BATCH_SIZE]
+        if inline:
+            DeadMansSwitchEmailService.send_check_in_reminders(
+                list(User.objects.filter(pk__in=batch).only('id', 'username', 'email', 'first_name', 'grace_period_days'))
+            )
+        else:
+            send_check_in_reminders_batch.delay(batch)
+
+
+def run_partition(partition_id, send_emails=True, inline=False, chunk_size=None):
+    """
+    Sweep one range, checkpointing after every chunk
+
+    Args:
+        partition_id (int): SweepPartition to sweep
+        send_emails (bool): Send reminders to the users marked as notified
+        inline (bool): Send reminders from this process instead of through Celery
+        chunk_size (int): Users per keyset page, defaults to DEFAULT_CHUNK_SIZE
+
+    Returns:
+        dict: Users 'notified' and 'triggered' and messages 'released' in the range
+
+    Raises:
+        PartitionLeased: Another worker is sweeping the range
+    """
+    chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+    lease = timedelta(seconds=get_sweep_partition_settings()['LEASE_SECONDS'])
+    partition = claim_partition(partition_id)
+    if partition.completed_at is not None:
+        return partition_result(partition)
+
+    run_at = partition.run_at
+    while True:
+        page = list(
+            in_id_range(User.objects.all(), partition.cursor, partition.upper_id)
+            .order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not page:
+            break
+        id_range = (partition.cursor, page[-1])
+
+        notified = mark_notified(run_at, id_range=id_range)
+        if send_emails:
+            # Everyone in the chunk marked by this run, so a resumed chunk does not skip any
+            _send_reminders(list(in_id_range(notified_users(run_at), *id_range).values_list('pk', flat=True)), inline)
+
+        expired = list(in_id_range(trigger_cohort(run_at), *id_range).values_list('pk', flat=True))
+        released = trigger_delivery(expired) if expired else {'users': 0, 'messages': 0}
+
+        SweepPartition.objects.filter(pk=partition.pk).update(
+            cursor=page[-1],
+            notified=F('notified') + notified,
+            triggered=F('triggered') + released['users'],
+            released=F('released') + released['messages'],
+            lease_expires_at=now() + lease,
+            updated_at=now(),
+        )
+        partition.cursor = page[-1]
+
+    SweepPartition.objects.filter(pk=partition.pk).update(completed_at=now(), lease_expires_at=None, updated_at=now())
+    partition.refresh_from_db()
+    logger.info(
+        f"Swept users ({partition.lower_id}, {partition.upper_id or 'end'}]: {partition.notified} notified, "
+        f"{partition.triggered} triggered, {partition.released} messages released"
+    )
+    return partition_result(partition)
+
+
+def get_run_totals(run_at, name=CHECKPOINT_NAME):
+    """Progress of a partitioned run added up over its ranges"""
+    totals = SweepPartition.objects.filter(name=name, run_at=run_at).aggregate(
+        partitions=Count('pk'),
+        completed=Count('pk', filter=Q(completed_at__isnull=False)),
+        notified=Sum('notified'),
+        triggered=Sum('triggered'),
+        released=Sum('released'),
+    )
+    for field in ('notified', 'triggered', 'released'):
+        totals[field] = totals[field] or 0
+    totals['run_at'] = run_at.isoformat()
+    return totals
+
+
+def get_sweep_progress(name=CHECKPOINT_NAME):
+    """
+    Progress of the oldest unfinished partitioned run
+
+    Returns:
+        dict: As from ``get_run_totals``, or None if no run is outstanding
+    """
+    oldest = SweepPartition.objects.filter(name=name).order_by('run_at').first()
+    if oldest is None:
+        return None
+    return get_run_totals(oldest.run_at, name)
+
+
+def finish_run(run_at, name=CHECKPOINT_NAME):
+    """
+    Close a run whose ranges all completed
+
+    The watermark advances to the run's reference time and its
+    SweepPartition rows are removed. A run with unfinished ranges is left
+    in place until the next full run supersedes it.
+
+    Returns:
+        dict: Totals of the run, as from ``get_run_totals``
+    """
+    totals = get_run_totals(run_at, name)
+    if not totals['partitions']:
+        logger.info(f"Partitioned sweep {run_at.isoformat()} was superseded by a newer run")
+    elif totals['completed'] == totals['partitions']:
+        advance_watermark(run_at, name)
+        SweepPartition.objects.filter(name=name, run_at=run_at).delete()
+        logger.info(
+            f"Partitioned sweep {run_at.isoformat()} finished over {totals['partitions']} ranges: "
+            f"{totals['notified']} notified, {totals['triggered']} triggered, {totals['released']} messages released"
+        )
+    else:
+        logger.warning(
+            f"Partitioned sweep {run_at.isoformat()}: {totals['completed']}/{totals['partitions']} ranges completed, "
+            f"watermark not advanced"
+        )
+    return totals
+
+
+def dispatch_partitions(partition_ids, run_at, send_emails=True, chunk_size=None, name=CHECKPOINT_NAME):
+    """Sweep the ranges in parallel as a Celery chord closed by ``finish_switch_sweep``"""
+    from celery import chord
+    from .tasks import finish_switch_sweep, sweep_switch_partition
+
+    header = [sweep_switch_partition.s(partition_id, send_emails, chunk_size) for partition_id in partition_ids]
+    return chord(header)(finish_switch_sweep.si(name, run_at.isoformat()))
+
+
+def run_partitions_inline(partition_ids, run_at, send_emails=True, chunk_size=None, name=CHECKPOINT_NAME):
+    """Sweep the ranges one after another in this process, then close the run"""
+    for partition_id in partition_ids:
+        try:
+            run_partition(partition_id, send_emails=send_emails, inline=True, chunk_size=chunk_size)
+        except PartitionLeased as e:
+            logger.warning(f"Skipping range {partition_id}: {str(e)}")
+    return finish_run(run_at, name)
+
+
+def start_partitioned_sweep(current_time, partitions, chunk_size=None, send_emails=True, inline=False,
+                            name=CHECKPOINT_NAME):
+    """
+    Start a partitioned full run
+
+    An outstanding run whose ranges were updated within ``LEASE_SECONDS`` is
+    a full run still in progress, and nothing new is started. A stalled run
+    is dropped: the new run re-evaluates every user as of ``current_time``,
+    which covers whatever the stalled run had left. If Celery is
+    unavailable the ranges are swept in this process.
+
+    Returns:
+        dict: 'status' ('running', 'dispatched' or 'completed'), the run's
+              'run_at', and 'partitions' dispatched or its totals
+    """
+    lease = timedelta(seconds=get_sweep_partition_settings()['LEASE_SECONDS'])
+    previous = SweepPartition.objects.filter(name=name).order_by('run_at').first()
+    if previous is not None:
+        run = SweepPartition.objects.filter(name=name, run_at=previous.run_at)
+        if not run.filter(completed_at__isnull=True).exists():
+            # Every range completed but the chord callback never ran
+            finish_run(previous.run_at, name)
+        elif run.filter(updated_at__gt=now() - lease).exists():
+            logger.warning(f"Full sweep {previous.run_at.isoformat()} still running, not starting another")
+            return dict(get_run_totals(previous.run_at, name), status='running')
+        else:
+            logger.warning(f"Superseding stalled sweep {previous.run_at.isoformat()} with a new full run")
+            SweepPartition.objects.filter(name=name).delete()
+
+    partition_ids = create_run(current_time, partitions, name)
+    if not partition_ids:
+        advance_watermark(current_time, name)
+        return {'status': 'completed', 'run_at': current_time.isoformat(), 'partitions': 0}
+    return _dispatch(partition_ids, current_time, send_emails, chunk_size, inline, name, status='dispatched')
+
+
+def _dispatch(partition_ids, run_at, send_emails, chunk_size, inline, name, status):
+    if not inline:
+        try:
+            result = dispatch_partitions(partition_ids, run_at, send_emails, chunk_size, name)
+            return {'status': status, 'run_at': run_at.isoformat(), 'partitions': len(partition_ids), 'id': result.id}
+        except Exception as e:
+            # No broker: sweep the ranges from here
+            logger.warning(f"Could not dispatch sweep ranges to Celery, sweeping inline: {str(e)}")
+    return dict(run_partitions_inline(partition_ids, run_at, send_emails, chunk_size, name), status='completed')
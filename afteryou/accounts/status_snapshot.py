@@ -0,0 +1,149 @@
+"""
+Cached per-user status snapshot
+
+The dashboard polls several endpoints that all need the same things: the
+user's check-in deadlines, their message counts by status and their number
+of digital lockers. The snapshot gathers them once (one Mongo aggregation
+instead of a count per status) and keeps them in Django's cache, so a poll
+is a single cache read. Whether the user is overdue or in the grace period
+depends on the clock, so it is derived from the cached deadlines at read
+time.
+
+Check-ins, settings changes and message creates, updates and deletes
+invalidate the snapshot. Status changes made in bulk by workers and the
+dead man's switch are bounded by ``STATUS_SNAPSHOT['TTL']``. If the cache
+is unavailable the snapshot is built on every call.
+"""
+import logging
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.timezone import now
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'status_snapshot:'
+
+MESSAGE_STATUSES = ('created', 'scheduled', 'pending', 'sent', 'failed')
+
+DEFAULT_SNAPSHOT_SETTINGS = {
+    'ENABLED': True,
+    'TTL': 60,  # Seconds a snapshot is served before it is rebuilt
+}
+
+
+def get_snapshot_settings():
+    """Get status snapshot settings merged over the defaults"""
+    config = dict(DEFAULT_SNAPSHOT_SETTINGS)
+    config.update(getattr(settings, 'STATUS_SNAPSHOT', {}))
+    return config
+
+
+def snapshot_key(user_id):
+    return f'{CACHE_KEY_PREFIX}{user_id}'
+
+
+def count_messages(user_id):
+    """Message counts of a user by status, from one aggregation"""
+    from legacy.models import LegacyMessage
+
+    counts = dict.fromkeys(MESSAGE_STATUSES, 0)
+    pipeline = [{'$group': {'_id': '$status', 'count': {'$sum': 1}}}]
+    for row in LegacyMessage.objects(user_id=str(user_id)).aggregate(pipeline):
+        counts[row['_id']] = row['count']
+    counts['total'] = sum(counts.values())
+    return counts
+
+
+def build_snapshot(user):
+    """
+    Gather the status of a user from the database, Mongo and buffered check-ins
+
+    Returns:
+        dict: 'check_in' deadlines and settings, 'messages' counts by status
+              (None if Mongo is unavailable) and 'digital_lockers'
+    """
+    from legacy.digital_locker_models import DigitalLocker
+    from .check_ins import apply_pending_check_in
+
+    user = apply_pending_check_in(user)
+    snapshot = {
+        'check_in': {
+            'last_check_in': user.last_check_in,
+            'next_check_in_due': user.next_check_in_due,
+            'notification_sent_at': user.notification_sent_at,
+            'grace_expires_at': user.grace_expires_at,
+            'check_in_interval_months': user.check_in_interval_months,
+            'grace_period_days': user.grace_period_days,
+        },
+        'messages': None,
+        'digital_lockers': DigitalLocker.objects.filter(user=user).count(),
+        'built_at': now(),
+    }
+    try:
+        snapshot['messages'] = count_messages(user.pk)
+    except Exception as e:
+        logger.warning(f"Could not count messages of user {user.pk}: {str(e)}")
+    return snapshot
+
+
+def get_status_snapshot(user):
+    """
+    Status snapshot of a user, from the cache when there is a fresh one
+
+    Snapshots without message counts are not cached, so a Mongo outage does
+    not hide the counts for a whole TTL.
+    """
+    config = get_snapshot_settings()
+    if not config['ENABLED']:
+        return build_snapshot(user)
+
+    key = snapshot_key(user.pk)
+    try:
+        snapshot = cache.get(key)
+        if snapshot is not None:
+            return snapshot
+    except Exception as e:
+        logger.warning(f"Status snapshot cache unavailable: {str(e)}")
+        return build_snapshot(user)
+
+    snapshot = build_snapshot(user)
+    if snapshot['messages'] is not None:
+        try:
+            cache.set(key, snapshot, config['TTL'])
+        except Exception as e:
+            logger.warning(f"Could not cache status snapshot of user {user.pk}: {str(e)}")
+    return snapshot
+
+
+def invalidate_status_snapshot(*user_ids):
+    """Drop the cached snapshots of the given users; failures are logged"""
+    keys = [snapshot_key(user_id) for user_id in user_ids if user_id is not None]
+    if not keys or not get_snapshot_settings()['ENABLED']:
+        return
+    try:
+        cache.delete_many(keys)
+    except Exception as e:
+        logger.warning(f"Could not invalidate status snapshots: {str(e)}")
+
+
+def check_in_state(snapshot, current_time=None):
+    """
+    Check-in fields as the status endpoints return them
+
+    Returns:
+        dict: Deadlines as ISO strings plus 'is_overdue' and 'in_grace_period'
+    """
+    current_time = current_time or now()
+    check_in = snapshot['check_in']
+    next_check_in_due = check_in['next_check_in_due']
+    grace_expires_at = check_in['grace_expires_at']
+    return {
+        'last_check_in': check_in['last_check_in'].isoformat() if check_in['last_check_in'] else None,
+        'next_check_in_due': next_check_in_due.isoformat() if next_check_in_due else None,
+        'check_in_interval_months': check_in['check_in_interval_months'],
+        'grace_period_days': check_in['grace_period_days'],
+        'is_overdue': bool(next_check_in_due and current_time > next_check_in_due),
+        'notification_sent_at': check_in['notification_sent_at'].isoformat() if check_in['notification_sent_at'] else None,
+        'in_grace_period': bool(grace_expires_at and current_time < grace_expires_at),
+        'grace_period_end': grace_expires_at.isoformat() if grace_expires_at else None,
+    }
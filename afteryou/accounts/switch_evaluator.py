@@ -0,0 +1,154 @@
+"""
+Vectorized evaluation of the dead man's switch
+
+Loads the four fields the switch depends on (``last_check_in``,
+``check_in_interval_months``, ``notification_sent_at`` and
+``grace_period_days``) for every user into columnar NumPy arrays, streaming
+them in chunks, and computes each user's stage with array operations instead
+of a Python loop. The result is a compact id array per stage, used for
+capacity planning and by ``trigger_inactive_users --engine=vectorized``.
+
+Stages follow the cohorts in ``dead_mans_switch``:
+    active:  before the check-in deadline
+    due:     past the deadline and not yet notified
+    grace:   notified, grace period still running
+    trigger: notified and the grace period has expired
+
+NumPy is only needed for this module; the default SQL engine does not use it.
+"""
+import logging
+import numpy as np
+from django.utils.timezone import now
+from .dead_mans_switch import DEFAULT_CHUNK_SIZE
+from .models import CHECK_IN_MONTH_DAYS, User
+
+logger = logging.getLogger(__name__)
+
+STAGES = ('active', 'due', 'grace', 'trigger')
+ACTIVE, DUE, GRACE, TRIGGER = range(len(STAGES))
+
+DAY_SECONDS = 86400
+
+SWITCH_FIELDS = ('pk', 'last_check_in', 'check_in_interval_months', 'notification_sent_at', 'grace_period_days')
+
+
+def _timestamp(value):
+    return value.timestamp() if value is not None else np.nan
+
+
+def load_columns(queryset=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Load the switch fields of every user into NumPy arrays
+
+    Times are Unix seconds as float64, NaN where the field is empty.
+
+    Args:
+        queryset: Users to load, defaults to all users
+        chunk_size (int): Rows fetched per round trip
+
+    Returns:
+        dict: 'ids', 'last_check_in', 'interval_months', 'notified_at' and 'grace_days' arrays
+    """
+    queryset = (queryset if queryset is not None else User.objects.all()).order_by('pk')
+    size = queryset.count()
+    columns = {
+        'ids': np.empty(size, dtype=np.int64),
+        'last_check_in': np.empty(size, dtype=np.float64),
+        'interval_months': np.empty(size, dtype=np.int32),
+        'notified_at': np.empty(size, dtype=np.float64),
+        'grace_days': np.empty(size, dtype=np.int32),
+    }
+
+    index = 0
+    chunk = []
+    rows = queryset.values_list(*SWITCH_FIELDS).iterator(chunk_size=chunk_size)
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            index = _fill(columns, chunk, index)
+            chunk = []
+    if chunk:
+        index = _fill(columns, chunk, index)
+
+    # Users created while loading are left for the next run
+    if index < size:
+        columns = {name: array[:index] for name, array in columns.items()}
+    return columns
+
+
+def _fill(columns, chunk, index):
+    end = min(index + len(chunk), len(columns['ids']))
+    chunk = chunk[:end - index]
+    ids, last_check_in, interval_months, notified_at, grace_days = zip(*chunk)
+    columns['ids'][index:end] = ids
+    columns['last_check_in'][index:end] = [_timestamp(value) for value in last_check_in]
+    columns['interval_months'][index:end] = interval_months
+    columns['notified_at'][index:end] = [_timestamp(value) for value in notified_at]
+    columns['grace_days'][index:end] = grace_days
+    return end
+
+
+def compute_stages(columns, current_time=None):
+    """
+    Stage of every user in ``columns``
+
+    Returns:
+        numpy.ndarray: One of ACTIVE, DUE, GRACE or TRIGGER per user
+    """
+    reference = (current_time or now()).timestamp()
+    due_at = columns['last_check_in'] + columns['interval_months'] * (CHECK_IN_MONTH_DAYS * DAY_SECONDS)
+    grace_ends_at = columns['notified_at'] + columns['grace_days'] * DAY_SECONDS
+
+    # Comparisons with NaN are False, so users without a check-in stay active
+    overdue = due_at < reference
+    notified = ~np.isnan(columns['notified_at'])
+
+    stages = np.full(len(columns['ids']), ACTIVE, dtype=np.int8)
+    stages[overdue & ~notified] = DUE
+    stages[overdue & notified] = GRACE
+    stages[overdue & (grace_ends_at <= reference)] = TRIGGER
+    return stages
+
+
+def evaluate(columns, current_time=None, since=None):
+    """
+    Ids of the users in each stage
+
+    Args:
+        columns (dict): Arrays from ``load_columns``
+        current_time (datetime): Reference time, defaults to now
+        since (datetime): Like the incremental cohorts, keep only users whose
+            deadline (due) or grace expiry (trigger) passed after this time
+
+    Returns:
+        dict: Stage name to an int64 array of user ids
+    """
+    current_time = current_time or now()
+    stages = compute_stages(columns, current_time)
+    ids = columns['ids']
+    result = {name: ids[stages == stage] for stage, name in enumerate(STAGES)}
+
+    if since is not None:
+        cutoff = since.timestamp()
+        due_at = columns['last_check_in'] + columns['interval_months'] * (CHECK_IN_MONTH_DAYS * DAY_SECONDS)
+        grace_ends_at = columns['notified_at'] + columns['grace_days'] * DAY_SECONDS
+        result['due'] = ids[(stages == DUE) & (due_at >= cutoff)]
+        result['trigger'] = ids[(stages == TRIGGER) & (grace_ends_at > cutoff)]
+    return result
+
+
+def evaluate_switch(current_time=None, since=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Load every user and evaluate the switch in one pass
+
+    Returns:
+        dict: Stage name to an array of user ids, as from ``evaluate``
+    """
+    columns = load_columns(chunk_size=chunk_size)
+    result = evaluate(columns, current_time, since)
+    logger.info(
+        "Evaluated dead man's switch for "
+        f"{len(columns['ids'])} users: "
+        + ', '.join(f"{len(result[name])} {name}" for name in STAGES)
+    )
+    return result
@@ -6,16 +6,22 @@ import logging
 logger = logging.getLogger(__name__)
 
 @shared_task
-def check_dead_mans_switch():
+def check_dead_mans_switch(full=False, partitions=1):
     """
     Celery task to check for inactive users and trigger dead man's switch logic.
-    This task runs daily and handles both notifications and message delivery.
+    This task runs hourly over the deadlines passed since the previous run, and
+    daily as a full check; it handles both notifications and message delivery.
+    With partitions above 1 a full check sweeps the user table as parallel
+    id ranges; incremental checks are never partitioned.
     """
     try:
-        logger.info("Starting dead man's switch check...")
+        logger.info(f"Starting {'full ' if full else ''}dead man's switch check...")
         
         # Call the management command with email sending enabled
-        call_command('trigger_inactive_users', '--send-emails')
+        args = ['--send-emails'] + (['--full'] if full else [])
+        if full and partitions > 1:
+            args.append(f'--partitions={partitions}')
+        call_command('trigger_inactive_users', *args)
         
         logger.info("Dead man's switch check completed successfully")
         return "Dead man's switch check completed"
@@ -24,6 +30,49 @@ def check_dead_mans_switch():
         logger.error(f"Error in dead man's switch check: {str(e)}")
         raise
 
+@shared_task(bind=True, acks_late=True, reject_on_worker_lost=True, max_retries=10)
+def sweep_switch_partition(self, partition_id, send_emails=True, chunk_size=None):
+    """
+    Task sweeping one id range of a partitioned dead man's switch run.
+    Progress is checkpointed per chunk; a task redelivered after its worker died
+    waits for the dead worker's lease to expire and continues from the checkpoint.
+    """
+    from accounts.models import SweepPartition
+    from accounts.partitioned_sweep import PartitionLeased, run_partition
+    
+    try:
+        return run_partition(partition_id, send_emails=send_emails, chunk_size=chunk_size)
+    except PartitionLeased as e:
+        raise self.retry(countdown=e.retry_in)
+    except SweepPartition.DoesNotExist:
+        logger.info(f"Sweep range {partition_id} belongs to a finished run")
+        return None
+    except Exception as e:
+        logger.error(f"Error sweeping range {partition_id}: {str(e)}")
+        raise self.retry(exc=e, countdown=60)
+
+@shared_task
+def finish_switch_sweep(name, run_at):
+    """
+    Chord callback of a partitioned sweep: add up the ranges and advance the watermark.
+    """
+    from django.utils.dateparse import parse_datetime
+    from accounts.partitioned_sweep import finish_run
+    
+    return finish_run(parse_datetime(run_at), name)
+
+@shared_task
+def flush_pending_check_ins():
+    """
+    Celery task writing buffered check-ins to the database in batches.
+    """
+    from accounts.check_ins import flush_check_ins_safely
+    
+    result = flush_check_ins_safely()
+    if 'error' in result:
+        logger.error(f"Flushing buffered check-ins failed: {result['error']}")
+    return result
+
 @shared_task
 def send_check_in_reminder(user_id):
     """
@@ -53,34 +102,47 @@ def send_check_in_reminder(user_id):
         logger.error(f"Error sending check-in reminder: {str(e)}")
         raise
 
+@shared_task(bind=True, max_retries=100)
+def send_check_in_reminders_batch(self, user_ids):
+    """
+    Task to send check-in reminders to a chunk of users over one SMTP connection.
+    The sweep has already marked these users as notified. While the SMTP circuit
+    breaker is open the unsent part of the chunk is retried once it may have closed.
+    """
+    from accounts.models import User
+    from accounts.email_service import DeadMansSwitchEmailService
+    from legacy.circuit_breaker import get_breaker_settings
+    
+    users = list(
+        User.objects.filter(pk__in=user_ids).only('id', 'username', 'email', 'first_name', 'grace_period_days')
+    )
+    results = DeadMansSwitchEmailService.send_check_in_reminders(users)
+    
+    deferred = [user_id for user_id, sent in results.items() if sent is None]
+    if deferred:
+        logger.warning(f"SMTP unavailable, retrying {len(deferred)} check-in reminders later")
+        raise self.retry(args=(deferred,), countdown=get_breaker_settings()['OPEN_SECONDS'])
+    
+    sent = sum(1 for ok in results.values() if ok)
+    logger.info(f"Check-in reminder batch: {sent} sent, {len(results) - sent} failed")
+    return {'sent': sent, 'failed': len(results) - sent}
+
 @shared_task
 def trigger_user_message_delivery(user_id):
     """
     Task to trigger message delivery for a specific user.
     """
-    from accounts.models import User
-    from legacy.models import LegacyMessage
+    from accounts.dead_mans_switch import trigger_delivery
     
     try:
-        user = User.objects.get(id=user_id)
-        messages = LegacyMessage.objects.filter(user=user, status='scheduled')
+        result = trigger_delivery([user_id])
         
-        if messages.exists():
-            updated = messages.update(status='pending')
-            
-            # Reset user's notification status for future cycles
-            user.notification_sent_at = None
-            user.save()
-            
-            logger.info(f"Triggered delivery of {updated} messages for user {user.username}")
-            return updated
+        if result['messages']:
+            logger.info(f"Triggered delivery of {result['messages']} messages for user {user_id}")
         else:
-            logger.info(f"No scheduled messages found for user {user.username}")
-            return 0
+            logger.info(f"No scheduled messages queued for user {user_id}")
+        return result['messages']
             
-    except User.DoesNotExist:
-        logger.error(f"User with ID {user_id} not found")
-        return 0
     except Exception as e:
         logger.error(f"Error triggering message delivery: {str(e)}")
         raise
@@ -1,3 +1,450 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+from legacy.circuit_breaker import CircuitOpen
+from legacy.task_backends import LANE_BULK
+from .check_ins import PENDING_KEY, apply_pending_check_in, flush_check_ins, record_check_in
+from .dead_mans_switch import get_watermark, trigger_delivery
+from .deadline_timers import REMINDER, DeadlineTimerService
+from .email_service import DeadMansSwitchEmailService
+from .models import CHECK_IN_MONTH_DAYS, SweepPartition, User
+from .partitioned_sweep import (
+    PartitionLeased, create_run, finish_run, partition_bounds, run_partition, start_partitioned_sweep
+)
+from .tasks import send_check_in_reminders_batch
+from .timing_wheel import TimingWheel
 
-# Create your tests here.
+
+def create_overdue_users(count, current_time, prefix='user'):
+    """Users one day past a one-month check-in deadline, not yet notified"""
+    return [
+        User.objects.create(
+            username=f'{prefix}-{index}',
+            email=f'{prefix}-{index}@example.com',
+            check_in_interval_months=1,
+            grace_period_days=7,
+            last_check_in=current_time - timedelta(days=CHECK_IN_MONTH_DAYS + 1),
+        )
+        for index in range(count)
+    ]
+
+
+def no_release(user_ids):
+    return {'users': 0, 'messages': 0, 'queued': 0}
+
+
+class FakeMessages:
+    """Stands in for ``LegacyMessage.objects`` over a list of message dicts"""
+
+    def __init__(self, *messages):
+        self.messages = [dict(message) for message in messages]
+
+    def __call__(self, **query):
+        matches = [message for message in self.messages if self.matches(message, query)]
+        return mock.Mock(
+            scalar=lambda *fields: [tuple(message[field] for field in fields) for message in matches],
+            update=lambda set__status: self.update(matches, set__status),
+        )
+
+    def matches(self, message, query):
+        for lookup, value in query.items():
+            field, _, operator = lookup.partition('__')
+            if operator == 'in':
+                if message[field] not in value:
+                    return False
+            elif message[field] != value:
+                return False
+        return True
+
+    def update(self, matches, status):
+        for message in matches:
+            message['status'] = status
+        return len(matches)
+
+    def statuses(self):
+        return {message['id']: message['status'] for message in self.messages}
+
+
+class PartitionBoundsTests(TestCase):
+    def assert_covers(self, bounds, user_ids):
+        ranges = [
+            [user_id for user_id in user_ids if user_id > lower and (upper is None or user_id <= upper)]
+            for lower, upper in bounds
+        ]
+        self.assertEqual(sorted(user_id for users in ranges for user_id in users), sorted(user_ids))
+        return [len(users) for users in ranges]
+
+    def test_no_users_no_ranges(self):
+        self.assertEqual(partition_bounds(4), [])
+
+    def test_ranges_are_balanced_despite_id_gaps(self):
+        users = create_overdue_users(40, now())
+        User.objects.filter(pk__in=[user.pk for user in users[5:20]]).delete()
+        user_ids = list(User.objects.values_list('pk', flat=True))
+
+        bounds = partition_bounds(4)
+
+        self.assertEqual(len(bounds), 4)
+        self.assertEqual(bounds[0][0], 0)
+        self.assertIsNone(bounds[-1][1])
+        for (_, upper), (lower, _) in zip(bounds, bounds[1:]):
+            self.assertEqual(upper, lower)
+        sizes = self.assert_covers(bounds, user_ids)
+        self.assertLessEqual(max(sizes) - min(sizes), 1)
+
+    def test_more_partitions_than_users(self):
+        create_overdue_users(3, now())
+
+        bounds = partition_bounds(8)
+
+        sizes = self.assert_covers(bounds, list(User.objects.values_list('pk', flat=True)))
+        self.assertEqual(sizes, [1, 1, 1])
+
+
+@mock.patch('accounts.partitioned_sweep.trigger_delivery', side_effect=no_release)
+class PartitionedSweepTests(TestCase):
+    def setUp(self):
+        self.current_time = now()
+
+    def test_expired_lease_resumes_from_cursor(self, trigger_delivery):
+        users = create_overdue_users(6, self.current_time)
+        partition_id, = create_run(self.current_time, 1)
+        SweepPartition.objects.filter(pk=partition_id).update(
+            cursor=users[2].pk,
+            lease_expires_at=self.current_time + timedelta(minutes=5),
+        )
+
+        with self.assertRaises(PartitionLeased):
+            run_partition(partition_id, send_emails=False, chunk_size=2)
+
+        SweepPartition.objects.filter(pk=partition_id).update(lease_expires_at=self.current_time - timedelta(minutes=1))
+        result = run_partition(partition_id, send_emails=False, chunk_size=2)
+
+        self.assertEqual(result['notified'], 3)
+        self.assertTrue(result['completed'])
+        notified = set(User.objects.filter(notification_sent_at__isnull=False).values_list('pk', flat=True))
+        self.assertEqual(notified, {user.pk for user in users[3:]})
+
+    def test_watermark_moves_only_when_every_range_completes(self, trigger_delivery):
+        create_overdue_users(4, self.current_time)
+        first, second = create_run(self.current_time, 2)
+
+        run_partition(first, send_emails=False)
+        finish_run(self.current_time)
+        self.assertIsNone(get_watermark())
+        self.assertEqual(SweepPartition.objects.count(), 2)
+
+        run_partition(second, send_emails=False)
+        totals = finish_run(self.current_time)
+        self.assertEqual(get_watermark(), self.current_time)
+        self.assertEqual(totals['notified'], 4)
+        self.assertFalse(SweepPartition.objects.exists())
+
+    def test_active_run_is_left_running(self, trigger_delivery):
+        create_overdue_users(4, self.current_time)
+        first, _ = create_run(self.current_time, 2)
+        run_partition(first, send_emails=False)
+
+        result = start_partitioned_sweep(self.current_time + timedelta(hours=1), 2, send_emails=False, inline=True)
+
+        self.assertEqual(result['status'], 'running')
+        self.assertIsNone(get_watermark())
+        self.assertEqual(SweepPartition.objects.count(), 2)
+
+    def test_stalled_run_is_superseded_by_a_full_run(self, trigger_delivery):
+        create_overdue_users(4, self.current_time)
+        first, _ = create_run(self.current_time, 2)
+        run_partition(first, send_emails=False)
+        SweepPartition.objects.update(updated_at=self.current_time - timedelta(hours=1))
+
+        later = self.current_time + timedelta(minutes=1)
+        result = start_partitioned_sweep(later, 2, send_emails=False, inline=True)
+
+        self.assertEqual(result['status'], 'completed')
+        self.assertEqual(result['completed'], result['partitions'])
+        self.assertEqual(get_watermark(), later)
+        self.assertFalse(SweepPartition.objects.exists())
+        self.assertFalse(User.objects.filter(notification_sent_at__isnull=True).exists())
+
+    def test_completed_run_is_closed_before_a_new_one(self, trigger_delivery):
+        create_overdue_users(2, self.current_time)
+        for partition_id in create_run(self.current_time, 2):
+            run_partition(partition_id, send_emails=False)
+
+        later = self.current_time + timedelta(minutes=1)
+        start_partitioned_sweep(later, 2, send_emails=False, inline=True)
+
+        self.assertEqual(get_watermark(), later)
+        self.assertFalse(SweepPartition.objects.exists())
+
+
+class FakeRedis:
+    """The hash commands and delete-if-unchanged script used for buffered check-ins"""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def encode(self, value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[self.encode(field)] = self.encode(value)
+
+    def hget(self, key, field):
+        return self.hashes.get(key, {}).get(self.encode(field))
+
+    def hmget(self, key, fields):
+        return [self.hget(key, field) for field in fields]
+
+    def hgetall(self, key):
+        return dict(self.hashes.get(key, {}))
+
+    def hdel(self, key, field):
+        return 1 if self.hashes.get(key, {}).pop(self.encode(field), None) is not None else 0
+
+    def eval(self, script, numkeys, key, field, value):
+        if self.hget(key, field) == self.encode(value):
+            return self.hdel(key, field)
+        return 0
+
+    def pipeline(self, transaction=True):
+        return mock.Mock(eval=self.eval, execute=lambda: [])
+
+
+@override_settings(CHECK_INS={'WRITE_BEHIND': True})
+@mock.patch('accounts.check_ins.invalidate_status_snapshot')
+class WriteBehindCheckInTests(TestCase):
+    def setUp(self):
+        self.redis = FakeRedis()
+        patcher = mock.patch('accounts.check_ins.get_shared_redis_connection', return_value=self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.current_time = now().replace(microsecond=0)
+        self.user = User.objects.create(
+            username='checker',
+            email='checker@example.com',
+            check_in_interval_months=1,
+            grace_period_days=7,
+            last_check_in=self.current_time - timedelta(days=10),
+        )
+
+    def test_buffered_check_in_is_applied_before_the_flush(self, invalidate):
+        self.assertTrue(record_check_in(self.user, self.current_time))
+
+        stored = User.objects.get(pk=self.user.pk)
+        self.assertEqual(stored.last_check_in, self.current_time - timedelta(days=10))
+        apply_pending_check_in(stored)
+        self.assertEqual(stored.last_check_in, self.current_time)
+        self.assertEqual(stored.next_check_in_due, self.current_time + timedelta(days=CHECK_IN_MONTH_DAYS))
+
+    def test_flush_writes_the_deadlines(self, invalidate):
+        notified_at = self.current_time - timedelta(days=2)
+        User.objects.filter(pk=self.user.pk).update(
+            notification_sent_at=notified_at,
+            grace_expires_at=notified_at + timedelta(days=7),
+        )
+        self.redis.hset(PENDING_KEY, self.user.pk, self.current_time.timestamp())
+
+        result = flush_check_ins()
+
+        self.assertEqual(result, {'flushed': 1, 'pending': 1})
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_check_in, self.current_time)
+        self.assertEqual(self.user.next_check_in_due, self.current_time + timedelta(days=CHECK_IN_MONTH_DAYS))
+        self.assertIsNone(self.user.notification_sent_at)
+        self.assertIsNone(self.user.grace_expires_at)
+        self.assertEqual(self.redis.hgetall(PENDING_KEY), {})
+
+    def test_check_in_during_the_flush_is_kept(self, invalidate):
+        record_check_in(self.user, self.current_time)
+        later = self.current_time + timedelta(minutes=5)
+        bulk_update = User.objects.bulk_update
+
+        def check_in_again(*args, **kwargs):
+            self.redis.hset(PENDING_KEY, self.user.pk, later.timestamp())
+            return bulk_update(*args, **kwargs)
+
+        with mock.patch.object(User.objects, 'bulk_update', side_effect=check_in_again):
+            flush_check_ins()
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_check_in, self.current_time)
+        self.assertEqual(self.redis.hget(PENDING_KEY, self.user.pk), str(later.timestamp()).encode())
+
+        flush_check_ins()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.last_check_in, later)
+        self.assertEqual(self.redis.hgetall(PENDING_KEY), {})
+
+
+@mock.patch('accounts.dead_mans_switch.invalidate_status_snapshot')
+@mock.patch('accounts.dead_mans_switch.enqueue_immediate_deliveries')
+class TriggerDeliveryTests(TestCase):
+    def setUp(self):
+        self.current_time = now()
+        self.first, self.second = create_overdue_users(2, self.current_time)
+        User.objects.update(notification_sent_at=self.current_time - timedelta(days=8))
+        self.messages = FakeMessages(
+            {'id': 'a', 'user_id': str(self.first.pk), 'status': 'scheduled'},
+            {'id': 'b', 'user_id': str(self.first.pk), 'status': 'sent'},
+            {'id': 'c', 'user_id': str(self.second.pk), 'status': 'scheduled'},
+        )
+        patcher = mock.patch('accounts.dead_mans_switch.LegacyMessage.objects', self.messages)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_scheduled_messages_are_claimed_and_queued(self, enqueue, invalidate):
+        enqueue.return_value = ['job-a', 'job-c']
+
+        result = trigger_delivery([self.first.pk, self.second.pk])
+
+        self.assertEqual(result, {'users': 2, 'messages': 2, 'queued': 2})
+        enqueue.assert_called_once_with(['a', 'c'], lane=LANE_BULK)
+        self.assertEqual(self.messages.statuses(), {'a': 'pending', 'b': 'sent', 'c': 'pending'})
+        self.assertFalse(User.objects.filter(notification_sent_at__isnull=False).exists())
+        self.assertFalse(User.objects.filter(grace_expires_at__isnull=False).exists())
+        self.assertEqual(set(invalidate.call_args.args), {str(self.first.pk), str(self.second.pk)})
+
+    def test_queueing_failure_puts_messages_back(self, enqueue, invalidate):
+        enqueue.return_value = []
+
+        result = trigger_delivery([self.first.pk, self.second.pk])
+
+        self.assertEqual(result, {'users': 0, 'messages': 0, 'queued': 0})
+        self.assertEqual(self.messages.statuses(), {'a': 'scheduled', 'b': 'sent', 'c': 'scheduled'})
+        self.assertEqual(User.objects.filter(notification_sent_at__isnull=False).count(), 2)
+        invalidate.assert_not_called()
+
+    def test_user_without_scheduled_messages_is_left_alone(self, enqueue, invalidate):
+        self.messages.messages[0]['status'] = 'sent'
+        enqueue.return_value = ['job-c']
+
+        result = trigger_delivery([self.first.pk, self.second.pk])
+
+        self.assertEqual(result, {'users': 1, 'messages': 1, 'queued': 1})
+        enqueue.assert_called_once_with(['c'], lane=LANE_BULK)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertIsNotNone(self.first.notification_sent_at)
+        self.assertIsNone(self.second.notification_sent_at)
+
+    def test_no_scheduled_messages_queues_nothing(self, enqueue, invalidate):
+        user, = create_overdue_users(1, self.current_time, prefix='other')
+
+        result = trigger_delivery([user.pk])
+
+        self.assertEqual(result, {'users': 0, 'messages': 0, 'queued': 0})
+        enqueue.assert_not_called()
+
+
+class CheckInReminderBatchTests(TestCase):
+    def setUp(self):
+        self.users = create_overdue_users(3, now())
+
+    @mock.patch('accounts.email_service.get_connection')
+    @mock.patch('accounts.email_service.allow_request', side_effect=CircuitOpen(60))
+    def test_open_breaker_defers_every_user(self, allow_request, get_connection):
+        results = DeadMansSwitchEmailService.send_check_in_reminders(self.users)
+
+        self.assertEqual(results, {user.pk: None for user in self.users})
+        get_connection.assert_not_called()
+
+    @mock.patch('accounts.email_service.record_success')
+    @mock.patch('accounts.email_service.record_failure', return_value=True)
+    @mock.patch('accounts.email_service.get_connection')
+    @mock.patch('accounts.email_service.allow_request')
+    def test_batch_retries_only_users_deferred_by_an_outage(self, allow_request, get_connection,
+                                                           record_failure, record_success):
+        # The first reminder goes out, then the relay goes away and opens the breaker
+        emails = [mock.Mock(), mock.Mock()]
+        emails[0].send.return_value = 1
+        emails[1].send.side_effect = ConnectionRefusedError()
+
+        with mock.patch.object(DeadMansSwitchEmailService, '_build_check_in_reminder', side_effect=emails), \
+                mock.patch.object(send_check_in_reminders_batch, 'retry', return_value=RuntimeError()) as retry:
+            with self.assertRaises(RuntimeError):
+                send_check_in_reminders_batch([user.pk for user in self.users])
+
+        deferred, = retry.call_args.kwargs['args']
+        self.assertEqual(sorted(deferred), sorted(user.pk for user in self.users[1:]))
+
+
+class TimingWheelTests(SimpleTestCase):
+    def test_timer_fires_on_its_tick(self):
+        wheel = TimingWheel(start=0)
+        wheel.schedule('a', 5, payload='payload')
+
+        self.assertEqual(wheel.advance(4), [])
+        self.assertEqual(wheel.advance(5), [('a', 'payload')])
+        self.assertEqual(len(wheel), 0)
+
+    def test_past_time_fires_on_next_tick(self):
+        wheel = TimingWheel(start=100)
+        wheel.schedule('a', 50)
+
+        self.assertEqual(wheel.advance(101), [('a', None)])
+
+    def test_timer_cascades_down_to_its_exact_tick(self):
+        wheel = TimingWheel(start=0)
+        hours = 2 * 3600 + 61
+        days = 3 * 86400 + 7
+        wheel.schedule('hours', hours)
+        wheel.schedule('days', days)
+        self.assertEqual(wheel.timers['hours'][0], 2)
+        self.assertEqual(wheel.timers['days'][0], 3)
+
+        self.assertEqual(wheel.advance(hours - 1), [])
+        self.assertEqual(wheel.advance(hours), [('hours', None)])
+        self.assertEqual(wheel.advance(days - 1), [])
+        self.assertEqual(wheel.advance(days), [('days', None)])
+
+    def test_timers_fire_in_deadline_order(self):
+        wheel = TimingWheel(start=0)
+        for key, when in (('c', 3700), ('a', 10), ('b', 70)):
+            wheel.schedule(key, when)
+
+        self.assertEqual([key for key, _ in wheel.advance(4000)], ['a', 'b', 'c'])
+
+    def test_cancelled_timer_does_not_fire(self):
+        wheel = TimingWheel(start=0)
+        wheel.schedule('a', 4000)
+
+        self.assertTrue(wheel.cancel('a'))
+        self.assertFalse(wheel.cancel('a'))
+        self.assertNotIn('a', wheel)
+        self.assertEqual(wheel.advance(5000), [])
+
+    def test_reschedule_replaces_the_timer(self):
+        wheel = TimingWheel(start=0)
+        wheel.schedule('later', 10)
+        wheel.schedule('later', 4000)
+        wheel.schedule('sooner', 4000)
+        wheel.schedule('sooner', 10)
+
+        self.assertEqual(len(wheel), 2)
+        self.assertEqual(wheel.advance(3999), [('sooner', None)])
+        self.assertEqual(wheel.advance(4000), [('later', None)])
+
+    def test_schedule_beyond_range_is_refused(self):
+        wheel = TimingWheel(start=0)
+
+        self.assertFalse(wheel.schedule('a', wheel.range_ticks + 1))
+        self.assertNotIn('a', wheel)
+
+
+class DeadlineTimerServiceTests(TestCase):
+    def test_reminder_claim_is_not_restamped(self):
+        user, = create_overdue_users(1, now())
+        service = DeadlineTimerService()
+        service.rehydrate()
+
+        with mock.patch('accounts.tasks.send_check_in_reminders_batch.delay') as batch, \
+                mock.patch('accounts.tasks.send_check_in_reminder.delay') as single:
+            service.fire(REMINDER, user.pk)
+
+        batch.assert_called_once_with([user.pk])
+        single.assert_not_called()
+        user.refresh_from_db()
+        self.assertIsNotNone(user.notification_sent_at)
+        self.assertEqual(user.grace_expires_at, user.notification_sent_at + timedelta(days=7))
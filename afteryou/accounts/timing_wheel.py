@@ -0,0 +1,115 @@
+"""
+Hierarchical timing wheel
+
+Timers live in a stack of wheels of growing granularity. Level 0 has one slot
+per tick; a slot of level ``i`` covers as many ticks as a whole turn of level
+``i - 1``. A timer is placed on the finest level whose range covers it, and
+is moved down a level (cascaded) when time reaches its slot, so it lands in
+level 0 exactly on its tick. Adding and cancelling a timer are O(1); each
+tick costs O(1) plus the timers that fire or cascade on it.
+"""
+import math
+
+# Ticks per slot per level: seconds, minutes, hours, days
+DEFAULT_LEVELS = (60, 60, 24, 64)
+
+
+class TimingWheel:
+    """
+    Timers keyed by an id, each carrying a payload returned when it fires
+
+    Args:
+        tick_seconds (float): Duration of one tick
+        levels (tuple): Number of slots of each level, finest first
+        start (float): Unix time of tick zero's reference, defaults to 0
+    """
+
+    def __init__(self, tick_seconds=1.0, levels=DEFAULT_LEVELS, start=0.0):
+        self.tick_seconds = tick_seconds
+        self.levels = levels
+        self.current_tick = self.to_tick(start)
+        # Ticks covered by one slot of each level
+        self.granularity = [math.prod(levels[:index]) for index in range(len(levels))]
+        self.wheels = [[{} for _ in range(size)] for size in levels]
+        self.timers = {}
+
+    @property
+    def range_ticks(self):
+        """Furthest ahead a timer can be scheduled, in ticks"""
+        return self.granularity[-1] * self.levels[-1]
+
+    def to_tick(self, timestamp):
+        return int(timestamp // self.tick_seconds)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def schedule(self, key, when, payload=None):
+        """
+        Add a timer, replacing any timer with the same key
+
+        Args:
+            key: Identifier of the timer
+            when (float): Unix time to fire at; past times fire on the next tick
+            payload: Returned with the key when the timer fires
+
+        Returns:
+            bool: False if ``when`` is beyond the wheel's range
+        """
+        self.cancel(key)
+        deadline = max(self.to_tick(when), self.current_tick + 1)
+        return self._place(key, deadline, payload)
+
+    def cancel(self, key):
+        """Remove a timer; returns True if it existed"""
+        position = self.timers.pop(key, None)
+        if position is None:
+            return False
+        level, slot = position
+        self.wheels[level][slot].pop(key, None)
+        return True
+
+    def _place(self, key, deadline, payload):
+        delta = deadline - self.current_tick
+        for level, size in enumerate(self.levels):
+            granularity = self.granularity[level]
+            if delta < granularity * size:
+                slot = (deadline // granularity) % size
+                self.wheels[level][slot][key] = (deadline, payload)
+                self.timers[key] = (level, slot)
+                return True
+        return False
+
+    def advance(self, now):
+        """
+        Move time forward to ``now``
+
+        Returns:
+            list: (key, payload) of the timers that fired, in deadline order
+        """
+        fired = []
+        target = self.to_tick(now)
+        while self.current_tick < target:
+            self.current_tick += 1
+            tick = self.current_tick
+
+            # Coarsest first so a timer can cascade through several levels at once
+            for level in range(len(self.levels) - 1, 0, -1):
+                granularity = self.granularity[level]
+                if tick % granularity == 0:
+                    slot = (tick // granularity) % self.levels[level]
+                    due = self.wheels[level][slot]
+                    self.wheels[level][slot] = {}
+                    for key, (deadline, payload) in due.items():
+                        self._place(key, deadline, payload)
+
+            slot = tick % self.levels[0]
+            due = self.wheels[0][slot]
+            self.wheels[0][slot] = {}
+            for key, (deadline, payload) in due.items():
+                del self.timers[key]
+                fired.append((key, payload))
+        return fired
@@ -3,10 +3,11 @@ from django.contrib.auth import login, authenticate, logout
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from django.utils.timezone import now
 from django.views.decorators.http import require_http_methods
-from datetime import timedelta
 from .forms import RegisterForm, LoginForm
+from .check_ins import record_check_in
+from .deadline_timers import publish_deadline_change
+from .status_snapshot import check_in_state, get_status_snapshot, invalidate_status_snapshot
 
 def register_view(request):
     if request.method == 'POST':
@@ -41,15 +42,13 @@ def check_in_view(request):
     """API endpoint for users to check in and reset their dead man's switch timer"""
     try:
         user = request.user
-        user.last_check_in = now()
-        user.notification_sent_at = None  # Reset notification status
-        user.save()
+        record_check_in(user)  # Also resets notification status
         
         return JsonResponse({
             'success': True,
             'message': 'Check-in successful! Your timer has been reset.',
             'last_check_in': user.last_check_in.isoformat(),
-            'next_check_in_due': (now() + timedelta(days=30 * user.check_in_interval_months)).isoformat()
+            'next_check_in_due': user.next_check_in_due.isoformat()
         })
     except Exception as e:
         return JsonResponse({
@@ -60,34 +59,12 @@ def check_in_view(request):
 @login_required
 def check_in_status_view(request):
     """Get user's current check-in status"""
-    user = request.user
-    current_time = now()
+    # Deadlines and message counts come from the cached snapshot
+    snapshot = get_status_snapshot(request.user)
+    status = check_in_state(snapshot)
+    status['scheduled_messages_count'] = (snapshot['messages'] or {}).get('scheduled', 0)
     
-    # Calculate when user should check in next
-    months_in_days = 30 * user.check_in_interval_months
-    next_check_in_due = user.last_check_in + timedelta(days=months_in_days)
-    
-    # Calculate if user is overdue
-    is_overdue = current_time > next_check_in_due
-    
-    # Check if in grace period
-    in_grace_period = False
-    grace_period_end = None
-    if user.notification_sent_at:
-        grace_period_end = user.notification_sent_at + timedelta(days=user.grace_period_days)
-        in_grace_period = current_time < grace_period_end
-    
-    return JsonResponse({
-        'last_check_in': user.last_check_in.isoformat(),
-        'next_check_in_due': next_check_in_due.isoformat(),
-        'check_in_interval_months': user.check_in_interval_months,
-        'grace_period_days': user.grace_period_days,
-        'is_overdue': is_overdue,
-        'notification_sent_at': user.notification_sent_at.isoformat() if user.notification_sent_at else None,
-        'in_grace_period': in_grace_period,
-        'grace_period_end': grace_period_end.isoformat() if grace_period_end else None,
-        'scheduled_messages_count': user.legacymessage_set.filter(status='scheduled').count()
-    })
+    return JsonResponse(status)
 
 @login_required
 @csrf_exempt
@@ -111,6 +88,8 @@ def update_user_settings_view(request):
                     user.grace_period_days = grace_days
             
             user.save()
+            invalidate_status_snapshot(user.pk)
+            publish_deadline_change(user)
             
             return JsonResponse({
                 'success': True,
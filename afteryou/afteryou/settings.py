@@ -95,11 +95,13 @@ DATABASES = {
     }
 }
 
-connect(
-    db="afteryou_db",
-    host="localhost",
-    port=27017
-)
+MONGODB = {
+    'db': 'afteryou_db',
+    'host': 'localhost',
+    'port': 27017,
+}
+
+connect(**MONGODB)
 
 
 # Password validation
@@ -261,11 +263,151 @@ RQ_QUEUES = {
     }
 }
 
+# Email priority lanes. Each lane is its own RQ queue sharing the 'email'
+# connection settings; workers dequeue from them by weighted fair share.
+#   email-interactive: test sends and chain replies someone is waiting on
+#   email-bulk:        scheduled legacy deliveries and delivery sweeps
+#   email-retry:       re-delivery of failed messages
+EMAIL_LANES = {
+    'email-interactive': {'WEIGHT': 6, 'SLO_SECONDS': 30},
+    'email-bulk': {'WEIGHT': 3, 'SLO_SECONDS': 600},
+    'email-retry': {'WEIGHT': 1, 'SLO_SECONDS': 1800},
+}
+for _lane in EMAIL_LANES:
+    RQ_QUEUES[_lane] = dict(RQ_QUEUES['email'])
+
 # Legacy Message Settings
 LEGACY_MESSAGE_SETTINGS = {
     'DELIVERY_CHECK_INTERVAL': 300,  # Check every 5 minutes
     'MAX_RETRY_ATTEMPTS': 3,
     'RETRY_DELAY': 3600,  # 1 hour between retries
+    'EMAIL_BATCH_SIZE': 50,  # Max send_single_message jobs delivered per SMTP connection
+    'DRAIN_TIMEOUT': 30,  # Seconds a stopping worker keeps sending before handing work back
+}
+
+# Autoscaling of local RQ workers (see `manage.py autoscale_workers`)
+RQ_AUTOSCALER = {
+    'QUEUE': 'email',
+    'MIN_WORKERS': 1,
+    'MAX_WORKERS': 4,
+    'JOBS_PER_WORKER': 200,  # Queued + soon-due jobs one worker is expected to absorb
+    'LOOKAHEAD_SECONDS': 900,  # Count deliveries due in the next 15 minutes as load
+    'SCALE_DOWN_RATIO': 0.6,  # Remove a worker only if the rest stay under 60% load
+    'COOLDOWN_SECONDS': 120,  # Minimum time between scaling actions
+    'SAMPLE_INTERVAL': 15,
+}
+
+# Backend used for all background work (see legacy/task_backends.py).
+# 'rq' runs every task, including accounts tasks given by dotted path, on the
+# RQ workers; 'celery' runs them on Celery workers; 'simple' keeps them in-process.
+TASK_BACKEND = {
+    'BACKEND': 'rq',
+    'FALLBACK': 'simple',  # Used per call when the primary backend is unreachable
+    'CELERY_ROUTE_QUEUES': False,  # With 'celery', send to queues named like the RQ lanes
+    'CELERY_MAX_ETA_SECONDS': 3000,  # With 'celery', later deliveries are left to the sweep
+}
+
+# Backpressure on delivery jobs pushed to Redis (see legacy/admission.py).
+# Over a limit, messages are deferred to the delivery sweep ('defer') or new
+# messages are refused by the API with 429 ('reject').
+ENQUEUE_ADMISSION = {
+    'ENABLED': True,
+    'POLICY': 'defer',
+    'MAX_QUEUE_DEPTH': 50000,
+    'MAX_SCHEDULED_JOBS': 500000,
+    'MAX_USED_MEMORY_MB': 512,
+    'SAMPLE_TTL': 5,
+    'RETRY_AFTER': 60,
+}
+
+# Lease-based leader election between start_message_scheduler daemons
+SCHEDULER_LEADER_ELECTION = {
+    'ENABLED': True,
+    'LEASE_SECONDS': 15,  # Failover time if the leader dies
+    'RENEW_INTERVAL': 5,
+}
+
+# Partitioned delivery sweeps (`start_message_scheduler --partitioned`)
+DELIVERY_PARTITIONS = {
+    'COUNT': 16,
+    'NODE_TTL': 30,  # Seconds without a heartbeat before a node's partitions move
+    'LOCK_SECONDS': 300,
+}
+
+# Chunked catch-up when the overdue backlog is too large for one sweep
+CATCHUP_DRAIN = {
+    'ENABLED': True,
+    'THRESHOLD': 500,  # Overdue messages that trigger a catch-up run
+    'CHUNK_SIZE': 200,  # Messages per chunk job
+    'STAGGER_SECONDS': 5,  # Delay between chunk starts (rate control)
+    'CHUNK_TIMEOUT': 300,
+}
+
+# Trimming of RQ job registries (compact_job_registries runs on the scheduler leader)
+RQ_RETENTION = {
+    'MAX_FINISHED_JOBS': 5000,  # Per queue
+    'MAX_FAILED_JOBS': 20000,  # Per queue
+    'COMPACT_INTERVAL': 3600,
+}
+
+# Per-task overrides of result_ttl / failure_ttl / ttl, keyed by dotted task
+# path or 'default' (defaults in legacy.tasks.DEFAULT_TASK_RETENTION)
+TASK_RETENTION = {}
+
+# Shared circuit breaker around the SMTP relay (legacy.circuit_breaker).
+# While open, sends are refused at once and messages stay scheduled.
+SMTP_CIRCUIT_BREAKER = {
+    'ENABLED': True,
+    'FAILURE_THRESHOLD': 5,  # Connection failures within the window that open it
+    'WINDOW_SECONDS': 60,
+    'OPEN_SECONDS': 120,  # Time before a single probe send is allowed
+    'PROBE_TIMEOUT': 60,
+}
+
+# Optional precise dead man's switch timers (manage.py run_deadline_timers).
+# When enabled, check-ins and settings changes publish reschedule events.
+DEADLINE_TIMERS = {
+    'ENABLED': False,
+    'HORIZON_HOURS': 48,  # Deadlines loaded into the timing wheel ahead of time
+    'RELOAD_MINUTES': 60,
+    'TICK_SECONDS': 1,
+}
+
+# Write-behind check-ins (accounts/check_ins.py): buffer check-ins in Redis and
+# flush them in batches. Users close to a deadline are always written through.
+CHECK_INS = {
+    'WRITE_BEHIND': False,
+    'FLUSH_SECONDS': 60,
+    'FLUSH_BATCH_SIZE': 1000,
+    'DEADLINE_MARGIN_HOURS': 72,
+}
+
+# Deadline forecast served at /api/system/forecast/ and by monitor_queues --forecast
+FORECAST = {
+    'CACHE_TTL': 300,
+    'MAX_PERIODS': 24 * 14,
+}
+
+# Django cache, used for the per-user status snapshot the dashboard polls
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/2',
+        'KEY_PREFIX': 'afteryou',
+    }
+}
+
+# Per-user check-in and dashboard snapshot (accounts/status_snapshot.py)
+STATUS_SNAPSHOT = {
+    'ENABLED': True,
+    'TTL': 60,  # Bounds staleness from bulk status changes made by workers
+}
+
+# Range-partitioned dead man's switch sweep (accounts/partitioned_sweep.py): the
+# daily full check splits the user table into id ranges swept by parallel workers
+SWEEP_PARTITIONS = {
+    'PARTITIONS': 4,
+    'LEASE_SECONDS': 900,  # A range without a checkpoint for this long is taken over
 }
 
 # Celery Configuration
@@ -282,7 +424,12 @@ try:
     CELERY_BEAT_SCHEDULE = {
         'check-dead-mans-switch': {
             'task': 'accounts.tasks.check_dead_mans_switch',
-            'schedule': crontab(hour=9, minute=0),  # Run daily at 9 AM
+            'schedule': crontab(minute=0),  # Hourly, only deadlines passed since the last run
+        },
+        'check-dead-mans-switch-full': {
+            'task': 'accounts.tasks.check_dead_mans_switch',
+            'schedule': crontab(hour=9, minute=30),  # Daily full reconciliation, swept as parallel id ranges
+            'kwargs': {'full': True, 'partitions': SWEEP_PARTITIONS['PARTITIONS']},
         },
     }
 except ImportError:
@@ -290,6 +437,18 @@ except ImportError:
     CELERY_BEAT_SCHEDULE = {
         'check-dead-mans-switch': {
             'task': 'accounts.tasks.check_dead_mans_switch',
-            'schedule': 60.0 * 60.0 * 24.0,  # Run daily (86400 seconds)
+            'schedule': 60.0 * 60.0,  # Hourly, only deadlines passed since the last run
+        },
+        'check-dead-mans-switch-full': {
+            'task': 'accounts.tasks.check_dead_mans_switch',
+            'schedule': 60.0 * 60.0 * 24.0,  # Daily full reconciliation, swept as parallel id ranges
+            'kwargs': {'full': True, 'partitions': SWEEP_PARTITIONS['PARTITIONS']},
         },
     }
+
+# Buffered check-ins only exist with write-behind enabled
+if CHECK_INS['WRITE_BEHIND']:
+    CELERY_BEAT_SCHEDULE['flush-pending-check-ins'] = {
+        'task': 'accounts.tasks.flush_pending_check_ins',
+        'schedule': float(CHECK_INS['FLUSH_SECONDS']),
+    }
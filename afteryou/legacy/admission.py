@@ -0,0 +1,227 @@
+"""
+Admission control for delivery jobs
+
+Before a delivery job is pushed to Redis the controller checks the queue
+depth, the number of scheduled jobs and Redis ``used_memory`` against the
+limits in ``ENQUEUE_ADMISSION``. Over a limit, a message that already exists
+is deferred: it stays in Mongo with ``status='scheduled'`` and the periodic
+delivery sweep sends it once it is due. With the 'reject' policy the API
+refuses new messages with 429 instead of storing them.
+"""
+import logging
+import threading
+import time
+from django.conf import settings
+from django.utils import timezone
+from .models import LegacyMessage
+from .task_backends import DEFAULT_QUEUE, EMAIL_QUEUES, get_shared_redis_connection
+
+logger = logging.getLogger(__name__)
+
+QUEUE_KEY_PREFIX = 'rq:queue:'
+SCHEDULED_JOBS_KEY = 'rq:scheduler:scheduled_jobs'
+
+DEFAULT_ADMISSION_SETTINGS = {
+    'ENABLED': True,
+    'POLICY': 'defer',  # 'defer' or 'reject'
+    'MAX_QUEUE_DEPTH': 50000,  # Jobs waiting across the default and email queues
+    'MAX_SCHEDULED_JOBS': 500000,  # Jobs waiting in rq-scheduler
+    'MAX_USED_MEMORY_MB': 512,  # Redis used_memory
+    'SAMPLE_TTL': 5,  # Seconds a pressure sample is reused
+    'RETRY_AFTER': 60,  # Seconds clients are asked to wait when rejected
+}
+
+_last_sample = None
+_last_sampled_at = None
+_lock = threading.Lock()
+
+
+class AdmissionRejected(Exception):
+    """Raised when new work is refused because Redis is over its limits"""
+
+    def __init__(self, reasons, retry_after):
+        self.reasons = reasons
+        self.retry_after = retry_after
+        super().__init__(f"Delivery queue is over capacity: {', '.join(reasons)}")
+
+
+def get_admission_settings():
+    """Get admission settings merged over the defaults"""
+    config = dict(DEFAULT_ADMISSION_SETTINGS)
+    config.update(getattr(settings, 'ENQUEUE_ADMISSION', {}))
+    return config
+
+
+def sample_pressure(config=None):
+    """
+    Read queue depth, scheduled jobs and memory usage from Redis
+
+    Samples are cached for SAMPLE_TTL seconds so a burst of enqueues costs
+    one round trip rather than one per message.
+
+    Returns:
+        dict: Sampled values, or None if Redis could not be reached
+    """
+    global _last_sample, _last_sampled_at
+    config = config or get_admission_settings()
+
+    with _lock:
+        now = time.monotonic()
+        if _last_sampled_at is not None and now - _last_sampled_at < config['SAMPLE_TTL']:
+            return _last_sample
+
+        try:
+            conn = get_shared_redis_connection()
+            pipe = conn.pipeline(transaction=False)
+            for name in [DEFAULT_QUEUE] + EMAIL_QUEUES:
+                pipe.llen(f'{QUEUE_KEY_PREFIX}{name}')
+            pipe.zcard(SCHEDULED_JOBS_KEY)
+            results = pipe.execute()
+
+            sample = {
+                'queue_depth': sum(results[:-1]),
+                'scheduled_jobs': results[-1],
+                'used_memory_mb': None,
+                'sampled_at': timezone.now(),
+            }
+            try:
+                used_memory = conn.info('memory')['used_memory']
+                sample['used_memory_mb'] = round(used_memory / (1024 * 1024), 1)
+            except Exception as e:
+                # Some managed Redis services restrict INFO; queue limits still apply
+                logger.debug(f"Redis INFO unavailable for admission control: {str(e)}")
+        except Exception as e:
+            logger.warning(f"Admission sample failed, admitting without limits: {str(e)}")
+            sample = None
+
+        _last_sample = sample
+        _last_sampled_at = now
+        return sample
+
+
+def over_limits(sample, config, scheduled=False):
+    """
+    List the limits the sample exceeds
+
+    Args:
+        sample (dict): Result of sample_pressure()
+        config (dict): Admission settings
+        scheduled (bool): Check the scheduled-jobs limit instead of queue depth
+
+    Returns:
+        list: Human readable reasons, empty when the job can be admitted
+    """
+    if sample is None:
+        return []
+
+    reasons = []
+    if sample['used_memory_mb'] is not None and sample['used_memory_mb'] >= config['MAX_USED_MEMORY_MB']:
+        reasons.append(f"used_memory {sample['used_memory_mb']}MB >= {config['MAX_USED_MEMORY_MB']}MB")
+    if scheduled:
+        if sample['scheduled_jobs'] >= config['MAX_SCHEDULED_JOBS']:
+            reasons.append(f"scheduled jobs {sample['scheduled_jobs']} >= {config['MAX_SCHEDULED_JOBS']}")
+    elif sample['queue_depth'] >= config['MAX_QUEUE_DEPTH']:
+        reasons.append(f"queue depth {sample['queue_depth']} >= {config['MAX_QUEUE_DEPTH']}")
+    return reasons
+
+
+def enforce_admission(scheduled=False):
+    """
+    Refuse new work up front when the 'reject' policy is active and Redis is over a limit
+
+    Called by the API before a message is stored.
+
+    Raises:
+        AdmissionRejected: If the work should be refused
+    """
+    config = get_admission_settings()
+    if not config['ENABLED'] or config['POLICY'] != 'reject':
+        return
+
+    reasons = over_limits(sample_pressure(config), config, scheduled=scheduled)
+    if reasons:
+        logger.warning(f"Rejecting new delivery: {', '.join(reasons)}")
+        raise AdmissionRejected(reasons, config['RETRY_AFTER'])
+
+
+def admit_enqueue(message_id, scheduled=False):
+    """
+    Decide whether a delivery job for a stored message may be pushed to Redis
+
+    A message that is not admitted is deferred to the periodic sweep by
+    setting its status to 'scheduled'; it is never dropped.
+
+    Args:
+        message_id (str): MongoDB ObjectId of the message
+        scheduled (bool): The job would go to rq-scheduler rather than a queue
+
+    Returns:
+        bool: True if the job may be enqueued
+    """
+    config = get_admission_settings()
+    if not config['ENABLED']:
+        return True
+
+    reasons = over_limits(sample_pressure(config), config, scheduled=scheduled)
+    if not reasons:
+        return True
+
+    try:
+        LegacyMessage.objects(id=message_id).update(set__status='scheduled')
+        logger.warning(f"Deferred message {message_id} to the delivery sweep: {', '.join(reasons)}")
+    except Exception as e:
+        logger.error(f"Error deferring message {message_id}: {str(e)}")
+    return False
+
+
+def admit_enqueue_many(message_ids):
+    """
+    Batch form of ``admit_enqueue``: one pressure check for all the messages
+
+    Args:
+        message_ids (list): MongoDB ObjectIds of the messages
+
+    Returns:
+        bool: True if the jobs may be enqueued
+    """
+    config = get_admission_settings()
+    if not config['ENABLED']:
+        return True
+
+    reasons = over_limits(sample_pressure(config), config)
+    if not reasons:
+        return True
+
+    try:
+        LegacyMessage.objects(id__in=message_ids).update(set__status='scheduled')
+        logger.warning(f"Deferred {len(message_ids)} messages to the delivery sweep: {', '.join(reasons)}")
+    except Exception as e:
+        logger.error(f"Error deferring {len(message_ids)} messages: {str(e)}")
+    return False
+
+
+def get_admission_state():
+    """
+    Describe the admission controller for status endpoints
+
+    Returns:
+        dict: Policy, limits, latest sample and whether new jobs are admitted
+    """
+    config = get_admission_settings()
+    sample = sample_pressure(config) if config['ENABLED'] else None
+    queue_reasons = over_limits(sample, config) if config['ENABLED'] else []
+    scheduled_reasons = over_limits(sample, config, scheduled=True) if config['ENABLED'] else []
+
+    return {
+        'enabled': config['ENABLED'],
+        'policy': config['POLICY'],
+        'admitting_immediate': not queue_reasons,
+        'admitting_scheduled': not scheduled_reasons,
+        'reasons': sorted(set(queue_reasons + scheduled_reasons)),
+        'sample': sample,
+        'limits': {
+            'max_queue_depth': config['MAX_QUEUE_DEPTH'],
+            'max_scheduled_jobs': config['MAX_SCHEDULED_JOBS'],
+            'max_used_memory_mb': config['MAX_USED_MEMORY_MB'],
+        },
+    }
@@ -3,6 +3,8 @@
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from django.views.decorators.csrf import csrf_exempt
+from accounts.deadline_timers import publish_deadline_change
+from accounts.status_snapshot import count_messages, get_status_snapshot, invalidate_status_snapshot
 
 @api_view(['GET', 'POST', 'PUT'])
 @permission_classes([IsAuthenticated])
@@ -32,6 +34,8 @@ def user_settings(request):
                 user.grace_period_days = grace
                 updated = True
         user.save()
+        invalidate_status_snapshot(user.pk)
+        publish_deadline_change(user)
         return Response({
             'success': True,
             'updated': updated,
@@ -45,32 +49,34 @@ from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.exceptions import Throttled
 from rest_framework_simplejwt.views import TokenObtainPairView
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from django.contrib.auth import get_user_model
 from django.utils import timezone
+from datetime import timezone as dt_timezone
 import logging
 from .models import LegacyMessage
 from .serializers import LegacyMessageSerializer, LegacyMessageCreateSerializer, UserSerializer
 from .email_service import LegacyEmailService
-# Try to import Redis-based tasks first, fallback to simple tasks
-try:
-    from .tasks import schedule_message_delivery, enqueue_immediate_delivery, get_redis_status
-    REDIS_AVAILABLE = True
-except ImportError:
-    from .simple_tasks import schedule_message_delivery, enqueue_immediate_delivery
-    REDIS_AVAILABLE = False
-    
-    def get_redis_status():
-        return {
-            'connected': False,
-            'mode': 'fallback',
-            'queue_info': {'queued_jobs': 0, 'failed_jobs': 0, 'workers': 0}
-        }
+from .admission import AdmissionRejected, enforce_admission, get_admission_state
+from .circuit_breaker import get_breaker_state
+from .forecast import get_forecast
+from .task_backends import (
+    get_task_backend, schedule_message_delivery, enqueue_immediate_delivery, enqueue_test_delivery,
+    cancel_message_delivery
+)
 
 User = get_user_model()
 logger = logging.getLogger(__name__)
 
+def check_delivery_admission(scheduled=False):
+    """Answer 429 when the delivery queue is over capacity and the reject policy is active"""
+    try:
+        enforce_admission(scheduled=scheduled)
+    except AdmissionRejected as e:
+        raise Throttled(wait=e.retry_after, detail=str(e))
+
 class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     def validate(self, attrs):
         data = super().validate(attrs)
@@ -94,7 +100,11 @@ class LegacyMessageListCreateView(generics.ListCreateAPIView):
         return LegacyMessage.objects.filter(user_id=str(user.id)).order_by('-created_at')
     
     def perform_create(self, serializer):
+        delivery_date = serializer.validated_data.get('delivery_date')
+        check_delivery_admission(scheduled=bool(delivery_date and delivery_date > timezone.now()))
+        
         message = serializer.save()
+        invalidate_status_snapshot(self.request.user.pk)
         
         # Schedule delivery based on delivery date
         if message.delivery_date > timezone.now():
@@ -106,6 +116,7 @@ class LegacyMessageListCreateView(generics.ListCreateAPIView):
                 job_id = schedule_message_delivery(str(message.id), message.delivery_date)
                 if job_id:
                     message.job_id = job_id
+                    message.save()
                     logger.info(f"Scheduled message {message.id} for delivery at {message.delivery_date}")
                 else:
                     logger.warning(f"Failed to schedule background task for message {message.id}")
@@ -122,6 +133,7 @@ class LegacyMessageListCreateView(generics.ListCreateAPIView):
                 job_id = enqueue_immediate_delivery(str(message.id))
                 if job_id:
                     message.job_id = job_id
+                    message.save()
                     logger.info(f"Queued message {message.id} for immediate delivery")
                 else:
                     logger.warning(f"Failed to queue message {message.id} for immediate delivery")
@@ -146,20 +158,48 @@ class LegacyMessageDetailView(generics.RetrieveUpdateDestroyAPIView):
         except LegacyMessage.DoesNotExist:
             from rest_framework.exceptions import NotFound
             raise NotFound('Message not found')
+    
+    def perform_update(self, serializer):
+        previous_delivery_date = serializer.instance.delivery_date
+        if previous_delivery_date and timezone.is_naive(previous_delivery_date):
+            # Mongo returns naive UTC datetimes
+            previous_delivery_date = timezone.make_aware(previous_delivery_date, dt_timezone.utc)
+        message = serializer.save()
+        invalidate_status_snapshot(self.request.user.pk)
+        
+        if message.status != 'scheduled' or message.delivery_date == previous_delivery_date:
+            return
+        
+        # Move the scheduled job with the message; a date in the past is left to the sweep
+        if message.delivery_date > timezone.now():
+            job_id = schedule_message_delivery(str(message.id), message.delivery_date)
+            if job_id and job_id != message.job_id:
+                message.job_id = job_id
+                message.save()
+            logger.info(f"Rescheduled message {message.id} for delivery at {message.delivery_date}")
+        else:
+            cancel_message_delivery(str(message.id))
+    
+    def perform_destroy(self, instance):
+        if instance.status == 'scheduled':
+            cancel_message_delivery(str(instance.id))
+        instance.delete()
+        invalidate_status_snapshot(self.request.user.pk)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def dashboard_stats(request):
     user = request.user
-    messages = LegacyMessage.objects.filter(user_id=str(user.id))
+    # Counts come from the cached status snapshot, recounted if Mongo was unavailable when it was built
+    counts = get_status_snapshot(user)['messages'] or count_messages(user.id)
     
     stats = {
-        'total_messages': messages.count(),
-        'scheduled': messages.filter(status='scheduled').count(),
-        'sent': messages.filter(status='sent').count(),
-        'failed': messages.filter(status='failed').count(),
-        'created': messages.filter(status='created').count(),
-        'pending': messages.filter(status='pending').count(),
+        'total_messages': counts['total'],
+        'scheduled': counts['scheduled'],
+        'sent': counts['sent'],
+        'failed': counts['failed'],
+        'created': counts['created'],
+        'pending': counts['pending'],
     }
     
     return Response(stats)
@@ -168,39 +208,55 @@ def dashboard_stats(request):
 @permission_classes([IsAuthenticated])
 def system_status(request):
     """Get system status including Redis connection and queue information"""
-    redis_status = get_redis_status()
+    backend = get_task_backend()
+    redis_status = backend.system_status()
     
     # Get job statistics
     user = request.user
     user_messages = LegacyMessage.objects.filter(user_id=str(user.id))
     pending_jobs = user_messages.filter(status='pending').count()
     
+    try:
+        smtp_breaker = get_breaker_state()
+    except Exception:
+        smtp_breaker = None
+    
     status_data = {
-        'redis_available': REDIS_AVAILABLE,
+        'redis_available': backend.name == 'rq',
+        'task_backend': backend.name,
         'redis_connected': redis_status.get('connected', False),
         'mode': redis_status.get('mode', 'fallback'),
         'queue_info': redis_status.get('queue_info', {}),
+        'admission': get_admission_state(),
+        'smtp_breaker': smtp_breaker,
         'user_pending_jobs': pending_jobs,
         'system_time': timezone.now().isoformat(),
     }
     
     return Response(status_data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def system_forecast(request):
+    """Upcoming reminders, delivery triggers and message deliveries per hour or day"""
+    try:
+        bucket = request.query_params.get('bucket', 'hour')
+        periods = int(request.query_params.get('periods', 48 if bucket == 'hour' else 14))
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        return Response(get_forecast(bucket, periods, refresh=refresh))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        logger.error(f"Error computing forecast: {str(e)}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def job_status(request, job_id):
     """Get status of a specific job"""
     try:
-        if REDIS_AVAILABLE:
-            from .tasks import get_job_status
-            job_info = get_job_status(job_id)
-            return Response(job_info)
-        else:
-            return Response({
-                'job_id': job_id,
-                'status': 'unknown',
-                'message': 'Redis not available - using fallback system'
-            })
+        job_info = get_task_backend().status(job_id)
+        return Response(job_info)
     except Exception as e:
         return Response({
             'error': str(e),
@@ -220,7 +276,16 @@ def send_test_message(request):
         # Verify user owns this message
         message = LegacyMessage.objects.get(id=message_id, user_id=str(request.user.id))
         
-        # Send test message using email service
+        # Queue the test send on the interactive lane so scheduled bursts don't delay it
+        job_id = enqueue_test_delivery(str(message.id))
+        if job_id:
+            return Response({
+                'success': True,
+                'message': 'Test message queued for delivery',
+                'job_id': job_id
+            })
+        
+        # Fall back to sending synchronously using email service
         success = LegacyEmailService.send_test_message(str(message.id))
         
         if success:
@@ -256,6 +321,7 @@ def schedule_message_api(request):
         
         # Schedule the message using email service
         success = LegacyEmailService.schedule_message_for_delivery(str(message.id))
+        invalidate_status_snapshot(request.user.pk)
         
         if success:
             return Response({
@@ -342,6 +408,8 @@ def view_message_by_token(request, token):
 @permission_classes([AllowAny])
 def extend_chain(request, token):
     """Allow recipients to add their message to the chain"""
+    check_delivery_admission()
+    
     try:
         # Get the original message
         parent_message = LegacyMessage.objects.get(recipient_access_token=token)
@@ -370,10 +438,11 @@ def extend_chain(request, token):
             status='created'
         )
         new_message.save()
+        invalidate_status_snapshot(parent_message.user_id)
         
-        # Queue for immediate delivery
+        # Queue for immediate delivery; chain replies go on the interactive lane
         try:
-            job_id = enqueue_immediate_delivery(str(new_message.id))
+            job_id = enqueue_immediate_delivery(str(new_message.id), lane='email-interactive')
             if job_id:
                 new_message.job_id = job_id
                 new_message.status = 'pending'
@@ -0,0 +1,205 @@
+"""
+Queue-depth-driven autoscaling for local RQ worker processes
+"""
+import json
+import logging
+import math
+import socket
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .models import LegacyMessage
+from .tasks import get_redis_connection, get_redis_status
+
+logger = logging.getLogger(__name__)
+
+METRICS_KEY_PREFIX = 'afteryou:autoscaler:'
+
+# Windows (in seconds) of the upcoming due-delivery curve
+DUE_CURVE_WINDOWS = (300, 900, 3600)
+
+DEFAULT_AUTOSCALER_SETTINGS = {
+    'QUEUE': 'email',
+    'MIN_WORKERS': 1,
+    'MAX_WORKERS': 4,
+    'JOBS_PER_WORKER': 200,  # Queued + soon-due jobs one worker is expected to absorb
+    'LOOKAHEAD_SECONDS': 900,  # How far ahead due deliveries count towards load
+    'SCALE_DOWN_RATIO': 0.6,  # Remove a worker only if the rest would be at most 60% loaded
+    'COOLDOWN_SECONDS': 120,  # Minimum time between two scaling actions
+    'SAMPLE_INTERVAL': 15,
+}
+
+
+def get_autoscaler_settings():
+    """Get autoscaler settings merged over the defaults"""
+    config = dict(DEFAULT_AUTOSCALER_SETTINGS)
+    config.update(getattr(settings, 'RQ_AUTOSCALER', {}))
+    return config
+
+
+def get_due_delivery_curve(windows=DUE_CURVE_WINDOWS):
+    """
+    Count scheduled messages that fall due within each upcoming window
+
+    Args:
+        windows (tuple): Window lengths in seconds, measured from now
+
+    Returns:
+        dict: Maps each window length to the number of messages due within it
+    """
+    current_time = timezone.now()
+    curve = {}
+    for window in windows:
+        try:
+            curve[window] = LegacyMessage.objects(
+                status='scheduled',
+                delivery_date__lte=current_time + timedelta(seconds=window)
+            ).count()
+        except Exception as e:
+            logger.error(f"Error counting due deliveries: {str(e)}")
+            curve[window] = 0
+    return curve
+
+
+def sample_load(config=None):
+    """
+    Sample the signals the autoscaler reacts to
+
+    Returns:
+        dict: Queue sizes, cluster worker count and the due-delivery curve
+    """
+    config = config or get_autoscaler_settings()
+    redis_status = get_redis_status()
+    queue_info = redis_status.get('queue_info', {})
+    windows = tuple(sorted(set(DUE_CURVE_WINDOWS) | {config['LOOKAHEAD_SECONDS']}))
+    curve = get_due_delivery_curve(windows)
+
+    return {
+        'connected': redis_status.get('connected', False),
+        'default_queue_size': queue_info.get('default_queue_size', 0),
+        'email_queue_size': queue_info.get('email_queue_size', 0),
+        'cluster_workers': queue_info.get('workers', 0),
+        'due_curve': curve,
+        'upcoming_due': curve.get(config['LOOKAHEAD_SECONDS'], 0),
+    }
+
+
+class WorkerAutoscaler:
+    """
+    Decides how many local workers should run for the sampled load
+
+    Scaling up follows demand immediately (subject to the cooldown); scaling
+    down removes one worker at a time and only once the remaining workers
+    would stay under SCALE_DOWN_RATIO of their capacity, which keeps the
+    count from flapping around a boundary.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or get_autoscaler_settings()
+        self.last_scaled_at = None
+
+    def queue_size(self, sample):
+        """Backlog of the queue this autoscaler manages"""
+        return sample.get(f"{self.config['QUEUE']}_queue_size", 0)
+
+    def load(self, sample):
+        """Jobs the workers are expected to handle within the lookahead"""
+        return self.queue_size(sample) + sample.get('upcoming_due', 0)
+
+    def target(self, sample):
+        """Worker count needed for the sampled load, clamped to the limits"""
+        needed = math.ceil(self.load(sample) / self.config['JOBS_PER_WORKER'])
+        return max(self.config['MIN_WORKERS'], min(self.config['MAX_WORKERS'], needed))
+
+    def in_cooldown(self, now=None):
+        if self.last_scaled_at is None:
+            return False
+        now = now if now is not None else time.monotonic()
+        return now - self.last_scaled_at < self.config['COOLDOWN_SECONDS']
+
+    def decide(self, sample, current, now=None):
+        """
+        Decide the worker count to run next
+
+        Args:
+            sample (dict): Result of sample_load()
+            current (int): Number of local workers currently running
+            now (float): Monotonic clock reading, defaults to time.monotonic()
+
+        Returns:
+            tuple: (desired worker count, reason)
+        """
+        now = now if now is not None else time.monotonic()
+        minimum = self.config['MIN_WORKERS']
+        maximum = self.config['MAX_WORKERS']
+
+        # Limits are enforced regardless of the cooldown
+        if current < minimum:
+            return minimum, 'below minimum'
+        if current > maximum:
+            return maximum, 'above maximum'
+
+        target = self.target(sample)
+        if target == current:
+            return current, 'steady'
+        if self.in_cooldown(now):
+            return current, 'cooldown'
+
+        if target > current:
+            return target, 'scale up'
+
+        load = self.load(sample)
+        remaining_capacity = (current - 1) * self.config['JOBS_PER_WORKER']
+        if load <= remaining_capacity * self.config['SCALE_DOWN_RATIO']:
+            return current - 1, 'scale down'
+        return current, 'hysteresis'
+
+    def record_scaling(self, now=None):
+        self.last_scaled_at = now if now is not None else time.monotonic()
+
+
+def get_controller_id(queue_name):
+    """Identify the autoscaler for a queue on this host in metrics"""
+    return f"{socket.gethostname()}:{queue_name}"
+
+
+def publish_metrics(controller_id, metrics, ttl=None):
+    """
+    Expose the latest autoscaler decision in Redis
+
+    Args:
+        controller_id (str): Identifier of the autoscaler instance
+        metrics (dict): Values to publish
+        ttl (int): Seconds before the metrics expire if the controller stops
+    """
+    conn = get_redis_connection()
+    if not conn:
+        return
+    try:
+        key = f'{METRICS_KEY_PREFIX}{controller_id}'
+        conn.set(key, json.dumps(metrics, default=str), ex=ttl)
+    except Exception as e:
+        logger.error(f"Failed to publish autoscaler metrics: {str(e)}")
+
+
+def get_autoscaler_metrics():
+    """
+    Read the metrics published by every running autoscaler
+
+    Returns:
+        dict: Maps controller id to its latest metrics
+    """
+    conn = get_redis_connection()
+    if not conn:
+        return {}
+    metrics = {}
+    try:
+        for key in conn.scan_iter(match=f'{METRICS_KEY_PREFIX}*'):
+            key = key.decode() if isinstance(key, bytes) else key
+            value = conn.get(key)
+            if value:
+                metrics[key[len(METRICS_KEY_PREFIX):]] = json.loads(value)
+    except Exception as e:
+        logger.error(f"Failed to read autoscaler metrics: {str(e)}")
+    return metrics
@@ -0,0 +1,25 @@
+"""
+Timing helper shared by the benchmark management commands
+"""
+import time
+
+
+def best_of(run, repeat):
+    """
+    Time ``run`` several times and keep the fastest run
+
+    Args:
+        run (callable): Code to time, called without arguments
+        repeat (int): Number of timed runs, at least one is made
+
+    Returns:
+        tuple: Best elapsed seconds and the result of the last run
+    """
+    best = None
+    result = None
+    for _ in range(max(repeat, 1)):
+        started = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
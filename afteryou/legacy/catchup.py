@@ -0,0 +1,225 @@
+"""
+Catch-up drain of an overdue delivery backlog
+
+After a Redis or SMTP outage the due set can hold far more messages than one
+sweep can send within its job timeout. When a sweep finds more than
+``THRESHOLD`` overdue messages it starts a catch-up run instead: the backlog
+is split into chunks of ``CHUNK_SIZE`` ids, oldest delivery date first, and
+each chunk becomes its own deliver_message_chunk job. Chunk start times are
+staggered by ``STAGGER_SECONDS`` so the fan-out does not hit SMTP all at
+once.
+
+While a run is active, regular sweeps step aside so they do not race the
+chunks for the same messages. Progress lives in a Redis hash so monitor_queues
+can report it along with an ETA.
+"""
+import logging
+import time
+import uuid
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .email_service import LegacyEmailService
+from .models import LegacyMessage
+from .task_backends import LANE_BULK, get_shared_redis_connection, get_task_backend
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_KEY = 'afteryou:catchup:active'
+PROGRESS_KEY = 'afteryou:catchup:progress'
+
+DEFAULT_CATCHUP_SETTINGS = {
+    'ENABLED': True,
+    'THRESHOLD': 500,  # Overdue messages that trigger a catch-up run
+    'CHUNK_SIZE': 200,  # Messages per chunk job, one SMTP connection each
+    'STAGGER_SECONDS': 5,  # Delay between the start of consecutive chunks
+    'CHUNK_TIMEOUT': 300,  # Allowance per chunk before a run is considered abandoned
+}
+
+
+def get_catchup_settings():
+    """Get catch-up settings merged over the defaults"""
+    config = dict(DEFAULT_CATCHUP_SETTINGS)
+    config.update(getattr(settings, 'CATCHUP_DRAIN', {}))
+    return config
+
+
+def is_catchup_active(connection=None):
+    """Check whether a catch-up run is draining the backlog"""
+    try:
+        connection = connection or get_shared_redis_connection()
+        return bool(connection.exists(ACTIVE_KEY))
+    except Exception:
+        return False
+
+
+def start_catchup_if_needed(current_time=None):
+    """
+    Start a catch-up run when the overdue backlog exceeds the threshold
+
+    Args:
+        current_time (datetime): Reference time, defaults to now
+
+    Returns:
+        dict: Run summary if a run was started, None otherwise
+    """
+    config = get_catchup_settings()
+    if not config['ENABLED']:
+        return None
+
+    current_time = current_time or timezone.now()
+    overdue = LegacyMessage.objects(status='scheduled', delivery_date__lte=current_time)
+    backlog = overdue.count()
+    if backlog <= config['THRESHOLD']:
+        return None
+
+    connection = get_shared_redis_connection()
+    run_id = uuid.uuid4().hex
+    chunk_count = -(-backlog // config['CHUNK_SIZE'])
+    # Long enough for every chunk to start and finish; refreshed as chunks complete
+    active_ttl = chunk_count * config['STAGGER_SECONDS'] + config['CHUNK_TIMEOUT']
+    if not connection.set(ACTIVE_KEY, run_id, nx=True, ex=active_ttl):
+        # Another sweep started a run first
+        return None
+
+    logger.warning(f"Overdue backlog of {backlog} messages, starting catch-up run {run_id}")
+    connection.delete(PROGRESS_KEY)
+    connection.hset(PROGRESS_KEY, mapping={
+        'run_id': run_id,
+        'total': backlog,
+        'chunks': 0,
+        'chunks_done': 0,
+        'sent': 0,
+        'failed': 0,
+        'skipped': 0,
+        'started_at': time.time(),
+    })
+
+    backend = get_task_backend()
+    chunk = []
+    index = 0
+    chunks = 0
+    ids = overdue.order_by('delivery_date', 'id').only('id').no_cache()
+    for message in ids:
+        chunk.append(str(message.id))
+        if len(chunk) == config['CHUNK_SIZE']:
+            # A backend may leave a far-off start to the sweeps after the run
+            chunks += bool(enqueue_chunk(backend, chunk, run_id, index, current_time, config))
+            index += 1
+            chunk = []
+    if chunk:
+        chunks += bool(enqueue_chunk(backend, chunk, run_id, index, current_time, config))
+
+    connection.hset(PROGRESS_KEY, 'chunks', chunks)
+    logger.info(f"Catch-up run {run_id}: {chunks} chunks over {chunks * config['STAGGER_SECONDS']}s")
+    return {'run_id': run_id, 'total': backlog, 'chunks': chunks}
+
+
+def enqueue_chunk(backend, message_ids, run_id, index, start_time, config):
+    """Schedule one chunk job at its staggered start time"""
+    args = (message_ids, run_id)
+    if index == 0:
+        return backend.enqueue('legacy.tasks.deliver_message_chunk', args=args, queue=LANE_BULK)
+    return backend.enqueue_at(
+        start_time + timedelta(seconds=index * config['STAGGER_SECONDS']),
+        'legacy.tasks.deliver_message_chunk',
+        args=args,
+        queue=LANE_BULK
+    )
+
+
+def deliver_chunk(message_ids, run_id):
+    """
+    Deliver one chunk of a catch-up run and record its progress
+
+    Messages that were sent or changed since the chunk was planned are skipped.
+
+    Args:
+        message_ids (list): MongoDB ObjectIds in the chunk
+        run_id (str): Catch-up run the chunk belongs to
+
+    Returns:
+        dict: sent, failed and skipped counts for the chunk
+    """
+    still_due = [
+        str(message_id) for message_id in
+        LegacyMessage.objects(id__in=message_ids, status='scheduled').scalar('id')
+    ]
+    results = LegacyEmailService.send_legacy_messages_batch(still_due) if still_due else {}
+    sent = sum(1 for ok in results.values() if ok is True)
+    failed = sum(1 for ok in results.values() if ok is False)
+    # None (deferred by the SMTP circuit breaker) and SKIPPED (sent meanwhile) are not failures
+    summary = {
+        'sent': sent,
+        'failed': failed,
+        'skipped': len(message_ids) - sent - failed,
+    }
+
+    try:
+        record_chunk_progress(run_id, summary)
+    except Exception as e:
+        logger.error(f"Error recording catch-up progress for run {run_id}: {str(e)}")
+    return summary
+
+
+def record_chunk_progress(run_id, summary, connection=None):
+    """Add a finished chunk to the run's progress and end the run after the last chunk"""
+    connection = connection or get_shared_redis_connection()
+    current_run = connection.hget(PROGRESS_KEY, 'run_id')
+    if current_run is None or current_run.decode() != run_id:
+        return
+
+    config = get_catchup_settings()
+    pipe = connection.pipeline()
+    pipe.hincrby(PROGRESS_KEY, 'chunks_done', 1)
+    for field, value in summary.items():
+        pipe.hincrby(PROGRESS_KEY, field, value)
+    pipe.hget(PROGRESS_KEY, 'chunks')
+    results = pipe.execute()
+    chunks_done, chunks = results[0], int(results[-1] or 0)
+
+    if chunks and chunks_done >= chunks:
+        connection.delete(ACTIVE_KEY)
+        connection.hset(PROGRESS_KEY, 'finished_at', time.time())
+        # Keep the summary around for a day for monitoring
+        connection.expire(PROGRESS_KEY, 86400)
+        logger.info(f"Catch-up run {run_id} finished")
+    else:
+        # Keep the run alive while its remaining chunks are due
+        remaining = max(chunks - chunks_done, 1)
+        connection.expire(ACTIVE_KEY, remaining * config['STAGGER_SECONDS'] + config['CHUNK_TIMEOUT'])
+
+
+def get_catchup_progress(connection=None):
+    """
+    Progress of the latest catch-up run
+
+    Returns:
+        dict: Counters, whether the run is active, throughput and ETA in seconds,
+              or None if no run has happened
+    """
+    connection = connection or get_shared_redis_connection()
+    raw = connection.hgetall(PROGRESS_KEY)
+    if not raw:
+        return None
+
+    progress = {key.decode(): value.decode() for key, value in raw.items()}
+    for field in ('total', 'chunks', 'chunks_done', 'sent', 'failed', 'skipped'):
+        progress[field] = int(progress.get(field, 0))
+    started_at = float(progress['started_at'])
+    ended_at = float(progress['finished_at']) if 'finished_at' in progress else time.time()
+
+    done = progress['sent'] + progress['failed'] + progress['skipped']
+    elapsed = max(ended_at - started_at, 0.001)
+    progress['active'] = is_catchup_active(connection)
+    progress['elapsed'] = elapsed
+    progress['rate'] = done / elapsed
+    remaining = max(progress['total'] - done, 0)
+    if not progress['active']:
+        progress['eta'] = None
+    elif progress['rate']:
+        progress['eta'] = remaining / progress['rate']
+    else:
+        # Nothing finished yet; fall back to the planned stagger
+        progress['eta'] = (progress['chunks'] - progress['chunks_done']) * get_catchup_settings()['STAGGER_SECONDS']
+    return progress
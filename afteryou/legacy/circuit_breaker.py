@@ -0,0 +1,224 @@
+"""
+Circuit breaker around the SMTP relay
+
+Every worker shares the breaker state in Redis. While the relay is healthy
+the breaker is closed and each send costs one extra round trip. After
+``FAILURE_THRESHOLD`` connection-level failures within ``WINDOW_SECONDS``
+the breaker opens: sends are refused at once with CircuitOpen instead of
+waiting out the SMTP socket timeout, and callers leave their messages
+scheduled for a later sweep rather than marking them failed.
+
+Once ``OPEN_SECONDS`` have passed the breaker is half-open. A single caller
+takes the probe lock and tries a real send; success closes the breaker,
+failure opens it again for another ``OPEN_SECONDS``. Everyone else keeps
+being refused until the probe has an answer.
+
+If Redis itself is unreachable the breaker stays out of the way and sends
+go ahead as they did before it existed.
+"""
+import logging
+import smtplib
+from django.conf import settings
+from .task_backends import get_shared_redis_connection
+
+logger = logging.getLogger(__name__)
+
+FAILURES_KEY = 'afteryou:smtp_breaker:failures'
+OPEN_KEY = 'afteryou:smtp_breaker:open'
+TRIPPED_KEY = 'afteryou:smtp_breaker:tripped'
+PROBE_KEY = 'afteryou:smtp_breaker:probe'
+
+DEFAULT_BREAKER_SETTINGS = {
+    'ENABLED': True,
+    'FAILURE_THRESHOLD': 5,  # Connection failures that open the breaker
+    'WINDOW_SECONDS': 60,  # Window the failures are counted in
+    'OPEN_SECONDS': 120,  # Time sends are refused before a probe is allowed
+    'PROBE_TIMEOUT': 60,  # Upper bound on one probe send
+}
+
+# Rejections tied to a single message; the relay itself answered
+MESSAGE_ERRORS = (
+    smtplib.SMTPRecipientsRefused,
+    smtplib.SMTPSenderRefused,
+    smtplib.SMTPDataError,
+)
+
+
+class CircuitOpen(Exception):
+    """Raised instead of sending while the SMTP breaker is open"""
+
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+        super().__init__(f"SMTP circuit breaker is open, retry in {retry_after}s")
+
+
+def get_breaker_settings():
+    """Get circuit breaker settings merged over the defaults"""
+    config = dict(DEFAULT_BREAKER_SETTINGS)
+    config.update(getattr(settings, 'SMTP_CIRCUIT_BREAKER', {}))
+    return config
+
+
+def is_outage_error(exc):
+    """True for errors that mean the relay is unreachable rather than a bad message"""
+    # smtplib errors and socket timeouts are all OSError subclasses
+    return isinstance(exc, OSError) and not isinstance(exc, MESSAGE_ERRORS)
+
+
+def allow_request(connection=None):
+    """
+    Check whether a send may go to the relay
+
+    Raises:
+        CircuitOpen: While the breaker is open, or half-open with a probe in flight
+    """
+    config = get_breaker_settings()
+    if not config['ENABLED']:
+        return
+
+    try:
+        connection = connection or get_shared_redis_connection()
+        pipe = connection.pipeline(transaction=False)
+        pipe.ttl(OPEN_KEY)
+        pipe.exists(TRIPPED_KEY)
+        open_ttl, tripped = pipe.execute()
+    except Exception as e:
+        logger.debug(f"SMTP breaker state unavailable, allowing send: {str(e)}")
+        return
+
+    if open_ttl and open_ttl > 0:
+        raise CircuitOpen(open_ttl)
+    if tripped:
+        # Half-open: exactly one caller probes the relay
+        if not connection.set(PROBE_KEY, 1, nx=True, ex=config['PROBE_TIMEOUT']):
+            raise CircuitOpen(config['PROBE_TIMEOUT'])
+        logger.info("SMTP breaker half-open, probing the relay")
+
+
+def record_success(connection=None):
+    """Close the breaker after the relay accepted a connection"""
+    if not get_breaker_settings()['ENABLED']:
+        return
+
+    try:
+        connection = connection or get_shared_redis_connection()
+        pipe = connection.pipeline(transaction=False)
+        pipe.delete(TRIPPED_KEY, OPEN_KEY, PROBE_KEY)
+        pipe.delete(FAILURES_KEY)
+        if pipe.execute()[0]:
+            logger.info("SMTP breaker closed, relay is reachable again")
+    except Exception:
+        pass
+
+
+def record_failure(exc, connection=None):
+    """
+    Count a failed send and open the breaker when the threshold is reached
+
+    Args:
+        exc (Exception): Error raised by the send
+
+    Returns:
+        bool: True if the breaker is open after this failure
+    """
+    if not is_outage_error(exc):
+        # The relay answered; it is reachable
+        record_success(connection)
+        return False
+
+    config = get_breaker_settings()
+    if not config['ENABLED']:
+        return False
+
+    try:
+        connection = connection or get_shared_redis_connection()
+        pipe = connection.pipeline()
+        pipe.incr(FAILURES_KEY)
+        pipe.expire(FAILURES_KEY, config['WINDOW_SECONDS'])
+        pipe.exists(TRIPPED_KEY)
+        failures, _, tripped = pipe.execute()
+
+        # A failed probe re-opens the breaker straight away
+        if not tripped and failures < config['FAILURE_THRESHOLD']:
+            return False
+
+        pipe = connection.pipeline()
+        pipe.set(OPEN_KEY, 1, ex=config['OPEN_SECONDS'])
+        pipe.set(TRIPPED_KEY, 1)
+        pipe.delete(FAILURES_KEY, PROBE_KEY)
+        pipe.execute()
+        logger.warning(
+            f"SMTP breaker opened for {config['OPEN_SECONDS']}s after "
+            f"{'a failed probe' if tripped else f'{failures} failures'}: {str(exc)}"
+        )
+        return True
+    except Exception as e:
+        logger.debug(f"Could not record SMTP failure: {str(e)}")
+        return False
+
+
+def guarded_send(send):
+    """
+    Run ``send`` through the breaker
+
+    Args:
+        send (callable): Performs the SMTP transaction, e.g. ``email.send``
+
+    Returns:
+        The return value of ``send``
+
+    Raises:
+        CircuitOpen: The send was not attempted because the breaker is open
+    """
+    allow_request()
+    try:
+        result = send()
+    except Exception as e:
+        record_failure(e)
+        raise
+    record_success()
+    return result
+
+
+def get_breaker_state(connection=None):
+    """
+    Current breaker state for monitoring
+
+    Returns:
+        dict: 'state' (closed, open or half-open), recent 'failures' and the
+              seconds until a probe is allowed while open
+    """
+    config = get_breaker_settings()
+    connection = connection or get_shared_redis_connection()
+    pipe = connection.pipeline(transaction=False)
+    pipe.ttl(OPEN_KEY)
+    pipe.exists(TRIPPED_KEY)
+    pipe.get(FAILURES_KEY)
+    pipe.exists(PROBE_KEY)
+    open_ttl, tripped, failures, probing = pipe.execute()
+
+    if open_ttl and open_ttl > 0:
+        state = 'open'
+    elif tripped:
+        state = 'half-open'
+    else:
+        state = 'closed'
+    return {
+        'enabled': config['ENABLED'],
+        'state': state,
+        'failures': int(failures or 0),
+        'threshold': config['FAILURE_THRESHOLD'],
+        'retry_after': open_ttl if state == 'open' else None,
+        'probing': bool(probing),
+    }
+
+
+def is_circuit_open(connection=None):
+    """True while sends are being refused outright (not while half-open)"""
+    if not get_breaker_settings()['ENABLED']:
+        return False
+    try:
+        connection = connection or get_shared_redis_connection()
+        return bool(connection.exists(OPEN_KEY))
+    except Exception:
+        return False
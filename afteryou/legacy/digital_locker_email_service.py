@@ -2,6 +2,7 @@ from django.core.mail import send_mail
 from django.template.loader import render_to_string
 from django.conf import settings
 from django.utils.html import strip_tags
+from .circuit_breaker import guarded_send
 import logging
 
 logger = logging.getLogger(__name__)
@@ -32,14 +33,14 @@ class DigitalLockerEmailService:
             html_message = render_to_string('emails/digital_locker_inheritance.html', context)
             plain_message = strip_tags(html_message)
             
-            send_mail(
+            guarded_send(lambda: send_mail(
                 subject=subject,
                 message=plain_message,
                 from_email=settings.DEFAULT_FROM_EMAIL,
                 recipient_list=[locker.inheritor_email],
                 html_message=html_message,
                 fail_silently=False,
-            )
+            ))
             
             # Log the notification
             from .digital_locker_models import LockerAccessLog
@@ -10,6 +10,50 @@ from datetime import timedelta
 
 User = get_user_model()
 
+class LockerCipher:
+    """
+    Fernet cipher of one locker, built once and reused for every field of its credentials
+    
+    Decoding the master key and constructing a Fernet object per field adds
+    up when a whole vault is read; get one with ``DigitalLocker.get_cipher``.
+    """
+    
+    def __init__(self, master_key):
+        self.fernet = Fernet(master_key)
+    
+    def encrypt(self, value):
+        """Encrypt a field value; empty values stay empty"""
+        if not value:
+            return ""
+        return self.fernet.encrypt(value.encode()).decode()
+    
+    def decrypt(self, encrypted_value):
+        """Decrypt a field value; empty values stay empty"""
+        if not encrypted_value:
+            return ""
+        return self.fernet.decrypt(encrypted_value.encode()).decode()
+    
+    def decrypt_many(self, credentials):
+        """
+        Decrypt the username, password and additional data of many credentials in one pass
+        
+        Args:
+            credentials (iterable): CredentialEntry objects of this locker
+        
+        Returns:
+            dict: Credential id -> {'username', 'password', 'additional_data'}
+        """
+        decrypt = self.decrypt
+        decrypted = {}
+        for credential in credentials:
+            additional = decrypt(credential.encrypted_additional_data)
+            decrypted[credential.pk] = {
+                'username': decrypt(credential.encrypted_username),
+                'password': decrypt(credential.encrypted_password),
+                'additional_data': json.loads(additional) if additional else {},
+            }
+        return decrypted
+
 class DigitalLocker(models.Model):
     """Main vault for a user's digital credentials"""
     
@@ -65,6 +109,14 @@ class DigitalLocker(models.Model):
         """Retrieve master key for encryption/decryption"""
         return base64.b64decode(self.master_key_hash.encode())
     
+    def get_cipher(self):
+        """Cipher for this locker's credentials, cached on the instance until the master key changes"""
+        cached = getattr(self, '_cipher', None)
+        if cached is None or cached[0] != self.master_key_hash:
+            cached = (self.master_key_hash, LockerCipher(self.get_master_key()))
+            self._cipher = cached
+        return cached[1]
+    
     def trigger_inheritance(self):
         """Trigger the inheritance process"""
         self.status = 'triggered'
@@ -125,21 +177,11 @@ class CredentialEntry(models.Model):
     
     def encrypt_field(self, value):
         """Encrypt a field value using the locker's master key"""
-        if not value:
-            return ""
-        
-        key = self.locker.get_master_key()
-        f = Fernet(key)
-        return f.encrypt(value.encode()).decode()
+        return self.locker.get_cipher().encrypt(value)
     
     def decrypt_field(self, encrypted_value):
         """Decrypt a field value using the locker's master key"""
-        if not encrypted_value:
-            return ""
-        
-        key = self.locker.get_master_key()
-        f = Fernet(key)
-        return f.decrypt(encrypted_value.encode()).decode()
+        return self.locker.get_cipher().decrypt(encrypted_value)
     
     def set_username(self, username):
         """Encrypt and store username"""
@@ -7,6 +7,7 @@ from django.views import View
 from django.utils.timezone import now
 from django.core.exceptions import ValidationError
 from .digital_locker_models import DigitalLocker, CredentialEntry, LockerAccessToken, LockerAccessLog
+from accounts.status_snapshot import invalidate_status_snapshot
 import json
 import logging
 
@@ -30,6 +31,7 @@ class DigitalLockerView(View):
             )
             locker.generate_master_key()
             locker.save()
+            invalidate_status_snapshot(request.user.pk)
         
         # Get credentials summary
         credentials = locker.credentials.filter(is_active=True)
@@ -361,17 +363,18 @@ class InheritanceAccessView(View):
             # Grant access
             if access_token.use_token():
                 # Return decrypted credentials
+                # One cipher for the whole vault instead of a key decode and Fernet per field
+                active = list(locker.credentials.filter(is_active=True).order_by('priority', 'title'))
+                decrypted = locker.get_cipher().decrypt_many(active)
                 credentials = []
-                for cred in locker.credentials.filter(is_active=True).order_by('priority', 'title'):
+                for cred in active:
                     credentials.append({
                         'id': cred.id,
                         'title': cred.title,
                         'category': cred.get_category_display(),
                         'website_url': cred.website_url,
                         'account_identifier': cred.account_identifier,
-                        'username': cred.get_username(),
-                        'password': cred.get_password(),
-                        'additional_data': cred.get_additional_data(),
+                        **decrypted[cred.id],
                         'notes': cred.notes,
                         'priority': cred.priority,
                     })
@@ -10,11 +10,20 @@ from datetime import datetime, timedelta
 from django.conf import settings
 from django.template.loader import render_to_string
 from django.utils import timezone
-from django.core.mail import send_mail, EmailMultiAlternatives
+from django.core.mail import send_mail, EmailMultiAlternatives, get_connection
+from rq.exceptions import StopRequested
 from .models import LegacyMessage
+from .partitions import partition_query
+from .circuit_breaker import CircuitOpen, allow_request, guarded_send, record_failure, record_success
 
 logger = logging.getLogger(__name__)
 
+# Batch outcome of a message that was already sent, failed or deleted
+SKIPPED = 'skipped'
+
+# Statuses a batch still delivers; duplicate jobs for other messages are skipped
+DELIVERABLE_STATUSES = ['created', 'scheduled', 'pending']
+
 class LegacyEmailService:
     """
     Service class for handling legacy message email delivery
@@ -30,69 +39,21 @@ class LegacyEmailService:
             template_name (str): Optional custom template name
             
         Returns:
-            bool: True if successful, False otherwise
+            bool: True if successful, False otherwise, None if the SMTP circuit
+                  breaker is open and the message was left for a later sweep
         """
         try:
             # Get the message from database
             message = LegacyMessage.objects.get(id=message_id)
+            if message.status == 'sent':
+                # A job requeued during a worker drain may arrive after the send
+                logger.info(f"Message {message_id} was already sent, skipping")
+                return True
             
-            # Determine email subject based on message type
-            if message.parent_message:
-                subject = f"Legacy Chain Message: {message.title}"
-            else:
-                subject = f"Legacy Message: {message.title}"
-            
-            # Create HTML email content with appropriate template
-            if template_name:
-                html_content = LegacyEmailService._render_email_template(message, template_name)
-            else:
-                # Choose template based on message type
-                if message.parent_message:
-                    html_content = LegacyEmailService._render_chain_email_template(message)
-                else:
-                    html_content = LegacyEmailService._render_email_template(message)
-            
-            # Create plain text fallback
-            if message.parent_message:
-                text_content = f"""
-{message.title}
-
-{message.content}
-
----
-This is part of a legacy chain (Generation {message.generation}).
-Added by: {message.sender_name or 'Anonymous'}
-
-View the full chain and add your own message:
-{settings.FRONTEND_URL}/legacy/message/{message.recipient_access_token}
-
-Sent via AfterYou Legacy Messages.
-                """.strip()
-            else:
-                text_content = f"""
-{message.title}
-
-{message.content}
-
----
-This message was scheduled to be delivered on {message.delivery_date.strftime('%B %d, %Y at %I:%M %p')}.
-View and extend this legacy:
-{settings.FRONTEND_URL}/legacy/message/{message.recipient_access_token}
-
-Sent via AfterYou Legacy Messages.
-                """.strip()
-            
-            # Send email using Django's email system
-            email = EmailMultiAlternatives(
-                subject=subject,
-                body=text_content,
-                from_email=settings.DEFAULT_FROM_EMAIL,
-                to=[message.recipient_email]
-            )
-            email.attach_alternative(html_content, "text/html")
+            email = LegacyEmailService._build_legacy_email(message, template_name)
             
             # Send the email
-            sent = email.send()
+            sent = guarded_send(email.send)
             
             if sent:
                 # Update message status
@@ -113,6 +74,14 @@ Sent via AfterYou Legacy Messages.
         except LegacyMessage.DoesNotExist:
             logger.error(f"Message {message_id} not found")
             return False
+        except CircuitOpen as e:
+            # Not a delivery failure: the sweep picks the message up once the relay is back
+            logger.warning(f"Deferred message {message_id}: {str(e)}")
+            try:
+                LegacyMessage.objects(id=message_id, status='created').update(set__status='scheduled')
+            except Exception:
+                pass
+            return None
         except Exception as e:
             logger.error(f"Error sending message {message_id}: {str(e)}")
             
@@ -126,6 +95,186 @@ Sent via AfterYou Legacy Messages.
                 
             return False
     
+    @staticmethod
+    def _build_legacy_email(message, template_name=None):
+        """
+        Compose the email for a legacy message without sending it
+        
+        Args:
+            message (LegacyMessage): The message object
+            template_name (str): Optional custom template name
+            
+        Returns:
+            EmailMultiAlternatives: Email ready to be sent
+        """
+        # Determine email subject based on message type
+        if message.parent_message:
+            subject = f"Legacy Chain Message: {message.title}"
+        else:
+            subject = f"Legacy Message: {message.title}"
+        
+        # Create HTML email content with appropriate template
+        if template_name:
+            html_content = LegacyEmailService._render_email_template(message, template_name)
+        else:
+            # Choose template based on message type
+            if message.parent_message:
+                html_content = LegacyEmailService._render_chain_email_template(message)
+            else:
+                html_content = LegacyEmailService._render_email_template(message)
+        
+        # Create plain text fallback
+        if message.parent_message:
+            text_content = f"""
+{message.title}
+
+{message.content}
+
+---
+This is part of a legacy chain (Generation {message.generation}).
+Added by: {message.sender_name or 'Anonymous'}
+
+View the full chain and add your own message:
+{settings.FRONTEND_URL}/legacy/message/{message.recipient_access_token}
+
+Sent via AfterYou Legacy Messages.
+            """.strip()
+        else:
+            text_content = f"""
+{message.title}
+
+{message.content}
+
+---
+This message was scheduled to be delivered on {message.delivery_date.strftime('%B %d, %Y at %I:%M %p')}.
+View and extend this legacy:
+{settings.FRONTEND_URL}/legacy/message/{message.recipient_access_token}
+
+Sent via AfterYou Legacy Messages.
+            """.strip()
+        
+        # Send email using Django's email system
+        email = EmailMultiAlternatives(
+            subject=subject,
+            body=text_content,
+            from_email=settings.DEFAULT_FROM_EMAIL,
+            to=[message.recipient_email]
+        )
+        email.attach_alternative(html_content, "text/html")
+        return email
+    
+    @staticmethod
+    def send_legacy_messages_batch(message_ids, should_stop=None):
+        """
+        Send several legacy messages through one shared SMTP connection
+        
+        Messages are loaded with a single query and their statuses are written
+        back with one update per outcome, so the per-message cost is only the
+        SMTP transaction itself. A failure on one message does not affect the
+        others in the batch. Messages that were already sent or failed are not
+        sent again, so a duplicate job for a delivered message is skipped.
+        
+        Args:
+            message_ids (list): MongoDB ObjectIds of the messages to send
+            should_stop (callable): Checked before each message; once it returns
+                True the rest of the batch is left untouched (used when draining)
+            
+        Returns:
+            dict: Maps each message id (str) to True if sent, False if it failed,
+                  SKIPPED if it was already sent, failed or deleted, or None if it
+                  was not attempted because of should_stop or because the SMTP
+                  circuit breaker is open
+        """
+        results = {str(message_id): False for message_id in message_ids}
+        if not results:
+            return results
+        
+        try:
+            messages = list(LegacyMessage.objects(id__in=list(results.keys()), status__in=DELIVERABLE_STATUSES))
+        except Exception as e:
+            logger.error(f"Error loading message batch: {str(e)}")
+            return results
+        
+        loaded = {str(message.id) for message in messages}
+        skipped = [message_id for message_id in results if message_id not in loaded]
+        if skipped:
+            logger.info(f"Skipping {len(skipped)} messages of the batch that were already sent, failed or deleted")
+            results.update(dict.fromkeys(skipped, SKIPPED))
+        
+        try:
+            allow_request()
+        except CircuitOpen as e:
+            # Leave every message scheduled; nothing is marked failed during an outage
+            logger.warning(f"Deferred batch of {len(messages)} messages: {str(e)}")
+            results.update(dict.fromkeys(loaded, None))
+            return results
+        
+        sent_ids = []
+        failed_ids = []
+        connection = get_connection()
+        
+        try:
+            connection.open()
+            for index, message in enumerate(messages):
+                if should_stop and should_stop():
+                    skipped = [str(pending.id) for pending in messages[index:]]
+                    results.update(dict.fromkeys(skipped, None))
+                    logger.warning(f"Stopping batch early, {len(skipped)} messages left for another worker")
+                    break
+                
+                message_id = str(message.id)
+                try:
+                    email = LegacyEmailService._build_legacy_email(message)
+                    email.connection = connection
+                    if email.send():
+                        sent_ids.append(message_id)
+                        results[message_id] = True
+                        logger.info(f"Successfully sent legacy message {message_id} to {message.recipient_email}")
+                    else:
+                        failed_ids.append(message_id)
+                        logger.error(f"Failed to send legacy message {message_id}")
+                except StopRequested:
+                    # A worker shutdown, not a delivery failure; the message stays unsent
+                    raise
+                except Exception as e:
+                    logger.error(f"Error sending message {message_id}: {str(e)}")
+                    if record_failure(e):
+                        # The relay went away mid-batch; keep the rest for a later sweep
+                        skipped = [str(pending.id) for pending in messages[index:]]
+                        results.update(dict.fromkeys(skipped, None))
+                        break
+                    failed_ids.append(message_id)
+            if sent_ids:
+                record_success()
+        except StopRequested:
+            raise
+        except Exception as e:
+            # The connection could not be opened; nothing in the batch was sent
+            logger.error(f"Error opening SMTP connection for batch: {str(e)}")
+            if record_failure(e):
+                results.update(dict.fromkeys(loaded, None))
+            failed_ids = [message_id for message_id, sent in results.items() if sent is False]
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+            
+            # Written even if the worker is interrupted so sent messages are never resent
+            try:
+                if sent_ids:
+                    LegacyMessage.objects(id__in=sent_ids).update(
+                        set__status='sent',
+                        set__sent_at=timezone.now()
+                    )
+                if failed_ids:
+                    LegacyMessage.objects(id__in=failed_ids).update(set__status='failed')
+            except Exception as e:
+                logger.error(f"Error updating statuses for message batch: {str(e)}")
+        
+        logger.info(f"Batch delivery completed: {len(sent_ids)} sent, {len(failed_ids)} failed")
+        return results
+    
     @staticmethod
     def _render_email_template(message):
         """
@@ -368,10 +517,14 @@ Sent via AfterYou Legacy Messages.
             """
     
     @staticmethod
-    def process_pending_deliveries():
+    def process_pending_deliveries(partition=None, partition_count=None):
         """
         Process all messages that are due for delivery
         
+        Args:
+            partition (int): Only process this partition of the due set
+            partition_count (int): Number of partitions the due set is split into
+        
         Returns:
             dict: Results summary with counts
         """
@@ -384,15 +537,24 @@ Sent via AfterYou Legacy Messages.
                 status='scheduled',
                 delivery_date__lte=current_time
             )
+            if partition is not None:
+                due_messages = due_messages.filter(partition_query(partition, partition_count))
             
             total_processed = 0
             successful = 0
             failed = 0
+            deferred = False
             
             for message in due_messages:
                 total_processed += 1
                 
-                if LegacyEmailService.send_legacy_message(str(message.id)):
+                success = LegacyEmailService.send_legacy_message(str(message.id))
+                if success is None:
+                    # SMTP breaker is open; the rest stay due for the next sweep
+                    total_processed -= 1
+                    deferred = True
+                    break
+                if success:
                     successful += 1
                 else:
                     failed += 1
@@ -401,7 +563,9 @@ Sent via AfterYou Legacy Messages.
                 'total_processed': total_processed,
                 'successful': successful,
                 'failed': failed,
-                'timestamp': current_time
+                'deferred': deferred,
+                # ISO string so the RQ result stays small and JSON friendly
+                'timestamp': current_time.isoformat()
             }
             
             logger.info(f"Delivery batch completed: {successful} successful, {failed} failed")
@@ -494,7 +658,7 @@ TEST sent via AfterYou Legacy Messages.
             )
             email.attach_alternative(html_content, "text/html")
             
-            sent = email.send()
+            sent = guarded_send(email.send)
             
             if sent:
                 logger.info(f"Successfully sent test message {message_id} to {message.recipient_email}")
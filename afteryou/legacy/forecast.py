@@ -0,0 +1,191 @@
+"""
+Deadline forecast for capacity planning
+
+Counts how many check-in reminders, grace expiries (delivery triggers) and
+scheduled message deliveries fall in each upcoming hour or day, so workers
+and SMTP quotas can be sized ahead of a peak. User deadlines come from one
+GROUP BY over the indexed ``next_check_in_due`` and ``grace_expires_at``
+columns; message deliveries come from one Mongo ``$bucket`` aggregation.
+
+Forecasts are cached in Redis for ``CACHE_TTL`` seconds so dashboards polling
+``/api/system/forecast/`` do not rerun the queries; without Redis they are
+computed on every call.
+"""
+import json
+import logging
+from datetime import timedelta, timezone as dt_timezone
+from django.conf import settings
+from django.db.models import Count
+from django.db.models.functions import Trunc
+from django.utils import timezone
+from accounts.models import User
+from .models import LegacyMessage
+from .task_backends import get_shared_redis_connection
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = 'afteryou:forecast:'
+
+BUCKET_SIZES = {
+    'hour': timedelta(hours=1),
+    'day': timedelta(days=1),
+}
+
+DEFAULT_FORECAST_SETTINGS = {
+    'CACHE_TTL': 300,  # Seconds a computed forecast is served from Redis
+    'MAX_PERIODS': 24 * 14,  # Upper bound on buckets per request
+}
+
+
+def get_forecast_settings():
+    """Get forecast settings merged over the defaults"""
+    config = dict(DEFAULT_FORECAST_SETTINGS)
+    config.update(getattr(settings, 'FORECAST', {}))
+    return config
+
+
+def bucket_start(moment, bucket):
+    """Start of the hour or day containing ``moment``"""
+    moment = moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if bucket == 'day':
+        moment = moment.replace(hour=0)
+    return moment
+
+
+def _as_utc(value):
+    if timezone.is_naive(value):
+        return value.replace(tzinfo=dt_timezone.utc)
+    return value.astimezone(dt_timezone.utc)
+
+
+def _user_histogram(queryset, field, bucket, start, end):
+    """Count of users per bucket of ``field`` within [start, end)"""
+    rows = queryset.filter(**{f'{field}__gte': start, f'{field}__lt': end}).annotate(
+        period=Trunc(field, bucket, tzinfo=dt_timezone.utc)
+    ).order_by().values('period').annotate(count=Count('pk')).values_list('period', 'count')
+    return {_as_utc(period): count for period, count in rows}
+
+
+def _message_histogram(boundaries):
+    """Count of scheduled messages per bucket of delivery_date, from one $bucket aggregation"""
+    pipeline = [
+        {'$bucket': {
+            'groupBy': '$delivery_date',
+            'boundaries': boundaries,
+            'default': 'outside',
+            'output': {'count': {'$sum': 1}},
+        }},
+    ]
+    scheduled = LegacyMessage.objects(
+        status='scheduled',
+        delivery_date__gte=boundaries[0],
+        delivery_date__lt=boundaries[-1],
+    )
+    return {
+        _as_utc(row['_id']): row['count']
+        for row in scheduled.aggregate(pipeline)
+        if row['_id'] != 'outside'
+    }
+
+
+def compute_forecast(bucket='hour', periods=48, current_time=None):
+    """
+    Histogram of upcoming reminders, delivery triggers and message deliveries
+
+    Args:
+        bucket (str): 'hour' or 'day'
+        periods (int): Number of buckets, starting with the current one
+        current_time (datetime): Reference time, defaults to now
+
+    Returns:
+        dict: One entry per bucket, totals, the peak bucket, and what is already overdue
+    """
+    current_time = current_time or timezone.now()
+    start = bucket_start(current_time, bucket)
+    boundaries = [start + BUCKET_SIZES[bucket] * index for index in range(periods + 1)]
+    end = boundaries[-1]
+
+    reminders = _user_histogram(
+        User.objects.filter(notification_sent_at__isnull=True), 'next_check_in_due', bucket, start, end
+    )
+    triggers = _user_histogram(User.objects.all(), 'grace_expires_at', bucket, start, end)
+
+    try:
+        messages = _message_histogram(boundaries)
+        messages_error = None
+    except Exception as e:
+        logger.error(f"Error forecasting message deliveries: {str(e)}")
+        messages = {}
+        messages_error = str(e)
+
+    series = []
+    for period_start in boundaries[:-1]:
+        series.append({
+            'start': period_start.isoformat(),
+            'reminders': reminders.get(period_start, 0),
+            'triggers': triggers.get(period_start, 0),
+            'messages': messages.get(period_start, 0),
+        })
+
+    totals = {
+        name: sum(entry[name] for entry in series)
+        for name in ('reminders', 'triggers', 'messages')
+    }
+    peak = max(series, key=lambda entry: entry['reminders'] + entry['triggers'] + entry['messages'], default=None)
+
+    # Deadlines already passed but not yet handled fire on the next sweep
+    overdue = {
+        'reminders': User.objects.filter(notification_sent_at__isnull=True, next_check_in_due__lt=start).count(),
+        'triggers': User.objects.filter(grace_expires_at__lt=start).count(),
+    }
+
+    return {
+        'bucket': bucket,
+        'periods': periods,
+        'start': start.isoformat(),
+        'end': end.isoformat(),
+        'generated_at': current_time.isoformat(),
+        'series': series,
+        'totals': totals,
+        'peak': peak,
+        'overdue': overdue,
+        'messages_error': messages_error,
+    }
+
+
+def get_forecast(bucket='hour', periods=48, refresh=False):
+    """
+    Forecast served from the Redis cache when a fresh one is there
+
+    Args:
+        bucket (str): 'hour' or 'day'
+        periods (int): Number of buckets
+        refresh (bool): Recompute even if a cached forecast exists
+
+    Returns:
+        dict: As from ``compute_forecast``, with 'cached' telling where it came from
+    """
+    if bucket not in BUCKET_SIZES:
+        raise ValueError(f"Unknown forecast bucket '{bucket}', expected one of {', '.join(BUCKET_SIZES)}")
+    config = get_forecast_settings()
+    if not 1 <= periods <= config['MAX_PERIODS']:
+        raise ValueError(f"Forecast periods must be between 1 and {config['MAX_PERIODS']}")
+
+    key = f'{CACHE_KEY_PREFIX}{bucket}:{periods}'
+    connection = None
+    try:
+        connection = get_shared_redis_connection()
+        cached = None if refresh else connection.get(key)
+        if cached is not None:
+            return dict(json.loads(cached), cached=True)
+    except Exception as e:
+        logger.warning(f"Forecast cache unavailable, computing directly: {str(e)}")
+        connection = None
+
+    forecast = compute_forecast(bucket, periods)
+    if connection is not None and forecast['messages_error'] is None:
+        try:
+            connection.setex(key, config['CACHE_TTL'], json.dumps(forecast))
+        except Exception as e:
+            logger.warning(f"Could not cache forecast: {str(e)}")
+    return dict(forecast, cached=False)
@@ -0,0 +1,198 @@
+"""
+Redis lease based leader election for scheduler daemons
+
+Several ``start_message_scheduler --daemon`` instances can run for high
+availability; only the lease holder enqueues delivery sweeps. The lease is
+a key set with NX and a short expiry that the leader keeps renewing. If
+the leader dies, the key expires and a standby takes over within one
+lease period.
+
+Every acquisition increments a fencing token. Sweeps carry the token of
+the leader that enqueued them and are skipped if a newer leader has since
+been elected, so a paused leader that wakes up late cannot double-schedule.
+"""
+import logging
+import os
+import socket
+import time
+from django.conf import settings
+from .task_backends import get_shared_redis_connection
+
+logger = logging.getLogger(__name__)
+
+LEADER_KEY_PREFIX = 'afteryou:leader:'
+
+DEFAULT_LEADER_SETTINGS = {
+    'ENABLED': True,
+    'LEASE_SECONDS': 15,  # A standby takes over at most this long after the leader dies
+    'RENEW_INTERVAL': 5,  # Seconds between lease renewals (well under the lease)
+}
+
+# Lease values are "identity|fencing token|acquired at (epoch seconds)"
+ACQUIRE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return false
+end
+local token = redis.call('incr', KEYS[2])
+local value = ARGV[1] .. '|' .. token .. '|' .. ARGV[3]
+redis.call('set', KEYS[1], value, 'PX', ARGV[2])
+return value
+"""
+
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def get_leader_settings():
+    """Get leader election settings merged over the defaults"""
+    config = dict(DEFAULT_LEADER_SETTINGS)
+    config.update(getattr(settings, 'SCHEDULER_LEADER_ELECTION', {}))
+    return config
+
+
+def lease_key(name):
+    return f'{LEADER_KEY_PREFIX}{name}'
+
+
+def fence_key(name):
+    return f'{LEADER_KEY_PREFIX}{name}:fence'
+
+
+def parse_lease(value):
+    """Split a lease value into its identity, fencing token and acquisition time"""
+    if isinstance(value, bytes):
+        value = value.decode()
+    identity, token, acquired_at = value.rsplit('|', 2)
+    return {'identity': identity, 'token': int(token), 'acquired_at': float(acquired_at)}
+
+
+class LeaderElection:
+    """
+    Holds or competes for the lease named ``name``
+
+    Call ``ensure()`` at least every RENEW_INTERVAL seconds; it renews the
+    lease when held and tries to acquire it otherwise.
+    """
+
+    def __init__(self, name='scheduler', identity=None, lease_seconds=None, connection=None):
+        config = get_leader_settings()
+        self.name = name
+        self.identity = identity or f'{socket.gethostname()}:{os.getpid()}'
+        self.lease_ms = int((lease_seconds or config['LEASE_SECONDS']) * 1000)
+        self.connection = connection or get_shared_redis_connection()
+        self.value = None
+        self.token = None
+
+    @property
+    def is_leader(self):
+        return self.value is not None
+
+    def try_acquire(self):
+        """Take the lease if nobody holds it"""
+        value = self.connection.eval(
+            ACQUIRE_SCRIPT, 2, lease_key(self.name), fence_key(self.name),
+            self.identity, self.lease_ms, f'{time.time():.3f}'
+        )
+        if not value:
+            return False
+
+        self.value = value.decode() if isinstance(value, bytes) else value
+        self.token = parse_lease(self.value)['token']
+        logger.info(f"{self.identity} became {self.name} leader with fencing token {self.token}")
+        return True
+
+    def renew(self):
+        """Extend the lease; returns False if it was lost"""
+        if not self.is_leader:
+            return False
+        if self.connection.eval(RENEW_SCRIPT, 1, lease_key(self.name), self.value, self.lease_ms):
+            return True
+
+        logger.warning(f"{self.identity} lost {self.name} leadership (token {self.token})")
+        self.value = None
+        self.token = None
+        return False
+
+    def ensure(self):
+        """
+        Renew or acquire the lease
+
+        Returns:
+            bool: True if this instance is the leader
+        """
+        try:
+            if self.is_leader:
+                return self.renew()
+            return self.try_acquire()
+        except Exception as e:
+            # Without Redis nobody can prove leadership; step down
+            logger.error(f"Leader election for {self.name} failed: {str(e)}")
+            self.value = None
+            self.token = None
+            return False
+
+    def release(self):
+        """Give the lease up so a standby can take over immediately"""
+        if not self.is_leader:
+            return
+        try:
+            self.connection.eval(RELEASE_SCRIPT, 1, lease_key(self.name), self.value)
+            logger.info(f"{self.identity} released {self.name} leadership")
+        except Exception as e:
+            logger.error(f"Error releasing {self.name} leadership: {str(e)}")
+        finally:
+            self.value = None
+            self.token = None
+
+
+def is_current_token(token, name='scheduler', connection=None):
+    """
+    Check that a fencing token belongs to the newest leader
+
+    Args:
+        token (int): Fencing token carried by the job
+        name (str): Lease name
+
+    Returns:
+        bool: False if a newer leader has been elected since the token was issued
+    """
+    try:
+        connection = connection or get_shared_redis_connection()
+        latest = connection.get(fence_key(name))
+        return latest is None or int(token) >= int(latest)
+    except Exception as e:
+        # The lease cannot be checked either; let the job run rather than stall deliveries
+        logger.warning(f"Could not verify fencing token {token}: {str(e)}")
+        return True
+
+
+def get_leader_info(name='scheduler', connection=None):
+    """
+    Describe the current lease holder
+
+    Returns:
+        dict: identity, token, lease_age and ttl in seconds, or None without a leader
+    """
+    connection = connection or get_shared_redis_connection()
+    pipe = connection.pipeline(transaction=False)
+    pipe.get(lease_key(name))
+    pipe.pttl(lease_key(name))
+    value, ttl_ms = pipe.execute()
+    if not value:
+        return None
+
+    info = parse_lease(value)
+    info['lease_age'] = max(0.0, time.time() - info['acquired_at'])
+    info['ttl'] = max(0, ttl_ms) / 1000
+    return info
@@ -0,0 +1,153 @@
+"""
+Management command to scale local RQ worker processes with queue depth
+"""
+import logging
+import signal
+import subprocess
+import sys
+import time
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from legacy.autoscaler import (
+    WorkerAutoscaler, get_autoscaler_settings, get_controller_id,
+    publish_metrics, sample_load
+)
+from legacy.workers import get_drain_timeout
+
+logger = logging.getLogger(__name__)
+
+# Seconds beyond the worker drain budget before a stopping worker is killed
+WORKER_STOP_GRACE = 30
+
+class Command(BaseCommand):
+    help = 'Scale local RQ workers between a minimum and maximum based on queue depth'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queue',
+            type=str,
+            default=None,
+            choices=['default', 'email'],
+            help='Queue whose workers are scaled (default: RQ_AUTOSCALER["QUEUE"])'
+        )
+        parser.add_argument('--min-workers', type=int, default=None, help='Minimum number of workers')
+        parser.add_argument('--max-workers', type=int, default=None, help='Maximum number of workers')
+        parser.add_argument(
+            '--interval',
+            type=int,
+            default=None,
+            help='Seconds between load samples (default: RQ_AUTOSCALER["SAMPLE_INTERVAL"])'
+        )
+        parser.add_argument(
+            '--cooldown',
+            type=int,
+            default=None,
+            help='Minimum seconds between scaling actions (default: RQ_AUTOSCALER["COOLDOWN_SECONDS"])'
+        )
+
+    def handle(self, *args, **options):
+        config = get_autoscaler_settings()
+        overrides = {
+            'QUEUE': options['queue'],
+            'MIN_WORKERS': options['min_workers'],
+            'MAX_WORKERS': options['max_workers'],
+            'SAMPLE_INTERVAL': options['interval'],
+            'COOLDOWN_SECONDS': options['cooldown'],
+        }
+        config.update({key: value for key, value in overrides.items() if value is not None})
+
+        if config['MIN_WORKERS'] > config['MAX_WORKERS']:
+            self.stdout.write(self.style.ERROR('--min-workers cannot be greater than --max-workers'))
+            return
+
+        self.autoscaler = WorkerAutoscaler(config)
+        self.controller_id = get_controller_id(config['QUEUE'])
+        self.workers = []
+        self.last_scaled_at = None
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Autoscaling {config['QUEUE']} workers between {config['MIN_WORKERS']} and "
+                f"{config['MAX_WORKERS']} (sampling every {config['SAMPLE_INTERVAL']} seconds)"
+            )
+        )
+
+        # Treat SIGTERM like Ctrl+C so the worker processes are stopped on shutdown
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+
+        try:
+            while True:
+                self.tick(config)
+                time.sleep(config['SAMPLE_INTERVAL'])
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('\nReceived interrupt signal, stopping workers...'))
+        finally:
+            # A repeated SIGTERM must not cut the workers' drain short
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)
+            self.scale_to(0)
+            publish_metrics(self.controller_id, {'running_workers': 0, 'stopped_at': timezone.now()}, ttl=config['SAMPLE_INTERVAL'] * 4)
+
+    def handle_sigterm(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def tick(self, config):
+        """Sample the load once and apply the scaling decision"""
+        self.reap_workers()
+        current = len(self.workers)
+        sample = sample_load(config)
+        desired, reason = self.autoscaler.decide(sample, current)
+
+        if desired != current:
+            logger.info(
+                f"Autoscaler {self.controller_id}: {reason} from {current} to {desired} workers "
+                f"(queue={self.autoscaler.queue_size(sample)}, upcoming_due={sample['upcoming_due']})"
+            )
+            self.stdout.write(f'[{timezone.now()}] {reason}: {current} -> {desired} workers')
+            self.scale_to(desired)
+            self.autoscaler.record_scaling()
+            self.last_scaled_at = timezone.now()
+
+        publish_metrics(self.controller_id, {
+            'queue': config['QUEUE'],
+            'running_workers': len(self.workers),
+            'desired_workers': desired,
+            'last_decision': reason,
+            'queue_size': self.autoscaler.queue_size(sample),
+            'upcoming_due': sample['upcoming_due'],
+            'due_curve': sample['due_curve'],
+            'cluster_workers': sample['cluster_workers'],
+            'min_workers': config['MIN_WORKERS'],
+            'max_workers': config['MAX_WORKERS'],
+            'last_scaled_at': self.last_scaled_at,
+            'sampled_at': timezone.now(),
+        }, ttl=config['SAMPLE_INTERVAL'] * 4)
+
+    def reap_workers(self):
+        """Forget worker processes that have exited on their own"""
+        alive = []
+        for process in self.workers:
+            if process.poll() is None:
+                alive.append(process)
+            else:
+                logger.warning(f"Worker process {process.pid} exited with code {process.returncode}")
+        self.workers = alive
+
+    def scale_to(self, desired):
+        """Start or stop worker processes until ``desired`` are running"""
+        while len(self.workers) < desired:
+            process = subprocess.Popen([
+                sys.executable, sys.argv[0], 'start_rq_worker',
+                f"--queue={self.autoscaler.config['QUEUE']}",
+            ])
+            self.workers.append(process)
+            logger.info(f"Started worker process {process.pid}")
+
+        while len(self.workers) > desired:
+            # Newest workers are stopped first; SIGTERM starts the worker's drain
+            process = self.workers.pop()
+            process.terminate()
+            try:
+                process.wait(timeout=get_drain_timeout() + WORKER_STOP_GRACE)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            logger.info(f"Stopped worker process {process.pid}")
@@ -0,0 +1,35 @@
+"""
+Management command to give messages stored without a partition key their key
+"""
+from django.core.management.base import BaseCommand
+from legacy.partitions import BACKFILL_BATCH_SIZE, backfill_partition_keys
+
+class Command(BaseCommand):
+    help = 'Set partition_key from chain_id on messages that have none, so they stop landing in partition 0'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the messages without a key and change nothing',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=BACKFILL_BATCH_SIZE,
+            help=f'Messages updated per bulk write (default: {BACKFILL_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            totals = backfill_partition_keys(batch_size=options['batch_size'], dry_run=options['dry_run'])
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error backfilling partition keys: {str(e)}'))
+            return
+
+        if options['dry_run']:
+            self.stdout.write(f"{totals['checked']} messages have no partition key")
+            return
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {totals['checked']} messages without a partition key, updated {totals['updated']}."
+        ))
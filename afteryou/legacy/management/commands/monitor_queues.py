@@ -2,10 +2,23 @@
 Management command to monitor Redis queues and job status
 """
 import time
+from datetime import datetime, timezone as dt_timezone
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 import django_rq
 from rq.job import Job
+from legacy.autoscaler import get_autoscaler_metrics
+from legacy.catchup import get_catchup_progress
+from legacy.circuit_breaker import get_breaker_state
+from legacy.forecast import get_forecast
+from legacy.leader import get_leader_info
+from legacy.partitions import get_partition_assignment
+from legacy.retention import get_memory_breakdown
+from legacy.tasks import EMAIL_QUEUES
+
+# Number of recently finished jobs sampled per lane for latency
+LATENCY_SAMPLE_SIZE = 100
 
 class Command(BaseCommand):
     help = 'Monitor Redis queues and job status'
@@ -22,6 +35,16 @@ class Command(BaseCommand):
             action='store_true',
             help='Run once instead of continuous monitoring'
         )
+        parser.add_argument(
+            '--memory',
+            action='store_true',
+            help='Show Redis memory use by key family and exit'
+        )
+        parser.add_argument(
+            '--forecast',
+            action='store_true',
+            help='Show reminders, delivery triggers and message deliveries due in the next 48 hours and exit'
+        )
 
     def handle(self, *args, **options):
         refresh_interval = options['refresh']
@@ -32,7 +55,11 @@ class Command(BaseCommand):
         )
         
         try:
-            if run_once:
+            if options['memory']:
+                self.display_memory()
+            elif options['forecast']:
+                self.display_forecast()
+            elif run_once:
                 self.display_status()
             else:
                 self.monitor_continuous(refresh_interval)
@@ -47,7 +74,7 @@ class Command(BaseCommand):
         self.stdout.write('=' * 60)
         
         # Check each queue
-        for queue_name in ['default', 'email']:
+        for queue_name in ['default'] + EMAIL_QUEUES:
             try:
                 queue = django_rq.get_queue(queue_name)
                 
@@ -76,6 +103,9 @@ class Command(BaseCommand):
                     self.style.ERROR(f'Error checking {queue_name} queue: {str(e)}')
                 )
         
+        # Check lane latency against the SLOs
+        self.display_lane_slos()
+        
         # Check scheduler
         try:
             scheduler = django_rq.get_scheduler('email')
@@ -92,6 +122,219 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.ERROR(f'Error checking scheduler: {str(e)}')
             )
+        
+        # Check scheduler leader
+        try:
+            leader = get_leader_info('scheduler')
+            self.stdout.write(f'\nSCHEDULER LEADER:')
+            if leader:
+                self.stdout.write(
+                    f"  {leader['identity']} (fencing token {leader['token']}), "
+                    f"lease held {self.format_seconds(leader['lease_age'])}, "
+                    f"expires in {self.format_seconds(leader['ttl'])}"
+                )
+            else:
+                self.stdout.write(self.style.WARNING('  No leader - no delivery sweeps are being scheduled'))
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error checking scheduler leader: {str(e)}')
+            )
+        
+        # Check SMTP circuit breaker
+        try:
+            breaker = get_breaker_state()
+            if breaker['state'] == 'closed':
+                self.stdout.write(
+                    f"\nSMTP BREAKER: closed ({breaker['failures']}/{breaker['threshold']} recent failures)"
+                )
+            elif breaker['state'] == 'open':
+                self.stdout.write(self.style.WARNING(
+                    f"\nSMTP BREAKER: OPEN - deliveries deferred, probe in {self.format_seconds(breaker['retry_after'])}"
+                ))
+            else:
+                probe = 'probe in flight' if breaker['probing'] else 'waiting for a probe'
+                self.stdout.write(self.style.WARNING(f"\nSMTP BREAKER: half-open ({probe})"))
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error checking SMTP breaker: {str(e)}')
+            )
+        
+        # Check catch-up drain
+        try:
+            progress = get_catchup_progress()
+            if progress:
+                done = progress['sent'] + progress['failed'] + progress['skipped']
+                state = 'ACTIVE' if progress['active'] else 'finished'
+                self.stdout.write(f'\nCATCH-UP DRAIN ({state}):')
+                self.stdout.write(
+                    f"  Run {progress['run_id']}: {done}/{progress['total']} messages, "
+                    f"chunks {progress['chunks_done']}/{progress['chunks']}"
+                )
+                self.stdout.write(
+                    f"  Sent: {progress['sent']}, failed: {progress['failed']}, skipped: {progress['skipped']}, "
+                    f"rate: {progress['rate']:.1f}/s, elapsed: {self.format_seconds(progress['elapsed'])}, "
+                    f"ETA: {self.format_seconds(progress['eta'])}"
+                )
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error checking catch-up drain: {str(e)}')
+            )
+        
+        # Check partitioned sweep nodes
+        try:
+            assignment = get_partition_assignment()
+            if assignment:
+                self.stdout.write(f'\nSWEEP PARTITIONS:')
+                for node_id, partitions in sorted(assignment.items()):
+                    self.stdout.write(f'  {node_id}: {len(partitions)} partitions {partitions}')
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error checking sweep partitions: {str(e)}')
+            )
+        
+        # Check autoscalers
+        autoscalers = get_autoscaler_metrics()
+        if autoscalers:
+            self.stdout.write(f'\nAUTOSCALERS:')
+            for controller_id, metrics in sorted(autoscalers.items()):
+                self.stdout.write(
+                    f"  {controller_id}: {metrics.get('running_workers', 0)} running, "
+                    f"{metrics.get('desired_workers', 0)} desired "
+                    f"[{metrics.get('min_workers', '?')}-{metrics.get('max_workers', '?')}] "
+                    f"({metrics.get('last_decision', 'stopped')})"
+                )
+                if 'queue_size' in metrics:
+                    self.stdout.write(
+                        f"    Queue: {metrics['queue_size']}, due soon: {metrics.get('upcoming_due', 0)}, "
+                        f"last scaled: {metrics.get('last_scaled_at') or 'never'}"
+                    )
+
+    def display_memory(self):
+        """Display an estimate of Redis memory use per key family"""
+        try:
+            breakdown = get_memory_breakdown()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error measuring Redis memory: {str(e)}'))
+            return
+        
+        families = breakdown['families']
+        total = sum(family['bytes'] for family in families.values())
+        used_memory = breakdown['used_memory']
+        
+        self.stdout.write(f'\nREDIS MEMORY BY KEY FAMILY:')
+        if used_memory:
+            self.stdout.write(f'  used_memory: {self.format_bytes(used_memory)} (keys account for {self.format_bytes(total)})')
+        self.stdout.write(f'  {"Family":<24}{"Keys":>10}{"Memory":>12}{"Share":>8}')
+        for name, family in sorted(families.items(), key=lambda item: item[1]['bytes'], reverse=True):
+            share = family['bytes'] / total * 100 if total else 0
+            estimate = '~' if family['sampled'] < family['keys'] else ''
+            self.stdout.write(
+                f"  {name:<24}{family['keys']:>10}{estimate + self.format_bytes(family['bytes']):>12}{share:>7.1f}%"
+            )
+
+    def display_forecast(self, hours=48):
+        """Display the hourly deadline forecast for the next ``hours`` hours"""
+        try:
+            forecast = get_forecast('hour', hours)
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error computing forecast: {str(e)}'))
+            return
+        
+        source = 'cached' if forecast['cached'] else 'fresh'
+        self.stdout.write(f'\nDEADLINE FORECAST, NEXT {hours} HOURS ({source}, generated {forecast["generated_at"]}):')
+        overdue = forecast['overdue']
+        self.stdout.write(f"  Overdue now: {overdue['reminders']} reminders, {overdue['triggers']} delivery triggers")
+        if forecast['messages_error']:
+            self.stdout.write(self.style.WARNING(f"  Message deliveries unavailable: {forecast['messages_error']}"))
+        
+        self.stdout.write(f'  {"Hour (UTC)":<18}{"Reminders":>11}{"Triggers":>10}{"Messages":>10}')
+        for entry in forecast['series']:
+            if not (entry['reminders'] or entry['triggers'] or entry['messages']):
+                continue
+            hour = datetime.fromisoformat(entry['start']).strftime('%Y-%m-%d %H:%M')
+            self.stdout.write(f"  {hour:<18}{entry['reminders']:>11}{entry['triggers']:>10}{entry['messages']:>10}")
+        
+        totals = forecast['totals']
+        self.stdout.write(f'  {"Total":<18}{totals["reminders"]:>11}{totals["triggers"]:>10}{totals["messages"]:>10}')
+        peak = forecast['peak']
+        if peak and (peak['reminders'] or peak['triggers'] or peak['messages']):
+            peak_hour = datetime.fromisoformat(peak['start']).strftime('%Y-%m-%d %H:%M')
+            self.stdout.write(f'  Peak hour: {peak_hour} ({peak["reminders"] + peak["triggers"] + peak["messages"]} events)')
+
+    @staticmethod
+    def format_bytes(value):
+        for unit in ('B', 'KB', 'MB'):
+            if value < 1024:
+                return f'{value:.0f}{unit}' if unit == 'B' else f'{value:.1f}{unit}'
+            value /= 1024
+        return f'{value:.1f}GB'
+
+    def display_lane_slos(self):
+        """Display queueing latency of each email lane against its SLO"""
+        lanes = getattr(settings, 'EMAIL_LANES', {})
+        if not lanes:
+            return
+        
+        self.stdout.write(f'\nLANE LATENCY (SLO):')
+        for lane, config in lanes.items():
+            try:
+                queue = django_rq.get_queue(lane)
+                oldest_wait, recent_p95 = self.lane_latency(queue)
+                slo = config.get('SLO_SECONDS')
+                worst = max(oldest_wait or 0, recent_p95 or 0)
+                
+                line = (
+                    f'  {lane}: oldest queued {self.format_seconds(oldest_wait)}, '
+                    f'recent p95 {self.format_seconds(recent_p95)} (SLO {slo}s)'
+                )
+                if slo is not None and worst > slo:
+                    self.stdout.write(self.style.ERROR(f'{line} BREACH'))
+                else:
+                    self.stdout.write(self.style.SUCCESS(f'{line} OK'))
+                    
+            except Exception as e:
+                self.stdout.write(
+                    self.style.ERROR(f'Error checking {lane} latency: {str(e)}')
+                )
+
+    def lane_latency(self, queue, sample_size=LATENCY_SAMPLE_SIZE):
+        """
+        Measure how long jobs wait in a queue before a worker starts them
+        
+        Returns:
+            tuple: (seconds the oldest queued job has waited, 95th percentile wait
+                    of recently finished jobs), each None when there is no data
+        """
+        current_time = datetime.now(dt_timezone.utc)
+        
+        oldest_wait = None
+        head_ids = queue.get_job_ids(0, 0)
+        if head_ids:
+            head = Job.fetch(head_ids[0], connection=queue.connection)
+            if head.enqueued_at:
+                oldest_wait = (current_time - self.as_utc(head.enqueued_at)).total_seconds()
+        
+        waits = []
+        finished_ids = queue.finished_job_registry.get_job_ids(-sample_size, -1)
+        for job in Job.fetch_many(finished_ids, connection=queue.connection):
+            if job and job.enqueued_at and job.started_at:
+                waits.append((self.as_utc(job.started_at) - self.as_utc(job.enqueued_at)).total_seconds())
+        
+        recent_p95 = None
+        if waits:
+            waits.sort()
+            recent_p95 = waits[min(len(waits) - 1, int(len(waits) * 0.95))]
+        
+        return oldest_wait, recent_p95
+
+    @staticmethod
+    def as_utc(value):
+        """RQ stores naive UTC datetimes in older releases"""
+        return value if value.tzinfo else value.replace(tzinfo=dt_timezone.utc)
+
+    @staticmethod
+    def format_seconds(value):
+        return 'n/a' if value is None else f'{value:.1f}s'
 
     def monitor_continuous(self, refresh_interval):
         """Monitor queues continuously"""
@@ -0,0 +1,35 @@
+"""
+Management command to reconcile rq-scheduler delivery jobs with Mongo
+"""
+from django.core.management.base import BaseCommand
+from legacy.reconciler import RECONCILE_BATCH_SIZE, reconcile_scheduled_jobs
+
+class Command(BaseCommand):
+    help = 'Remove orphaned deliver_message_* jobs and re-time jobs whose delivery date changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would change without touching the scheduler',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=RECONCILE_BATCH_SIZE,
+            help=f'Scheduler entries checked per Mongo query (default: {RECONCILE_BATCH_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            totals = reconcile_scheduled_jobs(dry_run=options['dry_run'], batch_size=options['batch_size'])
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'Error reconciling scheduled jobs: {str(e)}'))
+            return
+
+        prefix = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(
+            f"Checked {totals['checked']} scheduled delivery jobs. "
+            f"{prefix} {totals['orphaned']} orphaned and "
+            f"{'would re-time' if options['dry_run'] else 're-timed'} {totals['retimed']}."
+        ))
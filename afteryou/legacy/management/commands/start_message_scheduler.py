@@ -2,13 +2,16 @@
 Management command to start the message delivery scheduler
 This command runs the periodic task that checks for messages due for delivery
 """
+import signal
 import time
 import logging
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from django.conf import settings
-import django_rq
-from legacy.tasks import process_delivery_queue
+from legacy.leader import LeaderElection, get_leader_settings
+from legacy.partitions import PartitionMembership
+from legacy.retention import get_retention_settings
+from legacy.task_backends import LANE_BULK, get_task_backend
 
 logger = logging.getLogger(__name__)
 
@@ -27,34 +30,56 @@ class Command(BaseCommand):
             action='store_true',
             help='Run as a daemon process'
         )
+        parser.add_argument(
+            '--partitioned',
+            action='store_true',
+            help='Join the partitioned sweep: every daemon sweeps only the partitions it owns '
+                 '(DELIVERY_PARTITIONS in settings). Implies --daemon'
+        )
 
     def handle(self, *args, **options):
         interval = options['interval']
         is_daemon = options['daemon']
         
+        # Treat SIGTERM like Ctrl+C so the lease and partitions are released on shutdown
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        
         self.stdout.write(
             self.style.SUCCESS(
                 f'Starting message delivery scheduler (checking every {interval} seconds)'
             )
         )
         
-        if is_daemon:
+        if options['partitioned']:
+            self.run_partitioned(interval)
+        elif is_daemon:
             self.run_daemon(interval)
         else:
             self.run_once()
 
+    def handle_sigterm(self, signum, frame):
+        raise KeyboardInterrupt
+
+    def enqueue_sweep(self, fencing_token=None, **kwargs):
+        """Enqueue one process_delivery_queue job and return its id"""
+        if fencing_token is not None:
+            kwargs['fencing_token'] = fencing_token
+        return get_task_backend().enqueue(
+            'legacy.tasks.process_delivery_queue',
+            kwargs=kwargs,
+            queue=LANE_BULK
+        )
+
     def run_once(self):
         """Run the delivery queue processing once"""
         try:
             self.stdout.write('Processing delivery queue...')
             
-            # Get the queue and enqueue the processing task
-            queue = django_rq.get_queue('email')
-            job = queue.enqueue(process_delivery_queue)
+            job_id = self.enqueue_sweep()
             
             self.stdout.write(
                 self.style.SUCCESS(
-                    f'Delivery queue processing job enqueued with ID: {job.id}'
+                    f'Delivery queue processing job enqueued with ID: {job_id}'
                 )
             )
             
@@ -64,19 +89,51 @@ class Command(BaseCommand):
             )
 
     def run_daemon(self, interval):
-        """Run as a daemon, continuously scheduling delivery checks"""
+        """
+        Run as a daemon, continuously scheduling delivery checks
+        
+        With leader election enabled any number of daemons can run; only the
+        lease holder enqueues sweeps and the others stand by to take over.
+        """
+        config = get_leader_settings()
+        election = LeaderElection('scheduler') if config['ENABLED'] else None
+        tick = min(config['RENEW_INTERVAL'], interval) if election else interval
+        last_sweep_at = None
+        last_compact_at = None
+        compact_interval = get_retention_settings()['COMPACT_INTERVAL']
+        was_leader = False
+        
         try:
             while True:
-                self.stdout.write(f'[{timezone.now()}] Scheduling delivery queue check...')
+                is_leader = election.ensure() if election else True
+                
+                if is_leader != was_leader and election:
+                    if is_leader:
+                        self.stdout.write(self.style.SUCCESS(
+                            f'[{timezone.now()}] {election.identity} is now the scheduler leader '
+                            f'(fencing token {election.token})'
+                        ))
+                    else:
+                        self.stdout.write(self.style.WARNING(
+                            f'[{timezone.now()}] {election.identity} is standing by'
+                        ))
+                    was_leader = is_leader
                 
-                # Get the queue and enqueue the processing task
-                queue = django_rq.get_queue('email')
-                job = queue.enqueue(process_delivery_queue)
+                if not is_leader:
+                    # A new term starts with an immediate sweep
+                    last_sweep_at = None
+                elif last_sweep_at is None or time.monotonic() - last_sweep_at >= interval:
+                    self.stdout.write(f'[{timezone.now()}] Scheduling delivery queue check...')
+                    job_id = self.enqueue_sweep(election.token if election else None)
+                    self.stdout.write(f'Job {job_id} enqueued for delivery processing')
+                    last_sweep_at = time.monotonic()
                 
-                self.stdout.write(f'Job {job.id} enqueued for delivery processing')
+                # Housekeeping of RQ registries, also leader-only
+                if is_leader and (last_compact_at is None or time.monotonic() - last_compact_at >= compact_interval):
+                    get_task_backend().enqueue('legacy.tasks.compact_job_registries')
+                    last_compact_at = time.monotonic()
                 
-                # Wait for the specified interval
-                time.sleep(interval)
+                time.sleep(tick)
                 
         except KeyboardInterrupt:
             self.stdout.write(
@@ -86,3 +143,64 @@ class Command(BaseCommand):
             self.stdout.write(
                 self.style.ERROR(f'Error in scheduler daemon: {str(e)}')
             )
+        finally:
+            if election:
+                # Hand over right away instead of waiting for the lease to expire
+                election.release()
+
+    def run_partitioned(self, interval):
+        """
+        Run as one node of the partitioned sweep
+        
+        The node heartbeats into the membership set and, every interval,
+        enqueues one sweep per partition it owns so the partitions are
+        processed in parallel by the workers. Ownership follows membership,
+        so nodes can be added or removed at any time. Only the sweep of
+        partition 0 counts the overdue backlog for a catch-up run, so the
+        whole due set is counted once per tick rather than once per partition.
+        """
+        membership = PartitionMembership()
+        partition_count = membership.config['COUNT']
+        tick = min(membership.config['NODE_TTL'] / 3, interval)
+        owned = []
+        last_sweep_at = None
+        
+        self.stdout.write(f'Joining partitioned sweep as {membership.node_id} ({partition_count} partitions)')
+        
+        try:
+            while True:
+                try:
+                    membership.heartbeat()
+                    current = membership.owned_partitions()
+                except Exception as e:
+                    self.stdout.write(self.style.ERROR(f'Error updating partition membership: {str(e)}'))
+                    current = []
+                
+                if current != owned:
+                    self.stdout.write(f'[{timezone.now()}] Now owning partitions {current or "none"}')
+                    # Sweep newly acquired partitions right away
+                    last_sweep_at = None
+                    owned = current
+                
+                if owned and (last_sweep_at is None or time.monotonic() - last_sweep_at >= interval):
+                    for partition in owned:
+                        self.enqueue_sweep(
+                            partition=partition,
+                            partition_count=partition_count,
+                            check_backlog=partition == 0
+                        )
+                    self.stdout.write(f'[{timezone.now()}] Enqueued sweeps for partitions {owned}')
+                    last_sweep_at = time.monotonic()
+                
+                time.sleep(tick)
+                
+        except KeyboardInterrupt:
+            self.stdout.write(
+                self.style.WARNING('\nReceived interrupt signal, leaving the partitioned sweep...')
+            )
+        except Exception as e:
+            self.stdout.write(
+                self.style.ERROR(f'Error in partitioned scheduler: {str(e)}')
+            )
+        finally:
+            membership.leave()
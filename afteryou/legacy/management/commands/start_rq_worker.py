@@ -6,6 +6,8 @@ import sys
 from django.core.management.base import BaseCommand
 import django_rq
 from rq import Worker
+from legacy.tasks import EMAIL_QUEUES
+from legacy.workers import BatchEmailWorker, get_drain_timeout, get_email_batch_size
 
 logger = logging.getLogger(__name__)
 
@@ -18,7 +20,8 @@ class Command(BaseCommand):
             type=str,
             default='default',
             choices=['default', 'email', 'all'],
-            help='Queue to process (default: default, options: default, email, all)'
+            help='Queue to process (default: default, options: default, email, all). '
+                 'email covers every email priority lane'
         )
         parser.add_argument(
             '--workers',
@@ -26,13 +29,31 @@ class Command(BaseCommand):
             default=1,
             help='Number of worker processes to start (default: 1)'
         )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=None,
+            help='Deliver up to this many email jobs per SMTP connection '
+                 '(default: LEGACY_MESSAGE_SETTINGS["EMAIL_BATCH_SIZE"], 1 disables batching)'
+        )
+        parser.add_argument(
+            '--drain-timeout',
+            type=int,
+            default=None,
+            help='Seconds an email worker keeps sending its current batch after SIGTERM before '
+                 'returning the rest to the queue (default: LEGACY_MESSAGE_SETTINGS["DRAIN_TIMEOUT"])'
+        )
 
     def handle(self, *args, **options):
         queue_name = options['queue']
         num_workers = options['workers']
+        batch_size = options['batch_size'] or get_email_batch_size()
+        drain_timeout = options['drain_timeout'] if options['drain_timeout'] is not None else get_drain_timeout()
         
         if queue_name == 'all':
-            queues = ['default', 'email']
+            queues = ['default'] + EMAIL_QUEUES
+        elif queue_name == 'email':
+            queues = list(EMAIL_QUEUES)
         else:
             queues = [queue_name]
         
@@ -54,8 +75,18 @@ class Command(BaseCommand):
                     connection = queue_objects[0].connection
                     queue = queue_objects  # Pass list for multiple queues
                 
+                # Batch email deliveries and weigh the lanes when the worker serves email
+                if 'email' in queues:
+                    worker = BatchEmailWorker(
+                        queue if isinstance(queue, list) else [queue], connection=connection,
+                        batch_size=batch_size, drain_timeout=drain_timeout
+                    )
+                    self.stdout.write(
+                        f'Starting BatchEmailWorker (batch size {batch_size}, drain timeout {drain_timeout}s) '
+                        f'for queues: {queues}'
+                    )
                 # Use SimpleWorker for Windows compatibility
-                if sys.platform.startswith('win'):
+                elif sys.platform.startswith('win'):
                     from rq import SimpleWorker
                     worker = SimpleWorker(queue if isinstance(queue, list) else [queue], connection=connection)
                     self.stdout.write(f'Starting SimpleWorker (Windows mode) for queues: {queues}')
@@ -2,6 +2,7 @@ from mongoengine import Document, StringField, DateTimeField, EmailField, Refere
 from datetime import datetime
 from accounts.models import User
 import uuid
+from .partitions import compute_partition_key
 
 # Import the digital locker models
 from .digital_locker_models import DigitalLocker, CredentialEntry, LockerAccessToken, LockerAccessLog
@@ -37,12 +38,28 @@ class LegacyMessage(Document):
     # Background job tracking
     job_id = StringField()  # RQ job ID for tracking background tasks
     
+    # Delivery sweep partition, derived from chain_id (see legacy/partitions.py)
+    partition_key = IntField()
+    
     # Meta configuration
     meta = {
         'collection': 'legacy_messages',
         'ordering': ['-created_at'],
-        'indexes': ['chain_id', 'parent_message', 'recipient_access_token', 'generation']
+        'indexes': [
+            'chain_id', 'parent_message', 'recipient_access_token', 'generation',
+            ('status', 'partition_key', 'delivery_date'),
+            ('user_id', 'status'),
+        ]
     }
     
+    def assign_partition_key(self):
+        """Derive partition_key from chain_id; call before insert(), which bypasses save()"""
+        if self.partition_key is None and self.chain_id is not None:
+            self.partition_key = compute_partition_key(self.chain_id)
+    
+    def save(self, *args, **kwargs):
+        self.assign_partition_key()
+        return super().save(*args, **kwargs)
+    
     def __str__(self):
         return f"{self.title} - {self.recipient_email} (Gen {self.generation})"
\ No newline at end of file
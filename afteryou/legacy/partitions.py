@@ -0,0 +1,213 @@
+"""
+Partitioning of the delivery sweep across scheduler nodes
+
+Every message carries a ``partition_key`` in [0, PARTITION_KEY_SPACE) derived
+from its chain id, so a whole chain always lands in the same partition. The
+key space is split into ``COUNT`` contiguous ranges; a sweep for partition
+``p`` only reads messages whose key falls in that range, which the
+(status, partition_key, delivery_date) index serves directly.
+
+Nodes announce themselves in a Redis sorted set scored by heartbeat time.
+Each partition is owned by the live node that wins rendezvous hashing, so
+when a node joins or leaves only the partitions it wins or held move. A
+short per-partition lock covers the moment two nodes disagree about
+membership, so a partition is never swept twice at the same time.
+"""
+import hashlib
+import logging
+import os
+import socket
+import time
+import zlib
+from django.conf import settings
+from mongoengine.queryset.visitor import Q
+from .task_backends import get_shared_redis_connection
+
+logger = logging.getLogger(__name__)
+
+PARTITION_KEY_SPACE = 1 << 16
+
+# Messages given a key per bulk write by backfill_partition_keys
+BACKFILL_BATCH_SIZE = 1000
+
+MEMBERS_KEY = 'afteryou:partitions:members'
+LOCK_KEY_PREFIX = 'afteryou:partitions:lock:'
+
+DEFAULT_PARTITION_SETTINGS = {
+    'COUNT': 16,  # Number of partitions the key space is split into
+    'NODE_TTL': 30,  # Seconds without a heartbeat before a node is considered gone
+    'LOCK_SECONDS': 300,  # Upper bound on one partition sweep
+}
+
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+def get_partition_settings():
+    """Get partition settings merged over the defaults"""
+    config = dict(DEFAULT_PARTITION_SETTINGS)
+    config.update(getattr(settings, 'DELIVERY_PARTITIONS', {}))
+    return config
+
+
+def compute_partition_key(chain_id):
+    """Stable partition key of a chain"""
+    return zlib.crc32(str(chain_id).encode()) & (PARTITION_KEY_SPACE - 1)
+
+
+def partition_range(partition, partition_count):
+    """Half-open range of partition keys owned by a partition"""
+    start = partition * PARTITION_KEY_SPACE // partition_count
+    end = (partition + 1) * PARTITION_KEY_SPACE // partition_count
+    return start, end
+
+
+def partition_query(partition, partition_count):
+    """
+    Mongo filter selecting the messages of one partition
+
+    Documents written before partition keys existed have no key and belong
+    to partition 0 until backfill_partition_keys gives them one.
+    """
+    start, end = partition_range(partition, partition_count)
+    query = Q(partition_key__gte=start, partition_key__lt=end)
+    if partition == 0:
+        query |= Q(partition_key=None)
+    return query
+
+
+def backfill_partition_keys(batch_size=BACKFILL_BATCH_SIZE, dry_run=False):
+    """
+    Set the partition key of messages stored without one
+
+    LegacyMessage.save() derives the key, but documents written before keys
+    existed or through paths that bypass save() have none, and all of them
+    are swept with partition 0. Messages are walked in _id order and each
+    batch is written with one unordered bulk write.
+
+    Returns:
+        dict: 'checked' messages without a key and how many were 'updated'
+    """
+    from pymongo import UpdateOne
+    from .models import LegacyMessage
+
+    collection = LegacyMessage._get_collection()
+    checked = 0
+    updated = 0
+    last_id = None
+    while True:
+        batch = LegacyMessage.objects(partition_key=None, chain_id__ne=None)
+        if last_id is not None:
+            batch = batch.filter(id__gt=last_id)
+        batch = list(batch.order_by('id').only('id', 'chain_id').limit(batch_size))
+        if not batch:
+            break
+        last_id = batch[-1].id
+        checked += len(batch)
+        if dry_run:
+            continue
+
+        # Guarded on the missing key so a concurrent save() is not overwritten
+        result = collection.bulk_write([
+            UpdateOne(
+                {'_id': message.id, 'partition_key': None},
+                {'$set': {'partition_key': compute_partition_key(message.chain_id)}}
+            )
+            for message in batch
+        ], ordered=False)
+        updated += result.modified_count
+
+    logger.info(f"Partition key backfill: {checked} messages without a key, {updated} updated")
+    return {'checked': checked, 'updated': updated}
+
+
+def assign_partitions(nodes, partition_count):
+    """
+    Assign every partition to one node by rendezvous hashing
+
+    Args:
+        nodes (list): Identifiers of the live nodes
+        partition_count (int): Number of partitions
+
+    Returns:
+        dict: Maps each node to the sorted list of partitions it owns
+    """
+    assignment = {node: [] for node in nodes}
+    if not nodes:
+        return assignment
+
+    for partition in range(partition_count):
+        owner = max(
+            nodes,
+            key=lambda node: hashlib.md5(f'{node}:{partition}'.encode()).digest()
+        )
+        assignment[owner].append(partition)
+    return assignment
+
+
+class PartitionMembership:
+    """A scheduler node taking part in partitioned sweeps"""
+
+    def __init__(self, node_id=None, connection=None, config=None):
+        self.config = config or get_partition_settings()
+        self.node_id = node_id or f'{socket.gethostname()}:{os.getpid()}'
+        self.connection = connection or get_shared_redis_connection()
+
+    def heartbeat(self):
+        """Announce this node and forget nodes whose heartbeat expired"""
+        now = time.time()
+        pipe = self.connection.pipeline()
+        pipe.zadd(MEMBERS_KEY, {self.node_id: now})
+        pipe.zremrangebyscore(MEMBERS_KEY, '-inf', now - self.config['NODE_TTL'])
+        pipe.execute()
+
+    def live_nodes(self):
+        """Identifiers of the nodes with a recent heartbeat"""
+        nodes = self.connection.zrangebyscore(MEMBERS_KEY, time.time() - self.config['NODE_TTL'], '+inf')
+        return sorted(node.decode() if isinstance(node, bytes) else node for node in nodes)
+
+    def owned_partitions(self):
+        """Partitions this node currently owns"""
+        return assign_partitions(self.live_nodes(), self.config['COUNT']).get(self.node_id, [])
+
+    def leave(self):
+        """Withdraw so the remaining nodes take over this node's partitions at once"""
+        try:
+            self.connection.zrem(MEMBERS_KEY, self.node_id)
+        except Exception as e:
+            logger.error(f"Error leaving partition membership: {str(e)}")
+
+
+def acquire_partition_lock(partition, partition_count, owner, connection=None):
+    """
+    Lock a partition for the duration of one sweep
+
+    Returns:
+        bool: True if the lock was taken
+    """
+    connection = connection or get_shared_redis_connection()
+    key = f'{LOCK_KEY_PREFIX}{partition_count}:{partition}'
+    lock_ms = get_partition_settings()['LOCK_SECONDS'] * 1000
+    return bool(connection.set(key, owner, nx=True, px=lock_ms))
+
+
+def release_partition_lock(partition, partition_count, owner, connection=None):
+    """Release a partition lock if it is still held by ``owner``"""
+    connection = connection or get_shared_redis_connection()
+    key = f'{LOCK_KEY_PREFIX}{partition_count}:{partition}'
+    connection.eval(RELEASE_LOCK_SCRIPT, 1, key, owner)
+
+
+def get_partition_assignment():
+    """
+    Current partition assignment as seen from Redis
+
+    Returns:
+        dict: Maps each live node to the partitions it owns
+    """
+    membership = PartitionMembership(node_id='monitor')
+    return assign_partitions(membership.live_nodes(), membership.config['COUNT'])
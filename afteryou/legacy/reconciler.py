@@ -0,0 +1,113 @@
+"""
+Reconciliation of rq-scheduler delivery jobs against Mongo
+
+schedule_message_delivery creates one ``deliver_message_<id>`` job per
+message. A job becomes stale when its message is deleted, sent some other
+way, or rescheduled. The API now keeps jobs in sync as messages change; the
+reconciler repairs whatever drifted anyway (older data, failed hooks,
+messages edited outside the API) in bulk.
+"""
+import logging
+from bson import ObjectId
+from bson.errors import InvalidId
+from rq_scheduler.utils import to_unix
+from .models import LegacyMessage
+from .task_backends import DELIVERY_JOB_PREFIX, get_shared_redis_connection
+
+logger = logging.getLogger(__name__)
+
+SCHEDULED_JOBS_KEY = 'rq:scheduler:scheduled_jobs'
+JOB_KEY_PREFIX = 'rq:job:'
+
+# Number of scheduler entries checked per Mongo query
+RECONCILE_BATCH_SIZE = 1000
+
+# Scores are whole seconds; smaller differences are not drift
+RETIME_TOLERANCE_SECONDS = 1
+
+
+def iter_delivery_jobs(connection, batch_size=RECONCILE_BATCH_SIZE):
+    """Yield lists of (job_id, scheduled unix time) for delivery jobs in the scheduler"""
+    batch = []
+    for job_id, score in connection.zscan_iter(
+        SCHEDULED_JOBS_KEY, match=f'{DELIVERY_JOB_PREFIX}*', count=batch_size
+    ):
+        job_id = job_id.decode() if isinstance(job_id, bytes) else job_id
+        batch.append((job_id, score))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def reconcile_batch(connection, batch, dry_run=False):
+    """
+    Reconcile one batch of scheduler entries
+
+    Returns:
+        dict: checked, orphaned and retimed counts
+    """
+    message_ids = {}
+    orphans = []
+    for job_id, score in batch:
+        try:
+            message_ids[job_id] = ObjectId(job_id[len(DELIVERY_JOB_PREFIX):])
+        except InvalidId:
+            orphans.append(job_id)
+
+    messages = {
+        message.id: message for message in
+        LegacyMessage.objects(id__in=list(message_ids.values())).only('id', 'status', 'delivery_date')
+    }
+
+    retimes = {}
+    for job_id, score in batch:
+        if job_id not in message_ids:
+            continue
+        message = messages.get(message_ids[job_id])
+        if message is None or message.status != 'scheduled':
+            # Deleted, already sent or failed, or taken back by the user
+            orphans.append(job_id)
+            continue
+        expected = to_unix(message.delivery_date)
+        if abs(expected - score) > RETIME_TOLERANCE_SECONDS:
+            retimes[job_id] = expected
+
+    if not dry_run and (orphans or retimes):
+        pipe = connection.pipeline()
+        for job_id in orphans:
+            pipe.zrem(SCHEDULED_JOBS_KEY, job_id)
+            pipe.delete(f'{JOB_KEY_PREFIX}{job_id}')
+        if retimes:
+            # XX: only move jobs that have not been handed to a queue meanwhile
+            pipe.zadd(SCHEDULED_JOBS_KEY, retimes, xx=True)
+        pipe.execute()
+
+    return {'checked': len(batch), 'orphaned': len(orphans), 'retimed': len(retimes)}
+
+
+def reconcile_scheduled_jobs(dry_run=False, batch_size=RECONCILE_BATCH_SIZE):
+    """
+    Remove orphaned delivery jobs and re-time jobs whose delivery date changed
+
+    Args:
+        dry_run (bool): Only count what would change
+        batch_size (int): Scheduler entries checked per Mongo query
+
+    Returns:
+        dict: Totals of checked, orphaned and retimed jobs
+    """
+    connection = get_shared_redis_connection()
+    totals = {'checked': 0, 'orphaned': 0, 'retimed': 0}
+
+    for batch in iter_delivery_jobs(connection, batch_size):
+        result = reconcile_batch(connection, batch, dry_run=dry_run)
+        for key, value in result.items():
+            totals[key] += value
+
+    logger.info(
+        f"Scheduler reconciliation{' (dry run)' if dry_run else ''}: "
+        f"{totals['checked']} checked, {totals['orphaned']} orphaned, {totals['retimed']} retimed"
+    )
+    return totals
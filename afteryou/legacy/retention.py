@@ -0,0 +1,148 @@
+"""
+Retention of RQ job data in Redis and a breakdown of Redis memory use
+
+Job hashes, results and registry entries expire through the per-task TTLs
+in ``legacy.tasks.get_task_retention``. Registries are sorted sets that RQ
+only prunes lazily, so compact_registries drops expired entries and caps
+each registry at a fixed size, deleting the job data of what it trims.
+"""
+import logging
+from collections import defaultdict
+from django.conf import settings
+from rq import Queue
+from rq.results import Result
+from .task_backends import DEFAULT_QUEUE, EMAIL_QUEUES, get_shared_redis_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETENTION_SETTINGS = {
+    'MAX_FINISHED_JOBS': 5000,  # Finished job ids kept per queue
+    'MAX_FAILED_JOBS': 20000,  # Failed job ids kept per queue
+    'COMPACT_INTERVAL': 3600,  # Seconds between compaction runs (scheduler leader)
+}
+
+# Key families reported by the memory breakdown, first match wins
+KEY_FAMILIES = (
+    ('rq:job:', 'job data'),
+    ('rq:results:', 'job results'),
+    ('rq:queue:', 'queues'),
+    ('rq:finished:', 'finished registries'),
+    ('rq:failed:', 'failed registries'),
+    ('rq:wip:', 'started registries'),
+    ('rq:deferred:', 'deferred registries'),
+    ('rq:scheduled:', 'scheduled registries'),
+    ('rq:canceled:', 'canceled registries'),
+    ('rq:scheduler', 'rq-scheduler'),
+    ('rq:worker', 'workers'),
+    ('rq:', 'other rq'),
+    ('afteryou:', 'afteryou coordination'),
+)
+
+# Keys measured with MEMORY USAGE per family before extrapolating
+MEMORY_SAMPLE_SIZE = 200
+
+
+def get_retention_settings():
+    """Get retention settings merged over the defaults"""
+    config = dict(DEFAULT_RETENTION_SETTINGS)
+    config.update(getattr(settings, 'RQ_RETENTION', {}))
+    return config
+
+
+def trim_registry(connection, registry, max_size):
+    """
+    Drop the oldest entries of a registry beyond ``max_size``
+
+    Returns:
+        int: Number of jobs removed
+    """
+    excess = registry.count - max_size
+    if excess <= 0:
+        return 0
+
+    job_ids = [
+        job_id.decode() if isinstance(job_id, bytes) else job_id
+        for job_id in connection.zrange(registry.key, 0, excess - 1)
+    ]
+    pipe = connection.pipeline()
+    pipe.zrem(registry.key, *job_ids)
+    for job_id in job_ids:
+        pipe.delete(f'{registry.job_class.redis_job_namespace_prefix}{job_id}', Result.get_key(job_id))
+    pipe.execute()
+    return len(job_ids)
+
+
+def compact_registries(config=None):
+    """
+    Remove expired registry entries and cap finished and failed registries
+
+    Returns:
+        dict: Maps each queue name to the number of finished and failed jobs trimmed
+    """
+    config = config or get_retention_settings()
+    connection = get_shared_redis_connection()
+    summary = {}
+
+    for name in [DEFAULT_QUEUE] + EMAIL_QUEUES:
+        queue = Queue(name, connection=connection)
+        queue.finished_job_registry.cleanup()
+        queue.failed_job_registry.cleanup()
+        queue.started_job_registry.cleanup()
+        summary[name] = {
+            'finished': trim_registry(connection, queue.finished_job_registry, config['MAX_FINISHED_JOBS']),
+            'failed': trim_registry(connection, queue.failed_job_registry, config['MAX_FAILED_JOBS']),
+        }
+
+    trimmed = sum(counts['finished'] + counts['failed'] for counts in summary.values())
+    logger.info(f"Registry compaction removed {trimmed} old jobs")
+    return summary
+
+
+def key_family(key):
+    for prefix, family in KEY_FAMILIES:
+        if key.startswith(prefix):
+            return family
+    return 'other'
+
+
+def get_memory_breakdown(sample_size=MEMORY_SAMPLE_SIZE):
+    """
+    Estimate Redis memory use by key family
+
+    Every key is counted with SCAN; up to ``sample_size`` keys per family are
+    measured with MEMORY USAGE and the average is extrapolated to the family.
+
+    Returns:
+        dict: 'used_memory' in bytes and 'families' mapping each family to its
+              key count and estimated bytes
+    """
+    connection = get_shared_redis_connection()
+    counts = defaultdict(int)
+    samples = defaultdict(list)
+
+    for key in connection.scan_iter(count=1000):
+        key = key.decode() if isinstance(key, bytes) else key
+        family = key_family(key)
+        counts[family] += 1
+        if len(samples[family]) < sample_size:
+            samples[family].append(key)
+
+    families = {}
+    for family, keys in samples.items():
+        pipe = connection.pipeline(transaction=False)
+        for key in keys:
+            pipe.memory_usage(key)
+        sizes = [size for size in pipe.execute() if size]
+        average = sum(sizes) / len(sizes) if sizes else 0
+        families[family] = {
+            'keys': counts[family],
+            'bytes': int(average * counts[family]),
+            'sampled': len(keys),
+        }
+
+    try:
+        used_memory = connection.info('memory')['used_memory']
+    except Exception:
+        used_memory = None
+
+    return {'used_memory': used_memory, 'families': families}
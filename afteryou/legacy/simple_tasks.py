@@ -2,24 +2,42 @@
 Simple in-memory task queue for development when Redis is not available.
 This provides a fallback mechanism for background task processing.
 """
+import atexit
 import logging
 import threading
 import time
 from datetime import datetime, timedelta
-from queue import Queue, Empty
+from itertools import count
+from queue import PriorityQueue, Empty
+from django.conf import settings
 from django.utils import timezone
+# Delivery helpers go through the configured task backend, which falls back
+# to this queue when the broker is unavailable
+from .task_backends import (
+    LANE_INTERACTIVE, LANE_BULK, LANE_RETRY,
+    schedule_message_delivery, enqueue_immediate_delivery, enqueue_test_delivery
+)
 
 logger = logging.getLogger(__name__)
 
+# Email lanes, highest priority first (mirrors EMAIL_LANES for the Redis workers)
+LANE_PRIORITIES = {LANE_INTERACTIVE: 0, LANE_BULK: 1, LANE_RETRY: 2}
+
 class SimpleTaskQueue:
     """Simple in-memory task queue for development"""
     
     def __init__(self):
-        self.immediate_queue = Queue()
+        # Entries are (lane priority, sequence, task) so lanes drain in priority order, FIFO within a lane
+        self.immediate_queue = PriorityQueue()
+        self._sequence = count()
         self.scheduled_tasks = []
+        # Last known status of each task id, reported through the task backend
+        self.task_status = {}
         self.running = False
+        self.accepting = True
         self.worker_thread = None
         self.scheduler_thread = None
+        self._drain_deadline = None
         self._lock = threading.Lock()
     
     def start(self):
@@ -39,27 +57,91 @@ class SimpleTaskQueue:
         
         logger.info("Simple task queue started")
     
-    def stop(self):
-        """Stop the task queue workers"""
+    def stop(self, drain_timeout=None):
+        """
+        Stop the task queue workers, draining queued tasks first
+        
+        New tasks are refused immediately. Queued immediate tasks keep running
+        for up to ``drain_timeout`` seconds; whatever is left after that, and
+        every scheduled task, is handed back to the delivery sweep.
+        """
+        if drain_timeout is None:
+            drain_timeout = settings.LEGACY_MESSAGE_SETTINGS.get('DRAIN_TIMEOUT', 30)
+        
+        self.accepting = False
+        self._drain_deadline = time.monotonic() + drain_timeout
         self.running = False
+        
         if self.worker_thread:
-            self.worker_thread.join(timeout=5)
+            self.worker_thread.join(timeout=drain_timeout + 1)
+            if self.worker_thread.is_alive():
+                logger.warning("Simple task queue drain timed out with a task still running")
         if self.scheduler_thread:
             self.scheduler_thread.join(timeout=5)
-        logger.info("Simple task queue stopped")
+        
+        leftovers = []
+        while True:
+            try:
+                leftovers.append(self.immediate_queue.get_nowait()[2])
+            except Empty:
+                break
+        with self._lock:
+            leftovers.extend(self.scheduled_tasks)
+            self.scheduled_tasks = []
+        for task in leftovers:
+            self._handoff(task)
+        
+        logger.info(f"Simple task queue stopped, {len(leftovers)} tasks handed off")
+    
+    def _draining(self):
+        """True while stopping and queued tasks remain within the drain budget"""
+        return (
+            self._drain_deadline is not None
+            and time.monotonic() < self._drain_deadline
+            and not self.immediate_queue.empty()
+        )
+    
+    def _handoff(self, task):
+        """
+        Hand a task that will not run here back to durable storage
+        
+        Message deliveries are put back in the 'scheduled' state so the
+        delivery sweep sends them once they are due; nothing is kept in memory.
+        """
+        self.task_status[task['id']] = 'handed_off'
+        if getattr(task['func'], '__name__', '') != 'send_single_message' or not task['args']:
+            logger.warning(f"Dropping task {task['id']} ({getattr(task['func'], '__name__', task['func'])}) on shutdown")
+            return
+        
+        from .models import LegacyMessage
+        message_id = task['args'][0]
+        try:
+            LegacyMessage.objects(id=message_id, status__ne='sent').update(set__status='scheduled')
+            logger.info(f"Handed message {message_id} back to the delivery sweep")
+        except Exception as e:
+            logger.error(f"Error handing off message {message_id}: {str(e)}")
     
     def enqueue_immediate(self, func, *args, **kwargs):
         """Enqueue a task for immediate execution"""
+        return self.enqueue_in_lane(LANE_BULK, func, *args, **kwargs)
+    
+    def enqueue_in_lane(self, lane, func, *args, **kwargs):
+        """Enqueue a task for immediate execution on an email lane"""
         task_id = f"task_{int(time.time())}_{id(func)}"
         task = {
             'id': task_id,
             'func': func,
             'args': args,
             'kwargs': kwargs,
+            'lane': lane,
             'created_at': timezone.now()
         }
-        self.immediate_queue.put(task)
-        logger.info(f"Enqueued immediate task {task_id}")
+        if not self.accepting:
+            self._handoff(task)
+            return None
+        self.task_status[task_id] = 'queued'
+        self.immediate_queue.put((LANE_PRIORITIES.get(lane, len(LANE_PRIORITIES)), next(self._sequence), task))
+        logger.info(f"Enqueued immediate task {task_id} on {lane}")
         return task_id
     
     def schedule_task(self, func, run_at, *args, **kwargs):
@@ -73,8 +155,12 @@ class SimpleTaskQueue:
             'run_at': run_at,
             'created_at': timezone.now()
         }
+        if not self.accepting:
+            self._handoff(task)
+            return None
         
         with self._lock:
+            self.task_status[task_id] = 'scheduled'
             self.scheduled_tasks.append(task)
             # Keep scheduled tasks sorted by run_at
             self.scheduled_tasks.sort(key=lambda x: x['run_at'])
@@ -86,13 +172,18 @@ class SimpleTaskQueue:
         """Cancel a scheduled task"""
         with self._lock:
             self.scheduled_tasks = [t for t in self.scheduled_tasks if t['id'] != task_id]
+            self.task_status[task_id] = 'canceled'
         logger.info(f"Cancelled task {task_id}")
     
+    def get_task_status(self, task_id):
+        """Get the status of a task, or 'not_found' for unknown ids"""
+        return self.task_status.get(task_id, 'not_found')
+    
     def _worker_loop(self):
         """Worker loop for immediate tasks"""
-        while self.running:
+        while self.running or self._draining():
             try:
-                task = self.immediate_queue.get(timeout=1)
+                _, _, task = self.immediate_queue.get(timeout=1)
                 self._execute_task(task)
                 self.immediate_queue.task_done()
             except Empty:
@@ -126,10 +217,13 @@ class SimpleTaskQueue:
         """Execute a single task"""
         try:
             logger.info(f"Executing task {task['id']}")
+            self.task_status[task['id']] = 'started'
             result = task['func'](*task['args'], **task['kwargs'])
+            self.task_status[task['id']] = 'finished'
             logger.info(f"Task {task['id']} completed successfully")
             return result
         except Exception as e:
+            self.task_status[task['id']] = 'failed'
             logger.error(f"Task {task['id']} failed: {str(e)}")
             raise
 
@@ -142,6 +236,8 @@ def get_task_queue():
     if _task_queue is None:
         _task_queue = SimpleTaskQueue()
         _task_queue.start()
+        # Drain on interpreter exit so a restart does not lose queued deliveries
+        atexit.register(_task_queue.stop)
     return _task_queue
 
 # Task functions that work with both Redis and simple queue
@@ -150,42 +246,10 @@ def send_single_message(message_id):
     from .email_service import LegacyEmailService
     return LegacyEmailService.send_legacy_message(message_id)
 
-def schedule_message_delivery(message_id, delivery_datetime):
-    """Schedule a message for delivery at a specific time"""
-    try:
-        # Try Redis first
-        import django_rq
-        scheduler = django_rq.get_scheduler('email')
-        job = scheduler.enqueue_at(
-            delivery_datetime,
-            send_single_message,
-            message_id,
-            job_id=f'deliver_message_{message_id}'
-        )
-        logger.info(f"Scheduled message {message_id} with Redis")
-        return job.id
-    except Exception as e:
-        logger.warning(f"Redis not available, using simple queue: {str(e)}")
-        # Fallback to simple queue
-        queue = get_task_queue()
-        job_id = queue.schedule_task(send_single_message, delivery_datetime, message_id)
-        return job_id
-
-def enqueue_immediate_delivery(message_id):
-    """Queue a message for immediate delivery"""
-    try:
-        # Try Redis first
-        import django_rq
-        queue = django_rq.get_queue('email')
-        job = queue.enqueue(send_single_message, message_id)
-        logger.info(f"Queued message {message_id} with Redis")
-        return job.id
-    except Exception as e:
-        logger.warning(f"Redis not available, using simple queue: {str(e)}")
-        # Fallback to simple queue
-        queue = get_task_queue()
-        job_id = queue.enqueue_immediate(send_single_message, message_id)
-        return job_id
+def send_test_message(message_id):
+    """Send the test version of a legacy message"""
+    from .email_service import LegacyEmailService
+    return LegacyEmailService.send_test_message(message_id)
 
 def process_delivery_queue():
     """Process all pending deliveries"""
@@ -0,0 +1,555 @@
+"""
+Pluggable task backends for background work
+
+The project historically ran three schedulers side by side: django-rq for
+legacy deliveries, Celery for the dead man's switch and an in-process queue
+as a development fallback. Every caller now goes through one interface
+(enqueue, enqueue_at, cancel, status, batch) and the deployment picks the
+backend in ``TASK_BACKEND``, so a single worker fleet and a single broker
+connection pool can serve the whole project.
+
+Tasks are referenced by dotted path (e.g. ``'legacy.tasks.send_single_message'``)
+so callers never need to import a broker library themselves.
+"""
+import logging
+import threading
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Queue names understood by every backend
+DEFAULT_QUEUE = 'default'
+LANE_INTERACTIVE = 'email-interactive'
+LANE_BULK = 'email-bulk'
+LANE_RETRY = 'email-retry'
+
+# Scheduled delivery jobs are named after their message
+DELIVERY_JOB_PREFIX = 'deliver_message_'
+
+# Every queue an email worker serves; 'email' still drains jobs enqueued before the lanes existed
+EMAIL_QUEUES = [LANE_INTERACTIVE, LANE_BULK, LANE_RETRY, 'email']
+
+DEFAULT_TASK_BACKEND_SETTINGS = {
+    'BACKEND': 'rq',  # 'rq', 'celery' or 'simple'
+    'FALLBACK': 'simple',  # Used when the primary backend fails; None to disable
+    'CELERY_ROUTE_QUEUES': False,  # Send to Celery queues named like the RQ queues
+    'CELERY_MAX_ETA_SECONDS': 3000,  # Latest ETA handed to Celery; keep below the broker's visibility_timeout
+}
+
+_shared_connection = None
+_backend = None
+_lock = threading.Lock()
+
+
+def get_task_backend_settings():
+    """Get task backend settings merged over the defaults"""
+    config = dict(DEFAULT_TASK_BACKEND_SETTINGS)
+    config.update(getattr(settings, 'TASK_BACKEND', {}))
+    return config
+
+
+def get_shared_redis_connection():
+    """
+    Get the Redis connection shared by every queue in this process
+
+    django_rq builds a new client (and connection pool) per queue lookup;
+    reusing one client keeps a single pool per process for all queues,
+    schedulers and coordination keys.
+    """
+    global _shared_connection
+    if _shared_connection is None:
+        with _lock:
+            if _shared_connection is None:
+                import django_rq
+                _shared_connection = django_rq.get_connection(DEFAULT_QUEUE)
+    return _shared_connection
+
+
+def task_path(func):
+    """Return the dotted path of a task given as a callable or a string"""
+    if isinstance(func, str):
+        return func
+    # Celery tasks carry their registered name
+    name = getattr(func, 'name', None)
+    if isinstance(name, str) and '.' in name:
+        return name
+    return f"{func.__module__}.{func.__name__}"
+
+
+class BaseTaskBackend:
+    """Interface every task backend implements"""
+
+    name = None
+
+    def enqueue(self, func, args=(), kwargs=None, queue=DEFAULT_QUEUE, job_id=None):
+        """
+        Run a task as soon as a worker is free
+
+        Returns:
+            str: Id of the created job
+        """
+        raise NotImplementedError
+
+    def enqueue_at(self, when, func, args=(), kwargs=None, queue=DEFAULT_QUEUE, job_id=None):
+        """
+        Run a task at a given time
+
+        Returns:
+            str: Id of the created job
+        """
+        raise NotImplementedError
+
+    def cancel(self, job_id):
+        """
+        Cancel a queued or scheduled job
+
+        Returns:
+            bool: True if a job was cancelled
+        """
+        raise NotImplementedError
+
+    def status(self, job_id):
+        """
+        Get the status of a job
+
+        Returns:
+            dict: At least 'job_id' and 'status'
+        """
+        raise NotImplementedError
+
+    def batch(self, func, args_list, queue=DEFAULT_QUEUE):
+        """
+        Enqueue the same task once per argument tuple in as few round trips as possible
+
+        Returns:
+            list: Ids of the created jobs, in the order of ``args_list``
+        """
+        return [self.enqueue(func, args=args, queue=queue) for args in args_list]
+
+    def system_status(self):
+        """
+        Describe the backend's connectivity and queues for status endpoints
+
+        Returns:
+            dict: 'connected', 'mode' and 'queue_info'
+        """
+        return {
+            'connected': False,
+            'mode': 'fallback',
+            'queue_info': {'queued_jobs': 0, 'failed_jobs': 0, 'workers': 0}
+        }
+
+
+class RQBackend(BaseTaskBackend):
+    """django-rq queues plus rq-scheduler for timed jobs"""
+
+    name = 'rq'
+
+    def get_queue(self, queue=DEFAULT_QUEUE):
+        import django_rq
+        return django_rq.get_queue(queue, connection=get_shared_redis_connection())
+
+    def get_scheduler(self, queue=DEFAULT_QUEUE):
+        import django_rq
+        return django_rq.get_scheduler(queue, connection=get_shared_redis_connection())
+
+    def get_retention(self, path):
+        from .tasks import get_task_retention
+        return get_task_retention(path)
+
+    def enqueue(self, func, args=(), kwargs=None, queue=DEFAULT_QUEUE, job_id=None):
+        path = task_path(func)
+        job = self.get_queue(queue).enqueue_call(
+            path, args=tuple(args), kwargs=kwargs or {}, job_id=job_id, **self.get_retention(path)
+        )
+        return job.id
+
+    def enqueue_at(self, when, func, args=(), kwargs=None, queue=DEFAULT_QUEUE, job_id=None):
+        path = task_path(func)
+        retention = self.get_retention(path)
+        job = self.get_scheduler(queue).enqueue_at(
+            when, path, *args, job_id=job_id,
+            job_result_ttl=retention['result_ttl'], job_ttl=retention['ttl'],
+            **(kwargs or {})
+        )
+        if retention['failure_ttl'] is not None:
+            # rq-scheduler has no failure_ttl argument; RQ reads it from the job hash
+            job.connection.hset(job.key, 'failure_ttl', retention['failure_ttl'])
+        return job.id
+
+    def cancel(self, job_id):
+        from rq.job import Job
+        from rq.exceptions import NoSuchJobError
+
+        cancelled = False
+        scheduler = self.get_scheduler()
+        if job_id in scheduler:
+            scheduler.cancel(job_id)
+            cancelled = True
+
+        try:
+            job = Job.fetch(job_id, connection=get_shared_redis_connection())
+        except NoSuchJobError:
+            return cancelled
+
+        if cancelled or job.get_status() in ('queued', 'deferred', 'scheduled'):
+            job.delete()
+            cancelled = True
+        return cancelled
+
+    def status(self, job_id):
+        from .tasks import get_job_status
+        return get_job_status(job_id)
+
+    def batch(self, func, args_list, queue=DEFAULT_QUEUE):
+        from rq import Queue
+
+        rq_queue = self.get_queue(queue)
+        path = task_path(func)
+        retention = self.get_retention(path)
+        jobs = rq_queue.enqueue_many([
+            Queue.prepare_data(path, args=tuple(args), **retention) for args in args_list
+        ])
+        return [job.id for job in jobs]
+
+    def system_status(self):
+        from .tasks import get_redis_status
+        return get_redis_status()
+
+
+class CeleryBackend(BaseTaskBackend):
+    """
+    Celery workers; legacy tasks run through the generic execute_task task
+
+    Celery keeps ETA tasks in the worker's memory, and with a Redis broker an
+    unacknowledged task is redelivered every ``visibility_timeout`` (1 hour by
+    default), so a delivery months away would be handed out over and over.
+    Revokes are only held in memory by the workers that received them as well.
+    ETAs further out than ``max_eta_seconds`` are therefore not enqueued: the
+    periodic delivery sweep picks the message up once it is due.
+    """
+
+    name = 'celery'
+
+    def __init__(self, route_queues=False, max_eta_seconds=None):
+        self.route_queues = route_queues
+        self.max_eta_seconds = max_eta_seconds
+
+    def _signature(self, func, args, kwargs, queue):
+        from celery import signature
+
+        options = {}
+        if self.route_queues and queue != DEFAULT_QUEUE:
+            options['queue'] = queue
+
+        if hasattr(func, 'signature'):
+            return func.signature(args=tuple(args), kwargs=kwargs or {}, **options)
+        return signature(
+            'legacy.tasks.execute_task',
+            args=(task_path(func), list(args), kwargs or {}),
+            **options
+        )
+
+    def enqueue(self, func, args=(), kwargs=None, queue=DEFAULT_QUEUE, job_id=None):
+        result = self._signature(func, args, kwargs, queue).apply_async(task_id=job_id)
+        return result.id
+
+    def enqueue_at(self, when, func, args=(), kwargs=None, queue=DEFAULT_QUEUE, job_id=None):
+        if self.max_eta_seconds is not None and when > timezone.now() + timedelta(seconds=self.max_eta_seconds):
+            # Too far out for the broker; an earlier job under this id must not fire either
+            if job_id:
+                self.cancel(job_id)
+            logger.debug(f"ETA {when} beyond {self.max_eta_seconds}s, leaving {task_path(func)} to the periodic sweep")
+            return None
+        result = self._signature(func, args, kwargs, queue).apply_async(eta=when, task_id=job_id)
+        return result.id
+
+    def cancel(self, job_id):
+        from celery.result import AsyncResult
+        from afteryou.celery import app
+
+        if AsyncResult(job_id).ready():
+            return False
+        replies = app.control.revoke(job_id, reply=True, timeout=1.0) or []
+        # Only workers that answered will drop the task
+        return any('ok' in reply for response in replies for reply in response.values())
+
+    def status(self, job_id):
+        from celery.result import AsyncResult
+
+        result = AsyncResult(job_id)
+        return {
+            'job_id': job_id,
+            'status': result.state.lower(),
+            'result': str(result.result) if result.ready() and result.successful() else None,
+            'exc_info': result.traceback if result.failed() else None,
+        }
+
+    def batch(self, func, args_list, queue=DEFAULT_QUEUE):
+        from celery import group
+
+        result = group(
+            self._signature(func, args, None, queue) for args in args_list
+        ).apply_async()
+        return [child.id for child in result.children]
+
+    def system_status(self):
+        try:
+            from afteryou.celery import app
+            active = app.control.inspect().active() or {}
+            return {
+                'connected': True,
+                'mode': 'celery',
+                'queue_info': {
+                    'queued_jobs': sum(len(tasks) for tasks in active.values()),
+                    'failed_jobs': 0,
+                    'workers': len(active),
+                }
+            }
+        except Exception as e:
+            status = super().system_status()
+            status['error'] = str(e)
+            return status
+
+
+class SimpleQueueBackend(BaseTaskBackend):
+    """In-process SimpleTaskQueue for development without a broker"""
+
+    name = 'simple'
+
+    def get_queue(self):
+        from .simple_tasks import get_task_queue
+        return get_task_queue()
+
+    def enqueue(self, func, args=(), kwargs=None, queue=DEFAULT_QUEUE, job_id=None):
+        func = import_string(func) if isinstance(func, str) else func
+        return self.get_queue().enqueue_in_lane(queue, func, *args, **(kwargs or {}))
+
+    def enqueue_at(self, when, func, args=(), kwargs=None, queue=DEFAULT_QUEUE, job_id=None):
+        func = import_string(func) if isinstance(func, str) else func
+        return self.get_queue().schedule_task(func, when, *args, **(kwargs or {}))
+
+    def cancel(self, job_id):
+        from . import simple_tasks
+        if simple_tasks._task_queue is None or job_id not in simple_tasks._task_queue.task_status:
+            return False
+        simple_tasks._task_queue.cancel_task(job_id)
+        return True
+
+    def status(self, job_id):
+        # Don't start the in-process queue just to answer a status query
+        from . import simple_tasks
+        queue = simple_tasks._task_queue
+        return {
+            'job_id': job_id,
+            'status': queue.get_task_status(job_id) if queue else 'not_found',
+        }
+
+
+class FallbackTaskBackend(BaseTaskBackend):
+    """Send work to the primary backend and fall back to a second one when it fails"""
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+
+    @property
+    def name(self):
+        return self.primary.name
+
+    def _call(self, method, *args, **kwargs):
+        try:
+            return getattr(self.primary, method)(*args, **kwargs)
+        except Exception as e:
+            logger.warning(f"{self.primary.name} backend unavailable, using {self.fallback.name}: {str(e)}")
+            return getattr(self.fallback, method)(*args, **kwargs)
+
+    def enqueue(self, *args, **kwargs):
+        return self._call('enqueue', *args, **kwargs)
+
+    def enqueue_at(self, *args, **kwargs):
+        return self._call('enqueue_at', *args, **kwargs)
+
+    def cancel(self, job_id):
+        # The job may have been created by either backend
+        return self._call('cancel', job_id) or self.fallback.cancel(job_id)
+
+    def status(self, job_id):
+        info = self._call('status', job_id)
+        if info.get('status') in ('not_found', 'unknown', 'error'):
+            fallback_info = self.fallback.status(job_id)
+            if fallback_info.get('status') != 'not_found':
+                return fallback_info
+        return info
+
+    def batch(self, *args, **kwargs):
+        return self._call('batch', *args, **kwargs)
+
+    def system_status(self):
+        return self.primary.system_status()
+
+
+def build_backend(name, config):
+    if name == 'rq':
+        return RQBackend()
+    if name == 'celery':
+        return CeleryBackend(
+            route_queues=config['CELERY_ROUTE_QUEUES'],
+            max_eta_seconds=config['CELERY_MAX_ETA_SECONDS']
+        )
+    if name == 'simple':
+        return SimpleQueueBackend()
+    raise ValueError(f"Unknown task backend: {name}")
+
+
+def get_task_backend():
+    """Get the task backend configured in TASK_BACKEND"""
+    global _backend
+    if _backend is None:
+        with _lock:
+            if _backend is None:
+                config = get_task_backend_settings()
+                backend = build_backend(config['BACKEND'], config)
+                if config['FALLBACK'] and config['FALLBACK'] != config['BACKEND']:
+                    backend = FallbackTaskBackend(backend, build_backend(config['FALLBACK'], config))
+                _backend = backend
+    return _backend
+
+
+# Delivery helpers
+
+def delivery_job_id(message_id):
+    """Id of the scheduled delivery job of a message"""
+    return f'{DELIVERY_JOB_PREFIX}{message_id}'
+
+
+def schedule_message_delivery(message_id, delivery_datetime):
+    """
+    Schedule a specific message for delivery at a specific time
+
+    Args:
+        message_id (str): MongoDB ObjectId of the message
+        delivery_datetime (datetime): When to deliver the message
+    """
+    from .admission import admit_enqueue
+    if not admit_enqueue(message_id, scheduled=True):
+        return None
+
+    try:
+        job_id = get_task_backend().enqueue_at(
+            delivery_datetime,
+            'legacy.tasks.send_single_message',
+            args=(message_id,),
+            queue=LANE_BULK,
+            job_id=delivery_job_id(message_id)
+        )
+
+        if job_id is None:
+            logger.info(f"Message {message_id} due at {delivery_datetime} is left to the delivery sweep")
+            return None
+        logger.info(f"Scheduled message {message_id} for delivery at {delivery_datetime}")
+        return job_id
+
+    except Exception as e:
+        logger.error(f"Error scheduling message delivery: {str(e)}")
+        return None
+
+
+def cancel_message_delivery(message_id):
+    """
+    Cancel the scheduled delivery job of a message, if there is one
+
+    Args:
+        message_id (str): MongoDB ObjectId of the message
+    """
+    try:
+        cancelled = get_task_backend().cancel(delivery_job_id(message_id))
+        if cancelled:
+            logger.info(f"Cancelled scheduled delivery of message {message_id}")
+        return cancelled
+
+    except Exception as e:
+        logger.error(f"Error cancelling delivery of message {message_id}: {str(e)}")
+        return False
+
+
+def enqueue_immediate_delivery(message_id, lane=LANE_INTERACTIVE):
+    """
+    Queue a message for immediate delivery
+
+    Args:
+        message_id (str): MongoDB ObjectId of the message
+        lane (str): Email lane to deliver through (default: interactive)
+    """
+    from .admission import admit_enqueue
+    if not admit_enqueue(message_id):
+        return None
+
+    try:
+        job_id = get_task_backend().enqueue(
+            'legacy.tasks.send_single_message',
+            args=(message_id,),
+            queue=lane
+        )
+
+        logger.info(f"Queued message {message_id} for immediate delivery on {lane}")
+        return job_id
+
+    except Exception as e:
+        logger.error(f"Error queuing immediate delivery: {str(e)}")
+        return None
+
+
+def enqueue_immediate_deliveries(message_ids, lane=LANE_BULK):
+    """
+    Queue many messages for immediate delivery in as few round trips as possible
+
+    Args:
+        message_ids (list): MongoDB ObjectIds of the messages
+        lane (str): Email lane to deliver through (default: bulk)
+
+    Returns:
+        list: Ids of the created jobs, empty if the batch was deferred or failed
+    """
+    from .admission import admit_enqueue_many
+    if not message_ids or not admit_enqueue_many(message_ids):
+        return []
+
+    try:
+        job_ids = get_task_backend().batch(
+            'legacy.tasks.send_single_message',
+            [(message_id,) for message_id in message_ids],
+            queue=lane
+        )
+
+        logger.info(f"Queued {len(job_ids)} messages for immediate delivery on {lane}")
+        return job_ids
+
+    except Exception as e:
+        logger.error(f"Error queuing immediate deliveries: {str(e)}")
+        return []
+
+
+def enqueue_test_delivery(message_id):
+    """
+    Queue the test version of a message on the interactive lane
+
+    Args:
+        message_id (str): MongoDB ObjectId of the message
+    """
+    try:
+        job_id = get_task_backend().enqueue(
+            'legacy.tasks.send_test_message',
+            args=(message_id,),
+            queue=LANE_INTERACTIVE
+        )
+
+        logger.info(f"Queued test delivery of message {message_id}")
+        return job_id
+
+    except Exception as e:
+        logger.error(f"Error queuing test delivery: {str(e)}")
+        return None
@@ -2,21 +2,63 @@
 Background tasks for legacy message delivery using Django-RQ
 """
 import logging
+import uuid
 from datetime import timedelta
+from django.conf import settings
 from django.utils import timezone
+from django.utils.module_loading import import_string
 from django_rq import job
-import django_rq
-import redis
+from celery import shared_task
 from rq import Queue, Worker
-from .email_service import LegacyEmailService
+from .email_service import SKIPPED, LegacyEmailService
 from .models import LegacyMessage
+from .workers import pop_prefetched_result
+from .leader import is_current_token
+from .catchup import deliver_chunk, is_catchup_active, start_catchup_if_needed
+from .partitions import acquire_partition_lock, release_partition_lock
+from .reconciler import reconcile_scheduled_jobs
+from .retention import compact_registries
+from .circuit_breaker import is_circuit_open
+from .task_backends import (
+    LANE_INTERACTIVE, LANE_BULK, LANE_RETRY, EMAIL_QUEUES, get_shared_redis_connection,
+    schedule_message_delivery, enqueue_immediate_delivery, enqueue_test_delivery,
+    cancel_message_delivery
+)
 
 logger = logging.getLogger(__name__)
 
+# How long RQ keeps each task's data in Redis, in seconds. result_ttl keeps a
+# successful result, failure_ttl a failed job, ttl bounds the time a job may
+# wait in a queue (None: never dropped). Overridden by TASK_RETENTION in settings.
+DEFAULT_TASK_RETENTION = {
+    'default': {'result_ttl': 3600, 'failure_ttl': 7 * 86400, 'ttl': None},
+    # Sweeps run every few minutes; a result is only useful for monitoring
+    'legacy.tasks.process_delivery_queue': {'result_ttl': 600, 'failure_ttl': 86400, 'ttl': 3600},
+    'legacy.tasks.send_single_message': {'result_ttl': 3600, 'failure_ttl': 7 * 86400, 'ttl': None},
+    'legacy.tasks.send_test_message': {'result_ttl': 600, 'failure_ttl': 86400, 'ttl': 3600},
+    'legacy.tasks.deliver_message_chunk': {'result_ttl': 3600, 'failure_ttl': 7 * 86400, 'ttl': None},
+    'legacy.tasks.reconcile_scheduled_deliveries': {'result_ttl': 600, 'failure_ttl': 86400, 'ttl': 3600},
+    'legacy.tasks.compact_job_registries': {'result_ttl': 600, 'failure_ttl': 86400, 'ttl': 3600},
+}
+
+def get_task_retention(func_path):
+    """
+    Get the result_ttl, failure_ttl and ttl to enqueue a task with
+    
+    Args:
+        func_path (str): Dotted path of the task function
+    """
+    overrides = getattr(settings, 'TASK_RETENTION', {})
+    retention = dict(DEFAULT_TASK_RETENTION['default'])
+    retention.update(overrides.get('default', {}))
+    retention.update(DEFAULT_TASK_RETENTION.get(func_path, {}))
+    retention.update(overrides.get(func_path, {}))
+    return retention
+
 def get_redis_connection():
     """Get Redis connection for status checking"""
     try:
-        return django_rq.get_connection('default')
+        return get_shared_redis_connection()
     except Exception as e:
         logger.error(f"Failed to get Redis connection: {e}")
         return None
@@ -37,16 +79,21 @@ def get_redis_status():
         
         # Get queue information
         default_queue = Queue('default', connection=conn)
-        email_queue = Queue('email', connection=conn)
+        email_queues = [Queue(name, connection=conn) for name in EMAIL_QUEUES]
+        lane_sizes = {queue.name: len(queue) for queue in email_queues}
+        email_queue_size = sum(lane_sizes.values())
         
         workers = Worker.all(connection=conn)
         
         queue_info = {
-            'queued_jobs': len(default_queue) + len(email_queue),
-            'failed_jobs': len(default_queue.failed_job_registry) + len(email_queue.failed_job_registry),
+            'queued_jobs': len(default_queue) + email_queue_size,
+            'failed_jobs': len(default_queue.failed_job_registry) + sum(
+                len(queue.failed_job_registry) for queue in email_queues
+            ),
             'workers': len(workers),
             'default_queue_size': len(default_queue),
-            'email_queue_size': len(email_queue)
+            'email_queue_size': email_queue_size,
+            'lane_sizes': lane_sizes
         }
         
         return {
@@ -99,12 +146,61 @@ def get_job_status(job_id):
             'message': str(e)
         }
 
-@job('email')
-def process_delivery_queue():
+@job(LANE_BULK)
+def process_delivery_queue(fencing_token=None, partition=None, partition_count=None, check_backlog=True):
     """
     Task to process all pending legacy message deliveries
     This task runs periodically to check for due messages
+    
+    Args:
+        fencing_token (int): Token of the scheduler leader that enqueued the sweep
+        partition (int): Only sweep this partition (partitioned scheduling)
+        partition_count (int): Number of partitions the due set is split into
+        check_backlog (bool): Count the overdue backlog and start a catch-up run
+            if needed; the scheduler sets it on one sweep per tick
     """
+    if fencing_token is not None and not is_current_token(fencing_token):
+        logger.warning(f"Skipping delivery sweep from superseded scheduler leader (token {fencing_token})")
+        return {
+            'skipped': 'stale fencing token',
+            'total_processed': 0,
+            'successful': 0,
+            'failed': 0
+        }
+    
+    if is_circuit_open():
+        logger.warning("SMTP circuit breaker is open, skipping delivery sweep")
+        return {
+            'skipped': 'smtp circuit open',
+            'total_processed': 0,
+            'successful': 0,
+            'failed': 0
+        }
+    
+    # An overdue backlog is drained by a catch-up run rather than one long sweep
+    try:
+        if is_catchup_active():
+            logger.info("Catch-up run in progress, skipping regular delivery sweep")
+            return {
+                'skipped': 'catch-up in progress',
+                'total_processed': 0,
+                'successful': 0,
+                'failed': 0
+            }
+        catchup = start_catchup_if_needed() if check_backlog else None
+        if catchup:
+            return {
+                'catchup': catchup,
+                'total_processed': 0,
+                'successful': 0,
+                'failed': 0
+            }
+    except Exception as e:
+        logger.error(f"Error checking for an overdue backlog: {str(e)}")
+    
+    if partition is not None:
+        return process_delivery_partition(partition, partition_count)
+    
     logger.info("Starting delivery queue processing...")
     
     try:
@@ -131,6 +227,59 @@ def process_delivery_queue():
             'failed': 0
         }
 
+@job(LANE_BULK)
+def deliver_message_chunk(message_ids, run_id):
+    """
+    Task to deliver one chunk of a catch-up run
+    
+    Args:
+        message_ids (list): MongoDB ObjectIds in the chunk, oldest first
+        run_id (str): Catch-up run the chunk belongs to
+    """
+    logger.info(f"Delivering catch-up chunk of {len(message_ids)} messages (run {run_id})")
+    
+    try:
+        return deliver_chunk(message_ids, run_id)
+    except Exception as e:
+        logger.error(f"Error delivering catch-up chunk (run {run_id}): {str(e)}")
+        return {'error': str(e)}
+
+def process_delivery_partition(partition, partition_count):
+    """
+    Sweep one partition of the due set while holding its lock
+    
+    Args:
+        partition (int): Partition to sweep
+        partition_count (int): Number of partitions the due set is split into
+    """
+    owner = uuid.uuid4().hex
+    try:
+        if not acquire_partition_lock(partition, partition_count, owner):
+            logger.info(f"Partition {partition}/{partition_count} is already being swept, skipping")
+            return {
+                'skipped': 'partition locked',
+                'total_processed': 0,
+                'successful': 0,
+                'failed': 0
+            }
+    except Exception as e:
+        # Without Redis the lock cannot be taken; sweeping twice is safer than not at all
+        logger.warning(f"Could not lock partition {partition}/{partition_count}: {str(e)}")
+    
+    try:
+        results = LegacyEmailService.process_pending_deliveries(partition, partition_count)
+        if results['total_processed'] > 0:
+            logger.info(
+                f"Partition {partition}/{partition_count} sweep completed: "
+                f"{results['successful']} sent, {results['failed']} failed"
+            )
+        return results
+    finally:
+        try:
+            release_partition_lock(partition, partition_count, owner)
+        except Exception as e:
+            logger.warning(f"Could not release partition {partition}/{partition_count}: {str(e)}")
+
 @job('email')
 def send_single_message(message_id):
     """
@@ -142,9 +291,19 @@ def send_single_message(message_id):
     logger.info(f"Processing single message delivery: {message_id}")
     
     try:
-        success = LegacyEmailService.send_legacy_message(message_id)
+        # A BatchEmailWorker may already have delivered this message in a batch
+        success = pop_prefetched_result(message_id)
+        if success is None:
+            success = LegacyEmailService.send_legacy_message(message_id)
         
-        if success:
+        if success is None:
+            # SMTP breaker open: the message stays scheduled for the sweep
+            logger.info(f"Delivery of message {message_id} deferred until the SMTP relay recovers")
+        elif success == SKIPPED:
+            # Duplicate job for a message the batch found already handled
+            logger.info(f"Message {message_id} was already sent, failed or deleted, skipped")
+            return True
+        elif success:
             logger.info(f"Successfully delivered message {message_id}")
         else:
             logger.warning(f"Failed to deliver message {message_id}")
@@ -155,6 +314,22 @@ def send_single_message(message_id):
         logger.error(f"Error sending message {message_id}: {str(e)}")
         return False
 
+@job(LANE_INTERACTIVE)
+def send_test_message(message_id):
+    """
+    Task to send the test version of a legacy message
+    
+    Args:
+        message_id (str): MongoDB ObjectId of the message
+    """
+    logger.info(f"Processing test message delivery: {message_id}")
+    
+    try:
+        return LegacyEmailService.send_test_message(message_id)
+    except Exception as e:
+        logger.error(f"Error sending test message {message_id}: {str(e)}")
+        return False
+
 @job('default')
 def schedule_message(message_id):
     """
@@ -179,7 +354,7 @@ def schedule_message(message_id):
         logger.error(f"Error scheduling message {message_id}: {str(e)}")
         return False
 
-@job('email')
+@job(LANE_RETRY)
 def retry_failed_messages():
     """
     Task to retry sending failed messages
@@ -207,7 +382,12 @@ def retry_failed_messages():
                 message.status = 'scheduled'
                 message.save()
                 
-                if LegacyEmailService.send_legacy_message(str(message.id)):
+                success = LegacyEmailService.send_legacy_message(str(message.id))
+                if success is None:
+                    # SMTP breaker open; the rest are retried once it closes
+                    retry_count -= 1
+                    break
+                if success:
                     success_count += 1
         
         logger.info(f"Retry completed: {success_count} successful out of {retry_count} retried")
@@ -222,6 +402,32 @@ def retry_failed_messages():
         logger.error(f"Error in retry failed messages: {str(e)}")
         return {'error': str(e)}
 
+@job('default')
+def reconcile_scheduled_deliveries():
+    """
+    Task to remove orphaned scheduled delivery jobs and re-time moved ones
+    """
+    logger.info("Starting scheduled job reconciliation...")
+    
+    try:
+        return reconcile_scheduled_jobs()
+    except Exception as e:
+        logger.error(f"Error reconciling scheduled jobs: {str(e)}")
+        return {'error': str(e)}
+
+@job('default')
+def compact_job_registries():
+    """
+    Task to trim finished and failed job registries to their retention limits
+    """
+    logger.info("Starting job registry compaction...")
+    
+    try:
+        return compact_registries()
+    except Exception as e:
+        logger.error(f"Error compacting job registries: {str(e)}")
+        return {'error': str(e)}
+
 @job('default')
 def cleanup_old_messages():
     """
@@ -252,49 +458,17 @@ def cleanup_old_messages():
         logger.error(f"Error in cleanup: {str(e)}")
         return {'error': str(e)}
 
-# Helper functions for scheduling tasks
-
-def schedule_message_delivery(message_id, delivery_datetime):
+@shared_task(name='legacy.tasks.execute_task')
+def execute_task(func_path, args=None, kwargs=None):
     """
-    Schedule a specific message for delivery at a specific time
-    
-    Args:
-        message_id (str): MongoDB ObjectId of the message
-        delivery_datetime (datetime): When to deliver the message
-    """
-    try:
-        # Get the scheduler
-        scheduler = django_rq.get_scheduler('email')
-        
-        # Schedule the message for the specific delivery time
-        job = scheduler.enqueue_at(
-            delivery_datetime,
-            send_single_message,
-            message_id,
-            job_id=f'deliver_message_{message_id}'
-        )
-        
-        logger.info(f"Scheduled message {message_id} for delivery at {delivery_datetime}")
-        return job.id
-        
-    except Exception as e:
-        logger.error(f"Error scheduling message delivery: {str(e)}")
-        return None
+    Run any project task by dotted path on a Celery worker
+
+    Used by the Celery task backend so legacy tasks can share the Celery
+    worker fleet without being declared as Celery tasks themselves.
 
-def enqueue_immediate_delivery(message_id):
-    """
-    Queue a message for immediate delivery
-    
     Args:
-        message_id (str): MongoDB ObjectId of the message
+        func_path (str): Dotted path of the task function
+        args (list): Positional arguments
+        kwargs (dict): Keyword arguments
     """
-    try:
-        queue = django_rq.get_queue('email')
-        job = queue.enqueue(send_single_message, message_id)
-        
-        logger.info(f"Queued message {message_id} for immediate delivery")
-        return job.id
-        
-    except Exception as e:
-        logger.error(f"Error queuing immediate delivery: {str(e)}")
-        return None
+    return import_string(func_path)(*(args or []), **(kwargs or {}))
@@ -1,3 +1,69 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
+from bson import ObjectId
+from django.core import mail
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from .email_service import SKIPPED, LegacyEmailService
+from .models import LegacyMessage
 
-# Create your tests here.
+
+def build_message(status):
+    return LegacyMessage(
+        id=ObjectId(),
+        user_id='1',
+        title='Title',
+        content='Content',
+        recipient_email='recipient@example.com',
+        delivery_date=timezone.now() - timedelta(minutes=1),
+        status=status,
+    )
+
+
+class FakeObjects:
+    """Stands in for ``LegacyMessage.objects``, recording status updates"""
+
+    def __init__(self, messages):
+        self.messages = {str(message.id): message for message in messages}
+        self.updates = []
+
+    def __call__(self, id__in, status__in=None):
+        matches = [
+            self.messages[message_id] for message_id in id__in
+            if message_id in self.messages and (status__in is None or self.messages[message_id].status in status__in)
+        ]
+        return mock.Mock(
+            __iter__=lambda _: iter(matches),
+            update=lambda **fields: self.updates.append((sorted(id__in), fields)),
+        )
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    SMTP_CIRCUIT_BREAKER={'ENABLED': False},
+)
+class SendLegacyMessagesBatchTests(SimpleTestCase):
+    def send_batch(self, messages):
+        objects = FakeObjects(messages)
+        with mock.patch.object(LegacyMessage, 'objects', objects):
+            results = LegacyEmailService.send_legacy_messages_batch([str(message.id) for message in messages])
+        return results, objects.updates
+
+    def test_created_messages_are_sent(self):
+        messages = [build_message('created'), build_message('created')]
+
+        results, updates = self.send_batch(messages)
+
+        self.assertEqual(results, {str(message.id): True for message in messages})
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(updates[0][0], sorted(str(message.id) for message in messages))
+        self.assertEqual(updates[0][1]['set__status'], 'sent')
+
+    def test_sent_and_failed_messages_are_skipped(self):
+        sent, failed, scheduled = build_message('sent'), build_message('failed'), build_message('scheduled')
+
+        results, _ = self.send_batch([sent, failed, scheduled])
+
+        self.assertEqual(results, {str(sent.id): SKIPPED, str(failed.id): SKIPPED, str(scheduled.id): True})
+        self.assertEqual(len(mail.outbox), 1)
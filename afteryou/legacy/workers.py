@@ -0,0 +1,231 @@
+"""
+Custom RQ workers for legacy message delivery
+"""
+import logging
+import time
+import uuid
+from django.conf import settings
+from rq import SimpleWorker
+from rq.job import Job
+from rq.worker import WorkerStatus
+from .email_service import LegacyEmailService
+
+logger = logging.getLogger(__name__)
+
+# Jobs with this function name can be folded into one batched delivery
+BATCHABLE_FUNC_NAME = 'legacy.tasks.send_single_message'
+
+# Pop up to ARGV[1] job ids and register each in the StartedJobRegistry in the
+# same step, so jobs claimed by a worker that dies are cleaned up as abandoned
+# instead of vanishing
+CLAIM_BATCH_SCRIPT = """
+local ids = redis.call('lpop', KEYS[1], ARGV[1])
+if not ids then
+    return {}
+end
+for _, id in ipairs(ids) do
+    redis.call('zadd', KEYS[2], ARGV[2], id .. ':' .. ARGV[3])
+end
+return ids
+"""
+
+# Delivery outcomes computed by the current batch, keyed by message id.
+# send_single_message consumes these instead of opening its own SMTP session.
+_prefetched_results = {}
+
+
+def pop_prefetched_result(message_id):
+    """
+    Return the batch delivery outcome for a message, if one is pending
+
+    Args:
+        message_id (str): MongoDB ObjectId of the message
+
+    Returns:
+        bool or None: Delivery outcome, or None when the message was not batched
+    """
+    return _prefetched_results.pop(str(message_id), None)
+
+
+def get_email_batch_size():
+    """Get the configured number of jobs to deliver per batch"""
+    return settings.LEGACY_MESSAGE_SETTINGS.get('EMAIL_BATCH_SIZE', 1)
+
+
+def get_drain_timeout():
+    """Get the seconds a stopping worker may spend finishing its current batch"""
+    return settings.LEGACY_MESSAGE_SETTINGS.get('DRAIN_TIMEOUT', 30)
+
+
+def get_lane_weights():
+    """Get the dequeue weight of each email lane, keyed by queue name"""
+    return {
+        name: config.get('WEIGHT', 1)
+        for name, config in getattr(settings, 'EMAIL_LANES', {}).items()
+    }
+
+
+class BatchEmailWorker(SimpleWorker):
+    """
+    Worker that dequeues up to ``batch_size`` send_single_message jobs at once
+
+    The messages of the whole batch are delivered through one SMTP connection,
+    then every job is still performed individually so RQ records its own
+    result, status and failure exactly as it would for a regular job.
+
+    Queues are polled in smooth weighted round-robin order using the lane
+    weights from EMAIL_LANES, so a busy lane gets its share of dequeues
+    without starving the others; an empty lane simply yields its turn.
+
+    On a warm shutdown (SIGTERM) the worker claims no new jobs and keeps
+    sending the current batch for up to ``drain_timeout`` seconds. Jobs it
+    has not reached by then, or when it is interrupted, are pushed back to
+    the front of their queue for another worker.
+    """
+
+    def __init__(self, *args, batch_size=None, lane_weights=None, drain_timeout=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_size = batch_size or get_email_batch_size()
+        self.lane_weights = lane_weights if lane_weights is not None else get_lane_weights()
+        self.drain_timeout = drain_timeout if drain_timeout is not None else get_drain_timeout()
+        self._lane_credit = {queue.name: 0 for queue in self.queues}
+        self._stop_requested_at = None
+        self._claim_id = None
+
+    def request_stop(self, signum, frame):
+        self._stop_requested_at = time.monotonic()
+        super().request_stop(signum, frame)
+
+    def drain_expired(self):
+        """True once a stop was requested and the drain budget is spent"""
+        return (
+            self._stop_requested_at is not None
+            and time.monotonic() - self._stop_requested_at >= self.drain_timeout
+        )
+
+    def reorder_queues(self, reference_queue):
+        """Order queues for the next dequeue by accumulated lane credit"""
+        if not self.lane_weights:
+            return super().reorder_queues(reference_queue)
+
+        weights = {queue.name: self.lane_weights.get(queue.name, 1) for queue in self._ordered_queues}
+        total = sum(weights.values())
+
+        # The lane that was just served pays for its turn
+        self._lane_credit[reference_queue.name] = self._lane_credit.get(reference_queue.name, 0) - total
+        for name, weight in weights.items():
+            # Bound the credit so an idle lane cannot bank enough to monopolise the
+            # worker later, and a lone busy lane does not sink into a long debt
+            self._lane_credit[name] = max(-total, min(self._lane_credit.get(name, 0) + weight, total))
+
+        self._ordered_queues = sorted(
+            self._ordered_queues,
+            key=lambda queue: self._lane_credit[queue.name],
+            reverse=True
+        )
+
+    def execute_job(self, job, queue):
+        if self.batch_size <= 1 or job.func_name != BATCHABLE_FUNC_NAME:
+            return super().execute_job(job, queue)
+
+        # Busy for the whole batch: a SIGTERM then only requests a warm stop,
+        # instead of raising StopRequested in the middle of the sends
+        self.set_state(WorkerStatus.BUSY)
+        batch = [job]
+        if self._stop_requested_at is None:
+            batch += self._claim_batch(queue, self.batch_size - 1, self.get_heartbeat_ttl(job))
+        if len(batch) == 1:
+            return super().execute_job(job, queue)
+
+        message_ids = [str(batch_job.args[0]) for batch_job in batch if batch_job.args]
+        logger.info(f"Delivering batch of {len(batch)} messages from queue {queue.name}")
+        try:
+            results = LegacyEmailService.send_legacy_messages_batch(message_ids, should_stop=self.drain_expired)
+        except BaseException:
+            # Cold shutdown mid-batch: statuses of sent messages are already
+            # written, so requeued jobs for them are skipped when they run
+            self._requeue(queue, batch)
+            self.set_state(WorkerStatus.IDLE)
+            raise
+
+        _prefetched_results.update({message_id: ok for message_id, ok in results.items() if ok is not None})
+        # Unattempted jobs go back to the queue only when draining; otherwise
+        # (SMTP breaker open) they run individually and defer to the sweep
+        pending = [
+            batch_job for batch_job in batch
+            if batch_job.args and results.get(str(batch_job.args[0]), False) is None
+        ] if self._stop_requested_at is not None else []
+        remaining = [batch_job for batch_job in batch if batch_job not in pending]
+
+        try:
+            while remaining:
+                self._release_claims(queue, remaining[:1])
+                super().execute_job(remaining[0], queue)
+                remaining.pop(0)
+                # execute_job leaves the worker idle; stay busy until the batch is done
+                self.set_state(WorkerStatus.BUSY)
+        finally:
+            _prefetched_results.clear()
+            # Jobs not run because of an interruption go back with the undrained ones
+            self._requeue(queue, [batch_job for batch_job in batch if batch_job in pending or batch_job in remaining])
+            self.set_state(WorkerStatus.IDLE)
+
+    def _requeue(self, queue, jobs):
+        """Hand claimed jobs back to the front of the queue in their original order"""
+        self._release_claims(queue, jobs)
+        for batch_job in reversed(jobs):
+            queue.push_job_id(batch_job.id, at_front=True)
+        if jobs:
+            logger.info(f"Returned {len(jobs)} unsent jobs to queue {queue.name}")
+
+    def _release_claims(self, queue, jobs):
+        """Drop the StartedJobRegistry entries added by ``_claim_batch``"""
+        claims = [f'{batch_job.id}:{self._claim_id}' for batch_job in jobs]
+        if claims:
+            queue.connection.zrem(queue.started_job_registry.key, *claims)
+
+    def _claim_batch(self, queue, limit, ttl):
+        """
+        Pop up to ``limit`` more batchable jobs from the head of the queue
+
+        Ids are popped and registered as started in one script, and the jobs
+        fetched in one pipeline. The registry entries expire after ``ttl``
+        seconds, so if the worker dies RQ's registry cleanup moves the claimed
+        jobs to the failed registry (or retries them) rather than losing them.
+        Jobs that cannot be batched are pushed back to the front of the queue
+        untouched.
+        """
+        if limit <= 0:
+            return []
+
+        self._claim_id = f'batch-{uuid.uuid4().hex}'
+        job_ids = queue.connection.eval(
+            CLAIM_BATCH_SCRIPT, 2, queue.key, queue.started_job_registry.key,
+            limit, int(time.time()) + ttl, self._claim_id
+        ) or []
+        if not job_ids:
+            return []
+        job_ids = [job_id.decode() if isinstance(job_id, bytes) else job_id for job_id in job_ids]
+
+        claimed = []
+        returned = []
+        jobs = Job.fetch_many(job_ids, connection=queue.connection, serializer=queue.serializer)
+        for job_id, batch_job in zip(job_ids, jobs):
+            if batch_job is None:
+                # Job expired or was deleted while queued
+                queue.connection.zrem(queue.started_job_registry.key, f'{job_id}:{self._claim_id}')
+                continue
+            if batch_job.func_name == BATCHABLE_FUNC_NAME:
+                claimed.append(batch_job)
+            else:
+                returned.append(job_id)
+
+        # Push back in reverse so the original order is kept at the head
+        if returned:
+            queue.connection.zrem(
+                queue.started_job_registry.key, *[f'{job_id}:{self._claim_id}' for job_id in returned]
+            )
+        for job_id in reversed(returned):
+            queue.push_job_id(job_id, at_front=True)
+
+        return claimed